@@ -34,3 +34,54 @@ WIKIDATA_CLIENT_SECRET = ""
 WIKIDATA_OAUTH_SCOPE = ["basic", "editpage"]
 
 BROWSE_CACHE_TTL = timedelta(days=1)
+
+# Number of items per candidate search query in the matcher, 0 for one query per item.
+MATCHER_BATCH_SIZE = 100
+
+# Number of worker processes for the matcher candidate search, 1 to match in process.
+MATCHER_WORKERS = 1
+
+# Geometry saved for each candidate: "full", "simplified" or "centroid_bbox".
+# The full geometry can be loaded later with the load_item_candidate_geom command.
+CANDIDATE_GEOM = "full"
+
+# Maximum number of Overpass chunks to download at the same time, also limited by
+# the free slots reported by the Overpass status endpoint.
+OVERPASS_WORKERS = 4
+
+# Load each Overpass chunk with osm2pgsql as soon as it is downloaded, instead of
+# merging every chunk with osmium and loading the merged file.
+OSM2PGSQL_INCREMENTAL = False
+
+# Load Overpass data with "osm2pgsql" or the in-process "python" loader, which is
+# faster for small places. The python loader skips building indexes on the place
+# tables when there are fewer rows than OSM_LOADER_INDEX_THRESHOLD.
+OSM_LOADER = "osm2pgsql"
+OSM_LOADER_INDEX_THRESHOLD = 10_000
+
+# Keep OSM objects in shared osm_store_* tables, a later run for an area that is
+# already covered by data newer than OSM_STORE_MAX_AGE skips Overpass.
+OSM_STORE = False
+OSM_STORE_MAX_AGE = timedelta(days=1)
+
+# Number of wbgetentities requests to the Wikidata API in flight at the same time.
+# Wikimedia API etiquette asks for requests in series, keep this low.
+WIKIDATA_API_WORKERS = 1
+
+# Set ENTITY_CACHE to True to keep downloaded Wikidata entities in
+# CACHE_DIR/entities.sqlite, a cached entity is used while its lastrevid is current.
+# The cache grows up to ENTITY_CACHE_MAX_BYTES. Entities are compressed with zstd
+# when the zstandard module is installed.
+ENTITY_CACHE = False
+ENTITY_CACHE_MAX_BYTES = 2 * 1024**3
+ENTITY_CACHE_COMPRESS = True
+
+# Wikidata Query Service results are cached in CACHE_DIR/sparql. The time to live
+# of a query family ("browse", "hierarchy", "item_types" or "default") can be
+# changed here, the browse family also follows BROWSE_CACHE_TTL. The least recently
+# used results are removed when the cache grows beyond SPARQL_CACHE_MAX_BYTES.
+SPARQL_CACHE_TTL = {"item_types": timedelta(days=7)}
+SPARQL_CACHE_MAX_BYTES = 1024**3
+
+# Maximum number of Wikidata Query Service chunk queries to run at the same time.
+WIKIDATA_CHUNK_WORKERS = 3
@@ -9,14 +9,18 @@ if not prefix or prefix == '' then
     error('OWL_PLACES_OSM2PGSQL_PREFIX is not set')
 end
 
+-- tag_tokens holds 'key' and 'key=value' for every tag, with values split on
+-- semicolons, so the matcher can filter on tags with an indexed && overlap.
 local common_columns = {
     { column = 'name', type = 'text' },
     { column = 'tags', type = 'hstore' },
+    { column = 'tag_tokens', sql_type = 'text[]' },
 }
 
 local indexes = {
     { column = 'way', method = 'gist' },
     { column = 'tags', method = 'gin' },
+    { column = 'tag_tokens', method = 'gin' },
 }
 
 local points = osm2pgsql.define_table({
@@ -26,6 +30,7 @@ local points = osm2pgsql.define_table({
     columns = {
         common_columns[1],
         common_columns[2],
+        common_columns[3],
         { column = 'way', type = 'point', projection = 3857, not_null = true },
     },
 })
@@ -37,6 +42,7 @@ local lines = osm2pgsql.define_table({
     columns = {
         common_columns[1],
         common_columns[2],
+        common_columns[3],
         {
             column = 'way',
             type = 'linestring',
@@ -53,6 +59,7 @@ local polygons = osm2pgsql.define_table({
     columns = {
         common_columns[1],
         common_columns[2],
+        common_columns[3],
         { column = 'way', type = 'polygon', projection = 3857, not_null = true },
     },
 })
@@ -64,6 +71,7 @@ local relations = osm2pgsql.define_table({
     columns = {
         common_columns[1],
         common_columns[2],
+        common_columns[3],
         { column = 'way', type = 'geometry', projection = 3857, not_null = true },
     },
 })
@@ -100,10 +108,38 @@ local polygon_keys = {
     wetland = true,
 }
 
+-- Same tokens as tag_tokens_sql in matcher/osm_loader.py, as an array literal.
+local function tag_tokens(tags)
+    local tokens = {}
+    local seen = {}
+    local function add(token)
+        if not seen[token] then
+            seen[token] = true
+            tokens[#tokens + 1] = '"' .. token:gsub('[\\"]', '\\%0') .. '"'
+        end
+    end
+    for key, value in pairs(tags) do
+        add(key)
+        if value ~= '' then
+            local start = 1
+            while true do
+                local semicolon = value:find(';', start, true)
+                add(key .. '=' .. value:sub(start, (semicolon or 0) - 1))
+                if not semicolon then
+                    break
+                end
+                start = semicolon + 1
+            end
+        end
+    end
+    return '{' .. table.concat(tokens, ',') .. '}'
+end
+
 local function row(object, geometry)
     return {
         name = object.tags.name,
         tags = object.tags,
+        tag_tokens = tag_tokens(object.tags),
         way = geometry,
     }
 end
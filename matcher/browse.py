@@ -2,9 +2,7 @@
 
 import collections
 import json
-import os
 import typing
-from datetime import datetime
 from time import time
 from typing import Required, TypedDict
 
@@ -15,7 +13,7 @@ from . import (
     commons,
     database,
     nominatim,
-    utils,
+    sparql_cache,
     wikidata,
     wikidata_api,
     wikidata_language,
@@ -332,25 +330,16 @@ class BrowseDetail:
 
     def get_rows_with_cache(self) -> None:
         """Call Wikidata Query service to get next-level rows, cache the results."""
-        cache_path = utils.cache_dir()
-
-        now = datetime.utcnow()
-
-        filename = os.path.join(cache_path, f"{self.qid}_{self.lang}")
-        self.rows = []
-        if os.path.exists(filename):
-            with open(filename) as f:
-                json_data = json.load(f)
-                timestamp = datetime.fromisoformat(json_data["timestamp"])
-                if now - timestamp < flask.current_app.config.get("BROWSE_CACHE_TTL"):
-                    self.rows = json_data["rows"]
-                    return None
+        key = f"{self.qid}_{self.lang}"
+        data = sparql_cache.get("browse", key)
+        if data is not None:
+            self.rows = json.loads(data)
+            return None
 
         self.rows = wikidata.next_level_places(
             self.qid, self.entity, language=self.lang
         )
-        with open(filename, "w") as f:
-            json.dump({"timestamp": now.isoformat(), "rows": self.rows}, f, indent=2)
+        sparql_cache.put("browse", key, json.dumps(self.rows).encode("utf-8"))
 
     def details(self) -> None:
         """Return details for browse page."""
@@ -4,6 +4,7 @@ import re
 import sys
 import unicodedata
 import warnings
+from collections import Counter
 from datetime import datetime, timedelta
 from pprint import pprint
 from time import sleep, time
@@ -23,9 +24,11 @@ from . import (
     database,
     jobs,
     mail,
+    match,
     matcher,
     nominatim,
     osm_api,
+    sparql_cache,
     utils,
     wikidata,
     wikidata_api,
@@ -47,6 +50,7 @@ from .model import (
     LanguageLabel,
     OsmCandidate,
     PageBanner,
+    PlaceItem,
     get_bad,
 )
 from .place import Place
@@ -374,6 +378,81 @@ def place_match(place_identifier, debug):
     place.run_matcher(debug=debug)
 
 
+@app.cli.command()
+@click.option("--pairs", type=int, default=300_000)
+def name_match_benchmark(pairs):
+    """Time name matching over candidate names and item labels in the database.
+
+    The first pass runs with empty name caches and the second pass repeats the
+    same pairs with warm caches, so both numbers are reported.
+    """
+    app.config.from_object("config.default")
+    database.init_app(app)
+
+    q = (
+        database.session.query(ItemCandidate.name, Item.query_label)
+        .join(Item, Item.item_id == ItemCandidate.item_id)
+        .filter(ItemCandidate.name.isnot(None), Item.query_label.isnot(None))
+        .limit(pairs)
+    )
+    name_pairs = q.all()
+    distinct = len({n for pair in name_pairs for n in pair})
+    print(f"{len(name_pairs):,d} pairs, {distinct:,d} distinct names")
+
+    for func in match.tidy_name, match.normalize_name, match.ordinal_number_to_word:
+        func.cache_clear()
+
+    for label in "cold", "warm":
+        t0 = time()
+        for osm, wd in name_pairs:
+            match.name_match(osm, wd)
+        print(f"name_match ({label} cache): {time() - t0:.2f} seconds")
+    print("tidy_name cache:", match.tidy_name.cache_info())
+
+    t0 = time()
+    for pair in name_pairs:
+        for n in pair:
+            match.tidy_name.__wrapped__(n.lower())
+    print(f"tidy_name without cache: {time() - t0:.2f} seconds")
+
+
+@app.cli.command()
+@click.argument("place_identifier")
+@click.option("--workers", type=int, default=4)
+@click.option("--batch-size", type=int, default=100)
+def matcher_benchmark(place_identifier, workers, batch_size):
+    """Time serial and parallel candidate search without saving candidates."""
+    place = get_place(place_identifier)
+    place_items = place.matcher_query().all()
+    print("items:", len(place_items))
+
+    conn = database.session.bind.raw_connection()
+    cur = conn.cursor()
+    matcher.add_tag_tokens(cur, place.prefix)
+    t0 = time()
+    serial = {
+        place_item.item_id: len(candidates)
+        for place_item, candidates in place.iter_candidates(
+            cur, place_items, set(), batch_size, Counter()
+        )
+    }
+    serial_time = time() - t0
+    conn.close()
+    print(f"serial: {serial_time:.1f} seconds")
+
+    t0 = time()
+    parallel = {
+        place_item.item_id: len(candidates)
+        for place_item, candidates in place.iter_candidates_parallel(
+            place_items, set(), workers, batch_size, Counter()
+        )
+    }
+    parallel_time = time() - t0
+    print(f"{workers} workers: {parallel_time:.1f} seconds")
+    print(f"speedup: {serial_time / parallel_time:.2f}x")
+    assert serial == parallel
+
+
 @app.cli.command()
 @click.argument("place_identifier")
 @click.argument("qid")
@@ -544,6 +623,7 @@ def find_item_matches(place_identifier, qid):
     for k, v in item.names().items():
         print((k, v))
     print("NRHP:", item.ref_nrhp())
+    matcher.add_tag_tokens(cur, place.prefix)
     candidates = matcher.find_item_matches(cur, item, place.prefix, debug=True)
     print("candidate count:", len(candidates))
 
@@ -680,15 +760,16 @@ def geojson_chunks():
 @click.argument("place_identifier")
 def place_chunks(place_identifier):
     place = get_place(place_identifier)
+    chunks = place.geojson_chunks()
 
     print(
-        f"{place.chunk_count():3d}  "
+        f"{len(chunks):3d}  "
         + f"{place.area_in_sq_km:>10.0f}  "
         + f"{place.osm_type}/{place.osm_id} "
         + f"{place.display_name}"
     )
 
-    for chunk in place.geojson_chunks():
+    for chunk in chunks:
         print(len(chunk), chunk[:100])
 
 
@@ -901,7 +982,19 @@ def get_isa(qid):
 
 
 @app.cli.command()
-def load_item_candidate_geom():
+@click.argument("place_identifier", required=False)
+@click.option("--full", is_flag=True, help="replace simplified geometry")
+@click.option("--batch-size", type=int, default=1000)
+def load_item_candidate_geom(place_identifier, full, batch_size):
+    """Load candidate geometry from the OSM tables of a place.
+
+    With --full the stored geometry of the candidates in the given place is
+    replaced with the full geometry, for candidates saved with CANDIDATE_GEOM
+    set to simplified or centroid_bbox.
+    """
+    if full and not place_identifier:
+        raise click.UsageError("--full needs a place")
+
     app.config.from_object("config.default")
     database.init_app(app)
     tables = database.get_tables()
@@ -909,15 +1002,21 @@ def load_item_candidate_geom():
     conn = database.session.bind.raw_connection()
     cur = conn.cursor()
 
+    if place_identifier:
+        place = get_place(place_identifier)
+        load_place_candidate_geom(cur, place, tables, full, batch_size)
+        return
+
     q = ItemCandidate.query.filter(ItemCandidate.geom.is_(None))
     total = q.count()
+    expr = matcher.candidate_geom_expr("full")
 
     for num, c in enumerate(q):
         for place in c.item.places:
             table = place.prefix + "_" + c.planet_table
             if table not in tables:
                 continue
-            sql = f"select ST_AsText(ST_Transform(way, 4326)) from {table} where osm_id={c.src_id}"
+            sql = f"select {expr} from {table} where osm_id={c.src_id}"
             cur.execute(sql)
             row = cur.fetchone()
             if row is None:
@@ -934,6 +1033,38 @@ def load_item_candidate_geom():
     database.session.commit()
 
 
+def load_place_candidate_geom(cur, place, tables, full, batch_size):
+    """Load candidate geometry for the items in one place, a batch at a time."""
+    src_types = [
+        t for t in ("point", "line", "polygon") if f"{place.prefix}_{t}" in tables
+    ]
+    q = (
+        ItemCandidate.query.join(PlaceItem, PlaceItem.item_id == ItemCandidate.item_id)
+        .filter(
+            PlaceItem.osm_type == place.osm_type,
+            PlaceItem.osm_id == place.osm_id,
+            ItemCandidate.planet_table.in_(src_types),
+        )
+        .order_by(ItemCandidate.item_id)
+    )
+    if not full:
+        q = q.filter(ItemCandidate.geom.is_(None))
+    candidates = q.all()
+    total = len(candidates)
+
+    for start in range(0, total, batch_size):
+        batch = candidates[start : start + batch_size]
+        rows = [{"planet_table": c.planet_table, "src_id": c.src_id} for c in batch]
+        matcher.load_candidate_geoms(cur, place.prefix, rows, "full")
+        for c, row in zip(batch, rows):
+            geom = row["geom"]
+            if geom is not None and len(geom) <= 40_000:
+                c.geom = geom
+        database.session.commit()
+        done = start + len(batch)
+        print(f"{done}/{total} ({done / total:.2%})")
+
+
 @app.cli.command()
 @click.argument("place_identifier")
 def candidate_shapes(place_identifier):
@@ -1649,3 +1780,99 @@ def now_utc():
     print(func.timezone("utc", func.now()).type)
 
     print(database.now_utc().type)
+
+
+@app.cli.command()
+@click.option("--prune", is_flag=True, help="Remove expired and excess results.")
+@click.option("--max-bytes", type=int, help="Size limit when pruning.")
+def show_sparql_cache(prune, max_bytes):
+    """Show the size of the SPARQL result cache, optionally prune it."""
+    app.config.from_object("config.default")
+
+    if prune:
+        removed = sparql_cache.prune(max_bytes)
+        removed_bytes = sum(entry.size for entry in removed)
+        print(f"removed {len(removed):,d} results, {removed_bytes:,d} bytes")
+
+    now = time()
+    rows = []
+    by_family = {}
+    for entry in sparql_cache.entries():
+        by_family.setdefault(entry.family, []).append(entry)
+    for family, family_entries in sorted(by_family.items()):
+        ttl = sparql_cache.get_ttl(family)
+        expired = sum(
+            now - entry.saved > ttl.total_seconds() for entry in family_entries
+        )
+        size = sum(entry.size for entry in family_entries)
+        rows.append([family, len(family_entries), expired, f"{size:,d}", ttl])
+
+    headers = ["family", "results", "expired", "bytes", "ttl"]
+    print(tabulate(rows, headers=headers))
+
+
+@app.cli.command()
+@click.argument("filename", required=False)
+@click.option("--limit", type=int, default=10_000, help="Items to read categories from.")
+def benchmark_category_tags(filename, limit):
+    """Time categories_to_tags on a category dump, one category per line.
+
+    Without a filename the categories of items in the database are used.
+    """
+    app.config.from_object("config.default")
+
+    if filename:
+        with open(filename) as f:
+            item_categories = [[line.strip()] for line in f if line.strip()]
+    else:
+        database.init_app(app)
+        q = (
+            database.session.query(Item.categories)
+            .filter(Item.categories.isnot(None))
+            .limit(limit)
+        )
+        item_categories = [categories for (categories,) in q]
+
+    cat_map = matcher.build_cat_map()
+    category_count = sum(len(categories) for categories in item_categories)
+    print(f"{len(item_categories):,d} items, {category_count:,d} categories")
+    print(f"{len(cat_map):,d} category keys")
+
+    def regex_per_key(categories):
+        tags = set()
+        for cat in categories:
+            lc_cat = cat.lower()
+            for key, value in cat_map.items():
+                if not matcher.get_pattern(key).search(lc_cat):
+                    continue
+                exclude = value.get("exclude_cats")
+                if exclude and re.search(
+                    r"\b(" + "|".join(re.escape(e) for e in exclude) + r")\b",
+                    lc_cat,
+                    re.I,
+                ):
+                    continue
+                tags |= set(value["tags"])
+        return sorted(tags)
+
+    classifier = matcher.CategoryClassifier(cat_map)
+
+    def classifier_tags(categories):
+        return sorted(set().union(*map(classifier.category_tags, categories)))
+
+    rows = []
+    expect = None
+    for label, classify in [
+        ("regex per key", regex_per_key),
+        ("classifier, cold", classifier_tags),
+        ("classifier, warm", classifier_tags),
+    ]:
+        start = time()
+        found = [classify(categories) for categories in item_categories]
+        seconds = time() - start
+        if expect is None:
+            expect = found
+        assert found == expect
+        rows.append([label, f"{seconds:.3f}", f"{category_count / seconds:,.0f}"])
+
+    print(tabulate(rows, headers=["method", "seconds", "categories/s"]))
@@ -0,0 +1,189 @@
+"""Local cache of Wikidata entities, revalidated with lastrevid.
+
+Entities are stored as compact JSON, compressed with zstd when the zstandard
+module is installed, in a SQLite database in CACHE_DIR. Each entity is kept
+with its lastrevid, a cached copy is used if a cheap prop=info query shows the
+item hasn't been edited since it was downloaded. The least recently used
+entities are evicted once the cache is bigger than ENTITY_CACHE_MAX_BYTES.
+"""
+
+import json
+import os.path
+import sqlite3
+import time
+import typing
+from collections import Counter
+
+import flask
+
+from .utils import chunk
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+EntityDict = dict[str, typing.Any]
+
+default_max_bytes = 2 * 1024**3
+lastrevid_batch_size = 50  # titles per prop=info query
+
+create_table_sql = """
+create table if not exists entity (
+    qid text primary key,
+    lastrevid integer not null,
+    codec text not null,
+    data blob not null,
+    size integer not null,
+    accessed real not null
+)"""
+
+
+def encode(entity: EntityDict, compress: bool) -> tuple[str, bytes]:
+    """Serialise an entity, returns the codec name and the data."""
+    data = json.dumps(entity, separators=(",", ":")).encode("utf-8")
+    if compress and zstandard:
+        return "zstd", zstandard.ZstdCompressor().compress(data)
+    return "json", data
+
+
+def decode(codec: str, data: bytes) -> EntityDict:
+    """Load an entity serialised by encode."""
+    if codec == "zstd":
+        assert zstandard
+        data = zstandard.ZstdDecompressor().decompress(data)
+    entity: EntityDict = json.loads(data)
+    return entity
+
+
+class EntityCache:
+    """Wikidata entities keyed by QID with the lastrevid they were saved at."""
+
+    def __init__(
+        self,
+        filename: str,
+        max_bytes: int = default_max_bytes,
+        compress: bool = True,
+    ) -> None:
+        """Init."""
+        self.conn = sqlite3.connect(filename, timeout=30)
+        self.conn.execute(create_table_sql)
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.stats: Counter[str] = Counter()
+
+    def close(self) -> None:
+        """Close the database."""
+        self.conn.close()
+
+    def lastrevids(self, qids: typing.Iterable[str]) -> dict[str, int]:
+        """Revision IDs of the cached copies of the given entities."""
+        found = {}
+        for batch in chunk(qids, 500):
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"select qid, lastrevid from entity where qid in ({placeholders})",
+                batch,
+            )
+            found.update(rows)
+        return found
+
+    def get_many(self, qids: typing.Iterable[str]) -> dict[str, EntityDict]:
+        """Cached entities without checking if they are current."""
+        found = {}
+        for batch in chunk(qids, 500):
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(
+                f"select qid, codec, data from entity where qid in ({placeholders})",
+                batch,
+            )
+            found.update((qid, decode(codec, data)) for qid, codec, data in rows)
+        if found:
+            now = time.time()
+            self.conn.executemany(
+                "update entity set accessed = ? where qid = ?",
+                [(now, qid) for qid in found],
+            )
+            self.conn.commit()
+        return found
+
+    def put_many(self, entities: typing.Iterable[EntityDict]) -> None:
+        """Save entities, replacing older copies, then evict if over size."""
+        now = time.time()
+        rows = []
+        for entity in entities:
+            if "missing" in entity or "lastrevid" not in entity:
+                continue
+            codec, data = encode(entity, self.compress)
+            qid, lastrevid = entity["id"], entity["lastrevid"]
+            rows.append((qid, lastrevid, codec, data, len(data), now))
+        if not rows:
+            return
+        self.conn.executemany(
+            "insert or replace into entity "
+            "(qid, lastrevid, codec, data, size, accessed) values (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        self.stats["stored"] += len(rows)
+        self.evict()
+        self.conn.commit()
+
+    def evict(self) -> None:
+        """Drop least recently used entities until the cache fits in max_bytes."""
+        sql = "select coalesce(sum(size), 0) from entity"
+        (total,) = self.conn.execute(sql).fetchone()
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes * 0.9  # leave room for the next save
+        rows = self.conn.execute("select qid, size from entity order by accessed")
+        evict = []
+        for qid, size in rows:
+            if excess <= 0:
+                break
+            evict.append((qid,))
+            excess -= size
+        self.conn.executemany("delete from entity where qid = ?", evict)
+        self.stats["evicted"] += len(evict)
+
+    def current(
+        self,
+        qids: typing.Collection[str],
+        get_lastrevids: typing.Callable[[list[str]], dict[str, int]],
+    ) -> dict[str, EntityDict]:
+        """Cached entities that are still the latest revision.
+
+        The lastrevid of every cached entity is checked with get_lastrevids
+        in batches of 50, entities that have been edited are left out.
+        """
+        cached = self.lastrevids(qids)
+        self.stats["miss"] += len(qids) - len(cached)
+        fresh = []
+        for batch in chunk(cached, lastrevid_batch_size):
+            latest = get_lastrevids(list(batch))
+            fresh += [qid for qid in batch if latest.get(qid) == cached[qid]]
+        self.stats["hit"] += len(fresh)
+        self.stats["stale"] += len(cached) - len(fresh)
+        return self.get_many(fresh)
+
+
+def cache_enabled() -> bool:
+    """The entity cache is on, ENTITY_CACHE and CACHE_DIR are set."""
+    if not flask.has_app_context():
+        return False
+    config = flask.current_app.config
+    return bool(config.get("ENTITY_CACHE") and config.get("CACHE_DIR"))
+
+
+def get_entity_cache() -> EntityCache | None:
+    """Entity cache for the app, None if caching is off or there is no app.
+
+    The cache is only used when ENTITY_CACHE is set.
+    """
+    if not cache_enabled():
+        return None
+    config = flask.current_app.config
+    return EntityCache(
+        os.path.join(config["CACHE_DIR"], "entities.sqlite"),
+        max_bytes=config.get("ENTITY_CACHE_MAX_BYTES", default_max_bytes),
+        compress=config.get("ENTITY_CACHE_COMPRESS", True),
+    )
@@ -5,8 +5,16 @@ import json
 import os.path
 import re
 import subprocess
+import threading
 import traceback
 import typing
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
 from datetime import datetime, timedelta, timezone
 from time import sleep, time
 
@@ -16,8 +24,24 @@ import requests.exceptions
 from flask import g
 from sqlalchemy import text
 
-from matcher import database, mail, model, overpass, space_alert, wikidata_api, wikipedia
-from matcher.place import Place, PlaceMatcher, bbox_chunk
+from matcher import (
+    database,
+    mail,
+    model,
+    osm_loader,
+    osm_store,
+    overpass,
+    space_alert,
+    wikidata_api,
+    wikipedia,
+)
+from matcher.place import (
+    BBox,
+    Place,
+    PlaceMatcher,
+    WikidataChunkStat,
+    bbox_chunk,
+)
 from matcher.view import app
 
 re_point = re.compile(r"^Point\(([-E0-9.]+) ([-E0-9.]+)\)$")
@@ -27,7 +51,10 @@ WIKIDATA_ITEMS_MAX_AGE = timedelta(hours=24)  # reuse cached items within this w
 OVERPASS_RETRY_LIMIT = 5
 OVERPASS_RETRY_BASE_SECONDS = 60
 OVERPASS_RETRY_MAX_SECONDS = 300
+OVERPASS_WORKERS = 4  # default limit on concurrent chunk downloads
+OVERPASS_WRITE_BLOCK_SIZE = 1024 * 1024
 WIKIDATA_MAX_CHUNK_SPLIT_DEPTH = 4
+WIKIDATA_CHUNK_WORKERS = 3  # default limit on concurrent chunk queries
 SUBPROCESS_OUTPUT_MAX_CHARS = 6000
 
 
@@ -37,6 +64,17 @@ class Chunk(typing.TypedDict):
     filename: str
     num: int
     oql: str
+    bbox: typing.NotRequired[BBox]
+    tags: typing.NotRequired[list[str]]
+
+
+def chunk_bbox_tags(chunks: list[Chunk]) -> list[osm_store.ChunkTags]:
+    """Bounding box and tags of each chunk with an Overpass query."""
+    return [
+        (chunk["bbox"], chunk.get("tags") or [])
+        for chunk in chunks
+        if chunk.get("oql") and "bbox" in chunk
+    ]
 
 
 def overpass_chunk_filename(chunk: Chunk) -> str:
@@ -45,13 +83,27 @@ def overpass_chunk_filename(chunk: Chunk) -> str:
 
 
 def error_in_overpass_chunk(filename: str) -> bool:
-    """Error present in overpass chunk."""
-    if os.path.getsize(filename) >= 2000:
-        return False
+    """Error present in overpass chunk.
+
+    A large chunk is only checked for a runtime error remark at the end, added
+    by Overpass after partial output.
+    """
+    size = os.path.getsize(filename)
+    if size >= overpass.error_check_bytes:
+        with open(filename, "rb") as f:
+            f.seek(size - overpass.error_check_bytes)
+            return b"<remark> runtime error" in f.read()
     content = open(filename).read()
     return "<remark> runtime error" in content or "<!DOCTYPE html" in content
 
 
+overpass_error_messages = {
+    "runtime_error": "Overpass runtime error",
+    "out_of_memory": "Overpass query ran out of memory",
+    "timeout": "Overpass query timed out",
+}
+
+
 def overpass_response_excerpt(text: str, max_length: int = 300) -> str:
     """Return a compact, readable excerpt from an Overpass error response."""
     text = re.sub(r"<[^>]+>", " ", text)
@@ -165,7 +217,10 @@ class MatcherJob:
         self.place: Place | None = None
         self.log_file = None
         self._notify_conn: psycopg2.extensions.connection | None = None
+        self._send_lock = threading.Lock()  # chunk downloads send from threads
         self.status_callback = status_callback
+        self.loaded_chunks = 0
+        self.wikidata_chunk_stats: list[WikidataChunkStat] = []
 
     def _get_notify_conn(self) -> psycopg2.extensions.connection:
         """Get or create the psycopg2 connection used for NOTIFY."""
@@ -216,22 +271,25 @@ class MatcherJob:
         data["time"] = time() - self.t0
         data["type"] = msg_type
 
-        if self.log_file:
-            print(json.dumps(data), file=self.log_file)
-            self.log_file.flush()
+        with self._send_lock:
+            if self.log_file:
+                print(json.dumps(data), file=self.log_file)
+                self.log_file.flush()
 
-        if self.status_callback:
-            self.status_callback(data)
+            if self.status_callback:
+                self.status_callback(data)
 
-        channel = f"matcher_{self.osm_type}_{self.osm_id}"
-        payload = json.dumps(data)
+            channel = f"matcher_{self.osm_type}_{self.osm_id}"
+            payload = json.dumps(data)
 
-        if len(payload) <= NOTIFY_MAX_BYTES:
-            self._pg_notify(channel, payload)
-        elif msg_type == "pins" and "pins" in data:
-            self._send_chunked_pins(channel, data["pins"], data["time"])
-        else:
-            print(f"WARNING: dropping oversized notify payload for type {msg_type!r}")
+            if len(payload) <= NOTIFY_MAX_BYTES:
+                self._pg_notify(channel, payload)
+            elif msg_type == "pins" and "pins" in data:
+                self._send_chunked_pins(channel, data["pins"], data["time"])
+            else:
+                print(
+                    f"WARNING: dropping oversized notify payload for type {msg_type!r}"
+                )
 
     def status(self, msg: str) -> None:
         """Send a status message."""
@@ -263,7 +321,9 @@ class MatcherJob:
         gis_tables = self.place.gis_tables
         for t in gis_tables & set(database.get_tables()):
             database.session.execute(text(f"drop table if exists {t}"))
-        database.session.commit()
+        for t in gis_tables:  # views on the shared OSM store
+            database.session.execute(text(f"drop view if exists {t}"))
+        self.drop_middle_tables()
         assert not self.place.gis_tables & set(database.get_tables())
 
     def prepare_for_refresh(self, is_refresh: bool = False) -> None:
@@ -304,22 +364,6 @@ class MatcherJob:
         mail.send_mail("Overpass error", remark.text)
         return True
 
-    @staticmethod
-    def overpass_response_error(r: requests.models.Response) -> str | None:
-        """Classify an Overpass response body that contains an error page."""
-        content = r.text
-        if "<!DOCTYPE html" in content:
-            if "too busy" in content:
-                return "too_busy"
-            if "runtime error" in content:
-                return "runtime_error"
-            return "server_error"
-        if len(r.content) >= 2000:
-            return None
-        if "<remark> runtime error" in content:
-            return "runtime_error"
-        return None
-
     def retry_delay(self, attempt: int) -> int:
         """Return Overpass retry delay for a 1-based attempt number."""
         return min(
@@ -352,29 +396,48 @@ class MatcherJob:
             max_attempts=max_attempts,
         )
 
-    def fetch_overpass_chunk(self, oql: str) -> requests.models.Response | None:
-        """Fetch an Overpass chunk, retrying transient busy/rate-limit responses."""
+    def fetch_overpass_chunk(self, oql: str, filename: str) -> bool:
+        """Fetch an Overpass chunk, retrying transient busy/rate-limit responses.
+
+        The reply is streamed to filename, so a large chunk isn't held in memory.
+        """
         attempt = 1
         while attempt <= OVERPASS_RETRY_LIMIT:
             try:
-                r = overpass.run_query(oql)
+                r = overpass.run_query(oql, stream=True)
+                ends = overpass.save_response(
+                    r, filename, block_size=OVERPASS_WRITE_BLOCK_SIZE
+                )
             except overpass.RateLimited:
                 if not self.wait_for_slot():
-                    return None
+                    return False
                 continue
             except requests.exceptions.RequestException as e:
                 self.error(
                     f"Can't access Overpass API query endpoint: {e}",
                     stage="overpass",
                 )
-                return None
-
-            error_kind = self.overpass_response_error(r)
-            if error_kind != "too_busy":
-                return r
+                return False
+
+            error = overpass.response_error(ends)
+            if error in overpass_error_messages:
+                # a partial reply ending in an error would load truncated data
+                os.remove(filename)
+                text = (ends.head + ends.tail).decode("utf-8", errors="replace")
+                remark = re.search(r"<remark>(.*?)</remark>", text, re.S)
+                msg = overpass_error_messages[error]
+                if remark:
+                    msg += ": " + remark.group(1).strip()
+                self.error("overpass: " + msg, stage="overpass")
+                mail.send_mail("Overpass error", msg)
+                return False
+
+            # other errors are reported by overpass_chunk_error
+            if error != "too_busy":
+                return True
 
             if attempt == OVERPASS_RETRY_LIMIT:
-                return r
+                return True
 
             delay = self.overpass_status_wait_seconds() or self.retry_delay(attempt)
             self.status(
@@ -391,7 +454,7 @@ class MatcherJob:
             sleep(delay)
             attempt += 1
 
-        return None
+        return False
 
     def wait_for_slot(self) -> bool:
         """Wait for an Overpass API slot. Returns False if Overpass is unavailable."""
@@ -430,27 +493,78 @@ class MatcherJob:
         sleep(secs)
         return True
 
-    def overpass_request(self, chunks: list[Chunk]) -> bool:
-        """Download overpass data for all chunks."""
+    def overpass_worker_count(self, pending: int) -> int:
+        """Number of chunks to download at the same time.
+
+        Limited by OVERPASS_WORKERS and the free slots reported by Overpass.
+        """
+        limit = app.config.get("OVERPASS_WORKERS") or OVERPASS_WORKERS
+        try:
+            slots = overpass.free_slots(overpass.get_status())
+        except (overpass.OverpassError, requests.exceptions.RequestException):
+            slots = 1  # wait_for_slot reports the problem
+        if slots is not None:
+            limit = min(limit, max(slots, 1))
+        return max(1, min(limit, pending))
+
+    def download_overpass_chunk(self, num: int, chunk: Chunk) -> bool:
+        """Download a single chunk, called from a download thread."""
+        with app.app_context():
+            if not self.wait_for_slot():
+                return False
+            self.send("get_chunk", chunk_num=num)
+            return self.fetch_overpass_chunk(
+                chunk["oql"], overpass_chunk_filename(chunk)
+            )
+
+    def overpass_request(
+        self,
+        chunks: list[Chunk],
+        on_chunk: typing.Callable[[Chunk], None] | None = None,
+    ) -> bool:
+        """Download overpass data for all chunks.
+
+        Chunks are downloaded concurrently, using the free Overpass slots.
+        The on_chunk callback is called in this thread as each chunk lands.
+        """
         assert self.place
 
+        existing = []
+        pending = []
         for num, chunk in enumerate(chunks):
-            oql = chunk.get("oql")
-            if not oql:
+            if not chunk.get("oql"):
                 continue
-            filename = overpass_chunk_filename(chunk)
-            if not os.path.exists(filename):
-                space_alert.check_free_space(app.config)
-                if not self.wait_for_slot():
-                    return False
-                self.send("get_chunk", chunk_num=num)
-                r = self.fetch_overpass_chunk(oql)
-                if r is None:
-                    return False
-                with open(filename, "wb") as out:
-                    out.write(r.content)
-                space_alert.check_free_space(app.config)
-            self.send("chunk_done", chunk_num=num)
+            if os.path.exists(overpass_chunk_filename(chunk)):
+                existing.append((num, chunk))
+            else:
+                pending.append((num, chunk))
+
+        if pending:
+            space_alert.check_free_space(app.config)
+        workers = self.overpass_worker_count(len(pending)) if pending else 1
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(self.download_overpass_chunk, num, chunk): (num, chunk)
+                for num, chunk in pending
+            }
+            try:
+                for num, chunk in existing:
+                    self.send("chunk_done", chunk_num=num)
+                    if on_chunk:
+                        on_chunk(chunk)
+
+                for future in as_completed(futures):
+                    if not future.result():
+                        executor.shutdown(cancel_futures=True)
+                        return False
+                    space_alert.check_free_space(app.config)
+                    num, chunk = futures[future]
+                    self.send("chunk_done", chunk_num=num)
+                    if on_chunk:
+                        on_chunk(chunk)
+            except BaseException:
+                executor.shutdown(cancel_futures=True)
+                raise
 
         self.send("overpass_done")
         return True
@@ -476,27 +590,95 @@ class MatcherJob:
         chunk_size = 96 if self.want_isa else None
         skip = {"building", "building=yes"} if self.want_isa else set()
 
-        if place.osm_type == "node":
-            oql = place.get_oql()
-            chunks = [{"filename": f"{place.place_id}.xml", "num": 0, "oql": oql}]
+        chunks = self.get_chunks(chunk_size, skip)
+        use_store = bool(app.config.get("OSM_STORE")) and place.osm_type != "node"
+        if use_store and self.use_osm_store(chunks):
+            self.status("using OSM data from the shared store")
+            self.send("overpass_done")
         else:
-            chunks = place.get_chunks(chunk_size=chunk_size, skip=skip)
-            self.report_empty_chunks(chunks)
-
-        overpass_good = self.overpass_request(chunks)
-        if not overpass_good:
-            raise MatcherJobFailed("Overpass API unavailable")
-        if any(self.overpass_chunk_error(chunk) for chunk in chunks):
-            raise MatcherJobFailed("Overpass returned an error response")
+            self.download_osm_data(chunks)
+            if use_store:
+                self.save_to_osm_store(chunks)
 
-        if len(chunks) > 1:
-            self.merge_chunks(chunks)
-
-        self.run_osm2pgsql()
         self.load_isa()
         self.run_matcher()
         self.place.clean_up()
 
+    def get_chunks(self, chunk_size: int | None, skip: set[str]) -> list[Chunk]:
+        """Plan the Overpass chunks for the place."""
+        assert self.place
+        place = self.place
+
+        if place.osm_type == "node":
+            oql = place.get_oql()
+            return [{"filename": f"{place.place_id}.xml", "num": 0, "oql": oql}]
+        chunks: list[Chunk] = place.get_chunks(chunk_size=chunk_size, skip=skip)
+        self.report_empty_chunks(chunks)
+        return chunks
+
+    def download_osm_data(self, chunks: list[Chunk]) -> None:
+        """Download OSM data from Overpass and load it into the place tables."""
+        loader = app.config.get("OSM_LOADER") or "osm2pgsql"
+        # load each chunk with osm2pgsql as it arrives, instead of merging
+        incremental = (
+            loader == "osm2pgsql"
+            and len(chunks) > 1
+            and bool(app.config.get("OSM2PGSQL_INCREMENTAL"))
+        )
+        self.loaded_chunks = 0
+
+        on_chunk = self.load_chunk if incremental else None
+        try:
+            overpass_good = self.overpass_request(chunks, on_chunk=on_chunk)
+            if not overpass_good:
+                raise MatcherJobFailed("Overpass API unavailable")
+            if any(self.overpass_chunk_error(chunk) for chunk in chunks):
+                raise MatcherJobFailed("Overpass returned an error response")
+
+            if loader == "python":
+                self.load_osm_data(chunks)
+            elif incremental:
+                self.finish_incremental_load()
+            else:
+                if len(chunks) > 1:
+                    self.merge_chunks(chunks)
+                self.run_osm2pgsql()
+        except BaseException:
+            if loader == "osm2pgsql":  # a failed run leaves the slim tables behind
+                self.drop_middle_tables()
+            raise
+
+    def use_osm_store(self, chunks: list[Chunk]) -> bool:
+        """Use the shared OSM store if it has fresh data covering every chunk."""
+        assert self.place
+        max_age = app.config.get("OSM_STORE_MAX_AGE") or osm_store.default_max_age
+        store_chunks = chunk_bbox_tags(chunks)
+        conn = database.session.bind.raw_connection()
+        try:
+            cur = conn.cursor()
+            place_id = self.place.place_id
+            covered = osm_store.is_covered(cur, place_id, store_chunks, max_age)
+            if covered:
+                bboxes = [bbox for bbox, _ in store_chunks]
+                osm_store.create_place_views(cur, self.place.prefix, bboxes)
+            conn.commit()
+        finally:
+            conn.close()
+        return covered
+
+    def save_to_osm_store(self, chunks: list[Chunk]) -> None:
+        """Save the OSM objects loaded for this place in the shared store."""
+        assert self.place
+        store_chunks = chunk_bbox_tags(chunks)
+        conn = database.session.bind.raw_connection()
+        try:
+            cur = conn.cursor()
+            place_id = self.place.place_id
+            osm_store.save_place(cur, self.place.prefix, place_id, store_chunks)
+            conn.commit()
+        finally:
+            conn.close()
+
     def run_in_app_context(self) -> None:
         """Run the full matcher pipeline."""
         self.place = Place.get_by_osm(self.osm_type, self.osm_id)
@@ -559,61 +741,123 @@ class MatcherJob:
             return False
         return self.place.items.count() > 0
 
-    def handle_rate_limited(self, exc: wikidata_api.QueryRateLimited) -> None:
-        """Handle a 429 rate-limit response from the Wikidata Query Service."""
+    def report_rate_limited(self, exc: wikidata_api.QueryRateLimited) -> None:
+        """Report a 429 rate-limit response from the Wikidata Query Service."""
         retry_after = exc.retry_after
         msg = f"Wikidata rate limited, waiting {retry_after} seconds before retrying"
         print(msg)
         self.status(msg)
-        sleep(retry_after)
+
+    def handle_rate_limited(self, exc: wikidata_api.QueryRateLimited) -> None:
+        """Handle a 429 rate-limit response from the Wikidata Query Service."""
+        self.report_rate_limited(exc)
+        sleep(exc.retry_after)
+
+    def wikidata_chunk_worker_count(self) -> int:
+        """Number of Wikidata chunk queries to run at the same time."""
+        workers: int = (
+            app.config.get("WIKIDATA_CHUNK_WORKERS") or WIKIDATA_CHUNK_WORKERS
+        )
+        return max(1, workers)
+
+    def query_wikidata_chunk(self, bbox: BBox) -> dict[str, typing.Any]:
+        """Query Wikidata for one chunk, recording the result size and time.
+
+        Called from a worker thread.
+        """
+        assert self.place
+        t0 = time()
+        try:
+            items = self.place.query_bbox_items(bbox, want_isa=self.want_isa)
+        except wikidata_api.QueryTimeout:
+            stat = WikidataChunkStat(bbox, None, time() - t0, True)
+            self.wikidata_chunk_stats.append(stat)
+            raise
+        stat = WikidataChunkStat(bbox, len(items), time() - t0, False)
+        self.wikidata_chunk_stats.append(stat)
+        return items
 
     def wikidata_chunked(self, chunks):
+        """Query Wikidata for items in each chunk of the place bounding box.
+
+        A few chunk queries run at the same time. A chunk that times out is
+        split in four and the parts go back on the queue, a rate limited chunk
+        goes back on the queue and no new queries start until the Retry-After
+        delay has passed.
+        """
         assert self.place
+        place = self.place
         items = {}
         num = 0
-        chunks_with_depth = [(bbox, 0) for bbox in chunks]
-        while chunks_with_depth:
-            bbox, split_depth = chunks_with_depth.pop()
-            num += 1
-            self.send(
-                "wikidata_chunk",
-                chunk_num=num,
-                chunk=bbox_geojson_feature(bbox, num),
-            )
-            msg = f"requesting wikidata chunk {num}"
-            print(msg)
-            self.status(msg)
-            try:
-                items.update(
-                    self.place.bbox_wikidata_items(bbox, want_isa=self.want_isa)
-                )
-                self.send("wikidata_chunk_done", chunk_num=num)
-            except wikidata_api.QueryTimeout as e:
-                if split_depth >= WIKIDATA_MAX_CHUNK_SPLIT_DEPTH:
-                    raise wikidata_api.QueryServiceUnavailable(
-                        e.query, e.r
-                    ) from e
-                msg = f"wikidata timeout, splitting chunk {num} into four"
-                print(msg)
-                self.status(msg)
-                split_chunks = bbox_chunk(bbox, 2)
-                self.send(
-                    "wikidata_chunk_split",
-                    chunk_num=num,
-                    chunks=[
-                        bbox_geojson_feature(split_bbox, num)
-                        for split_bbox in split_chunks
-                    ],
-                )
-                chunks_with_depth += [
-                    (split_bbox, split_depth + 1) for split_bbox in split_chunks
-                ]
-            except wikidata_api.QueryRateLimited as e:
-                chunks_with_depth.append(
-                    (bbox, split_depth)
-                )  # put back to retry after waiting
-                num -= 1
-                self.handle_rate_limited(e)
+        # (bbox, split depth, chunk number), the number is kept when retrying
+        queue: list[tuple[BBox, int, int | None]] = [
+            (bbox, 0, None) for bbox in chunks
+        ]
+        running: dict[Future, tuple[BBox, int, int]] = {}
+        resume_at = 0.0
+        workers = self.wikidata_chunk_worker_count()
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            while queue or running:
+                while queue and len(running) < workers and time() >= resume_at:
+                    bbox, split_depth, chunk_num = queue.pop()
+                    if chunk_num is None:
+                        num += 1
+                        chunk_num = num
+                    self.send(
+                        "wikidata_chunk",
+                        chunk_num=chunk_num,
+                        chunk=bbox_geojson_feature(bbox, chunk_num),
+                    )
+                    msg = f"requesting wikidata chunk {chunk_num}"
+                    print(msg)
+                    self.status(msg)
+                    future = executor.submit(self.query_wikidata_chunk, bbox)
+                    running[future] = (bbox, split_depth, chunk_num)
+
+                if not running:  # every query is waiting for the rate limit
+                    sleep(max(0, resume_at - time()))
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    bbox, split_depth, chunk_num = running.pop(future)
+                    try:
+                        chunk_items = future.result()
+                    except wikidata_api.QueryTimeout as e:
+                        if split_depth >= WIKIDATA_MAX_CHUNK_SPLIT_DEPTH:
+                            raise wikidata_api.QueryServiceUnavailable(
+                                e.query, e.r
+                            ) from e
+                        msg = (
+                            f"wikidata timeout, splitting chunk {chunk_num} into four"
+                        )
+                        print(msg)
+                        self.status(msg)
+                        split_chunks = bbox_chunk(bbox, 2)
+                        self.send(
+                            "wikidata_chunk_split",
+                            chunk_num=chunk_num,
+                            chunks=[
+                                bbox_geojson_feature(split_bbox, chunk_num)
+                                for split_bbox in split_chunks
+                            ],
+                        )
+                        queue += [
+                            (split_bbox, split_depth + 1, None)
+                            for split_bbox in split_chunks
+                        ]
+                    except wikidata_api.QueryRateLimited as e:
+                        # put back to retry after waiting
+                        queue.append((bbox, split_depth, chunk_num))
+                        if time() + e.retry_after > resume_at:
+                            resume_at = time() + e.retry_after
+                            self.report_rate_limited(e)
+                    else:
+                        items.update(place.filter_bbox_items(chunk_items))
+                        self.send("wikidata_chunk_done", chunk_num=chunk_num)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
 
         return items
 
@@ -644,18 +888,27 @@ class MatcherJob:
     def get_items_bbox(self):
         assert self.place
         place = self.place
-        if self.want_isa:
-            size = 220
-        else:
-            size = 22
-        chunk_size = place.wikidata_chunk_size(size=size)
+        want_isa = bool(self.want_isa)
+        density = place.wikidata_density(want_isa)
+        size = place.wikidata_chunk_side(220 if want_isa else 22, density)
+        chunk_size = place.wikidata_chunk_size(size=size, density=density)
+        self.wikidata_chunk_stats = []
         if chunk_size == 1:
             print("wikidata unchunked")
             while True:
+                t0 = time()
                 try:
                     wikidata_items = place.bbox_wikidata_items(want_isa=self.want_isa)
+                    self.wikidata_chunk_stats.append(
+                        WikidataChunkStat(
+                            place.bbox, len(wikidata_items), time() - t0, False
+                        )
+                    )
                     break
                 except wikidata_api.QueryTimeout:
+                    self.wikidata_chunk_stats.append(
+                        WikidataChunkStat(place.bbox, None, time() - t0, True)
+                    )
                     place.wikidata_query_timeout = True
                     database.session.commit()
                     chunk_size = 2
@@ -671,6 +924,7 @@ class MatcherJob:
             self.status(msg)
             wikidata_items = self.wikidata_chunked(chunks)
 
+        place.save_wikidata_chunk_stats(self.wikidata_chunk_stats, want_isa)
         return wikidata_items
 
     def get_item_detail(self, db_items):
@@ -734,15 +988,77 @@ class MatcherJob:
         if msg:
             self.status(msg)
 
+    def load_chunk(self, chunk: Chunk) -> None:
+        """Load a single Overpass chunk into the place tables.
+
+        The first chunk creates the tables, later chunks are appended. Objects
+        that appear in more than one chunk are replaced rather than duplicated.
+        """
+        assert self.place
+        if self.overpass_chunk_error(chunk):
+            raise MatcherJobFailed("Overpass returned an error response")
+
+        append = self.loaded_chunks > 0
+        cmd = self.place.osm2pgsql_cmd(
+            overpass_chunk_filename(chunk), append=append, keep_middle=True
+        )
+        self.status(f"running osm2pgsql for chunk {chunk['num']}")
+        self.exec_osm2pgsql(cmd)
+        self.loaded_chunks += 1
+
+    def drop_middle_tables(self) -> None:
+        """Drop the osm2pgsql slim tables kept for an incremental load."""
+        assert self.place
+        for t in self.place.osm2pgsql_middle_tables:
+            database.session.execute(text(f"drop table if exists {t}"))
+        database.session.commit()
+
+    def finish_incremental_load(self) -> None:
+        """Drop the osm2pgsql slim tables once every chunk is loaded."""
+        self.drop_middle_tables()
+        print("osm2pgsql done")
+        self.status("osm2pgsql done")
+
+    def load_osm_data(self, chunks: list[Chunk]) -> None:
+        """Load the chunks with the in-process loader instead of osm2pgsql.
+
+        Every chunk is read directly, so there is no need to merge them first.
+        """
+        assert self.place
+        self.status("loading OSM data")
+        filenames = [
+            overpass_chunk_filename(chunk) for chunk in chunks if chunk.get("oql")
+        ]
+        threshold = app.config.get("OSM_LOADER_INDEX_THRESHOLD")
+        conn = database.session.bind.raw_connection()
+        try:
+            counts = osm_loader.load(
+                conn,
+                self.place.prefix,
+                filenames,
+                index_threshold=threshold or osm_loader.index_threshold,
+            )
+        finally:
+            conn.close()
+        detail = ", ".join(f"{count:,d} {table}" for table, count in counts.items())
+        self.status(f"OSM data loaded: {detail}")
+
     def run_osm2pgsql(self) -> None:
         """Run osm2pgsql."""
         assert self.place
         self.status("running osm2pgsql")
+        self.exec_osm2pgsql(self.place.osm2pgsql_cmd())
+        print("osm2pgsql done")
+        self.status("osm2pgsql done")
+
+    def exec_osm2pgsql(self, cmd: list[str]) -> None:
+        """Run an osm2pgsql command, report failure to the user."""
+        assert self.place
         env = os.environ.copy()
         env["PGPASSWORD"] = app.config["DB_PASS"]
         env["OWL_PLACES_OSM2PGSQL_PREFIX"] = self.place.prefix
         result = subprocess.run(
-            self.place.osm2pgsql_cmd(),
+            cmd,
             env=env,
             encoding="utf-8",
             errors="replace",
@@ -758,8 +1074,6 @@ class MatcherJob:
             raise MatcherJobFailed(
                 f"osm2pgsql failed (exit status {result.returncode})"
             )
-        print("osm2pgsql done")
-        self.status("osm2pgsql done")
 
     def load_isa(self) -> None:
         """Load IsA data."""
@@ -789,4 +1103,5 @@ class MatcherJob:
             self.item_line(msg)
             self.send("matching_progress", num=checked, total=total)
 
-        self.place.run_matcher(progress=progress, want_isa=self.want_isa)
+        query_count = self.place.run_matcher(progress=progress, want_isa=self.want_isa)
+        self.status(f"candidate search used {query_count:,d} database queries")
@@ -14,7 +14,6 @@ from .place import Place, PlaceMatcher
 StrDict = dict[str, typing.Any]
 
 MATCHER_TASK_NAME = "matcher.run_matcher"
-MATCHER_SUBSCRIBER_PREFIX = "owl_places_matcher_"
 
 _ACTIVE_JOBS_SQL = text("""
     SELECT j.id,
@@ -23,15 +22,19 @@ _ACTIVE_JOBS_SQL = text("""
            j.abort_requested,
            j.worker_id,
            (
+               -- each notify_hub subscription holds a shared advisory lock
                SELECT count(*)
-               FROM pg_stat_activity a
-               WHERE a.datname = current_database()
-                 AND a.application_name = concat(
-                     'owl_places_matcher_',
-                     j.args->>'osm_type',
-                     '_',
-                     j.args->>'osm_id'
+               FROM pg_locks l
+               WHERE l.locktype = 'advisory'
+                 AND l.objsubid = 2
+                 AND l.database = (
+                     SELECT oid FROM pg_database WHERE datname = current_database()
                  )
+                 AND l.classid = (
+                     hashtext(concat(
+                         'matcher_', j.args->>'osm_type', '_', j.args->>'osm_id'
+                     ))::bigint & 4294967295
+                 )::oid
            ) AS subscribers,
            e.at AS created_at
     FROM procrastinate_jobs j
@@ -214,9 +217,9 @@ def _running_job_progress(place: Place, created_at: datetime) -> StrDict:
                 )
             elif message_type == "msg" and message.get("msg"):
                 detail = message["msg"]
-                if "running osm2pgsql" in detail:
+                if "running osm2pgsql" in detail or "loading OSM data" in detail:
                     stage = "Import OSM data"
-                elif "osm2pgsql done" in detail:
+                elif "osm2pgsql done" in detail or "OSM data loaded" in detail:
                     stage = "Find matches"
             elif message_type == "error" and message.get("msg"):
                 detail = message["msg"]
@@ -311,9 +314,28 @@ def get_queue_status(osm_type: str, osm_id: int) -> StrDict | None:
     return None
 
 
-def subscriber_application_name(osm_type: str, osm_id: int) -> str:
-    """Return the PostgreSQL application name used by matcher subscribers."""
-    return f"{MATCHER_SUBSCRIBER_PREFIX}{osm_type}_{osm_id}"
+def get_queue_snapshot() -> list[StrDict]:
+    """Return active matcher jobs in queue order, without the details of get_jobs.
+
+    Used to refresh the queue status shared by the matcher websockets.
+    """
+    rows = database.session.execute(
+        _ACTIVE_JOBS_SQL,
+        {"task_name": MATCHER_TASK_NAME, "include_orphaned": False},
+    ).fetchall()
+    return [
+        {
+            "osm_type": row.args.get("osm_type"),
+            "osm_id": row.args.get("osm_id"),
+            "status": row.status,
+        }
+        for row in rows
+    ]
+
+
+def matcher_channel(osm_type: str, osm_id: int) -> str:
+    """Return the NOTIFY channel for matcher progress messages about a place."""
+    return f"matcher_{osm_type}_{osm_id}"
 
 
 def stop_job(place: Place) -> int:
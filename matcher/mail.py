@@ -74,9 +74,16 @@ def get_area(place: Place) -> str:
 
 
 def error_mail(
-    subject: str, data: typing.Any, r: requests.models.Response, via_web: bool = True
+    subject: str,
+    data: typing.Any,
+    r: requests.models.Response,
+    via_web: bool = True,
+    reply: str | None = None,
 ) -> None:
-    """Send error mail."""
+    """Send error mail.
+
+    Pass the reply for a streamed response, its body has already been read.
+    """
     body = f"""
 remote URL: {r.url}
 status code: {r.status_code}
@@ -88,7 +95,7 @@ status code: {r.status_code}
 content-type: {r.headers["content-type"]}
 
 reply:
-{r.text}
+{r.text if reply is None else reply}
 """
 
     if has_request_context():
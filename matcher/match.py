@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 
 import collections
+import functools
 import re
 import typing
 from collections import defaultdict
@@ -100,75 +101,83 @@ class NameMatch(object):
         self.osm_key: str | None = None
 
 
+tidy_name_replacements: list[tuple[str, str]] = [
+    (" no. ", " number "),
+    (" nr ", " number "),
+    (" hosp ", " hospital "),
+    (" rgnl ", " regional "),
+    ("saint ", "st "),
+    ("mount ", "mt "),
+    (" mountain", " mtn"),
+    (" county", " co"),
+    (" church of england ", " ce "),
+    (" cofe ", " ce "),
+    (" c of e ", " ce "),
+    (" @ ", " at "),
+    (" roman catholic ", " rc "),
+    (" catholic ", " rc "),
+    (" helena", " helen"),
+    (" laurence", " lawrence"),
+    (" holy ascension", "ascension"),
+    (" most holy trinity", "holy trinity"),
+    (" nicolas", " nicholas"),
+    (" anne", " ann"),
+    (" ethelreda", " etheldreda"),
+    (" mary magdalene", " mary magdalen"),
+    (" mary magdelene", " mary magdalen"),
+    (" mary the virgin", " mary"),
+    (" blessed virgin mary", " st mary"),
+    (" nativity of the blessed virgin mary", " st mary"),
+    (" margaret the queen", " margaret"),
+    (" john the baptist", " john"),
+    (" john the evangelist", " john"),
+    (" john, the evangelist", " john"),
+    (" john, apostle and evangelist", " john"),
+    (" john the divine", " john"),
+    (" michael the archangel", " michael"),
+    (" luke the evangelist,", " luke"),
+    (" giles the abbot", " giles"),
+    (" andrew the apostle", " andrew"),
+    (" peter the apostle", " peter"),
+    (" thomas the apostle", " thomas"),
+    (" lawrence the martyr", " lawrence"),
+    (" alban the martyr", " alban"),
+    (" egelwin the martyr", " egelwin"),
+    (" nicholas the confessor", " nicholas"),
+    (" edward the confessor", " edward"),
+    (" edward the martyr", " edward"),
+    (" edmund king and martyr", " edmund"),
+    (" gregory the great", " gregory"),
+    (" james the great", " james"),
+    (" james the less", " james"),
+    (" james the apostle", " james"),
+    (" bartholemew", " bartholomew"),
+    (" preparatory school", " prep school"),
+    (" incorporated", " inc"),
+    (" cooperative", " coop"),
+    (" co-operative", " coop"),
+    (" hotel and country club", " hotel"),
+    (" hotel and spa", " hotel"),
+    (" missionary baptist", " baptist"),
+    (" thomas a becket", " thomas becket"),
+    (" thomas of canterbury", " thomas becket"),
+]
+
+re_plural = re.compile(r"(?<=.)e?s+\b")
+
+
+@functools.lru_cache(maxsize=65536)
 def tidy_name(n: str) -> str:
     """Normalise the given name."""
     # expects to be passed a name in lowercase
     n = unidecode(n).strip().rstrip("'")
-    n = n.replace(" no. ", " number ")
-    n = n.replace(" nr ", " number ")
-    n = n.replace(" hosp ", " hospital ")
-    n = n.replace(" rgnl ", " regional ")
-    n = n.replace("saint ", "st ")
-    n = n.replace("mount ", "mt ")
-    n = n.replace(" mountain", " mtn")
-    n = n.replace(" county", " co")
-    n = n.replace(" church of england ", " ce ")
-    n = n.replace(" cofe ", " ce ")
-    n = n.replace(" c of e ", " ce ")
-    n = n.replace(" @ ", " at ")
-    n = n.replace(" roman catholic ", " rc ")
-    n = n.replace(" catholic ", " rc ")
-    n = n.replace(" helena", " helen")
-    n = n.replace(" laurence", " lawrence")
-    n = n.replace(" holy ascension", "ascension")
-    n = n.replace(" most holy trinity", "holy trinity")
-    n = n.replace(" nicolas", " nicholas")
-    n = n.replace(" anne", " ann")
-    n = n.replace(" ethelreda", " etheldreda")
-    n = n.replace(" mary magdalene", " mary magdalen")
-    n = n.replace(" mary magdelene", " mary magdalen")
-    n = n.replace(" mary the virgin", " mary")
-    n = n.replace(" blessed virgin mary", " st mary")
-    n = n.replace(" nativity of the blessed virgin mary", " st mary")
-    n = n.replace(" margaret the queen", " margaret")
-    n = n.replace(" john the baptist", " john")
-    n = n.replace(" john the evangelist", " john")
-    n = n.replace(" john, the evangelist", " john")
-    n = n.replace(" john, apostle and evangelist", " john")
-    n = n.replace(" john the divine", " john")
-    n = n.replace(" michael the archangel", " michael")
-    n = n.replace(" luke the evangelist,", " luke")
-    n = n.replace(" giles the abbot", " giles")
-    n = n.replace(" andrew the apostle", " andrew")
-    n = n.replace(" peter the apostle", " peter")
-    n = n.replace(" thomas the apostle", " thomas")
-    n = n.replace(" lawrence the martyr", " lawrence")
-    n = n.replace(" alban the martyr", " alban")
-    n = n.replace(" egelwin the martyr", " egelwin")
-    n = n.replace(" nicholas the confessor", " nicholas")
-    n = n.replace(" edward the confessor", " edward")
-    n = n.replace(" edward the martyr", " edward")
-    n = n.replace(" edmund king and martyr", " edmund")
-    n = n.replace(" gregory the great", " gregory")
-    n = n.replace(" james the great", " james")
-    n = n.replace(" james the less", " james")
-    n = n.replace(" james the apostle", " james")
-    n = n.replace(" bartholemew", " bartholomew")
-    n = n.replace(" preparatory school", " prep school")
-    n = n.replace(" incorporated", " inc")
-    n = n.replace(" cooperative", " coop")
-    n = n.replace(" co-operative", " coop")
-    n = n.replace(" hotel and country club", " hotel")
-    n = n.replace(" hotel and spa", " hotel")
-    n = n.replace(" missionary baptist", " baptist")
-    n = n.replace(" thomas a becket", " thomas becket")
-    n = n.replace(" thomas of canterbury", " thomas becket")
+    for old, new in tidy_name_replacements:
+        n = n.replace(old, new)
 
     if n.endswith("'s"):
         n = n[:-2]
 
     if any(c.isalpha() and c != "s" for c in n):
-        re_plural = re.compile(r"(?<=.)e?s+\b")
         n = re_plural.sub("", n)
 
     n = n.replace("ss", "s")
@@ -730,6 +739,7 @@ def name_match(
     return None
 
 
+@functools.lru_cache(maxsize=65536)
 def ordinal_number_to_word(name: str) -> str:
     """Convert ordinal numbers to words."""
     ret = re_ordinal_number.sub(
@@ -738,6 +748,7 @@ def ordinal_number_to_word(name: str) -> str:
     return ret
 
 
+@functools.lru_cache(maxsize=65536)
 def normalize_name(name: str) -> str:
     """Normalize name."""
     name = ordinal_number_to_word(name)
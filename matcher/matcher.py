@@ -1,16 +1,21 @@
 """Matcher functions."""
 
 import collections
+import copy
+import hashlib
 import json
 import os.path
 import re
+import time
 import typing
 from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from types import MappingProxyType
 
 import psycopg2
 from flask import current_app
 
-from . import database, embassy, match, model, wikidata
+from . import database, embassy, match, model, osm_loader, wikidata
 
 
 class EntityType(typing.TypedDict):
@@ -44,13 +49,89 @@ class CandidateDict(typing.TypedDict):
     address_match: bool
     name_match: match.NameMatchDict
     matching_tags: set[str]
-    geom: typing.NotRequired[str]
+    geom: typing.NotRequired[str | None]
+
+
+@dataclass(frozen=True, slots=True)
+class ItemMatchContext:
+    """Facts about a Wikidata item used when checking each candidate row.
+
+    Built once per item so the checks don't keep going back to the item tags
+    and entity JSON for every candidate.
+    """
+
+    tags: frozenset[str] = frozenset()
+    instanceof: frozenset[str] = frozenset()
+    names: dict[str, list[tuple[str, str]]] = field(default_factory=dict)
+    identifiers: dict[str, list[tuple[tuple[str, ...], str]]] = field(
+        default_factory=dict
+    )
+    endings: frozenset[str] = frozenset()
+    # endings before the farmhouse, hamlet and street adjustments
+    criteria_endings: frozenset[str] = frozenset()
+    place_names: frozenset[str] = frozenset()
+    wikidata_tags: frozenset[str] = frozenset()
+    operator_countries: frozenset[str] = frozenset()
+    extract: str | None = None
+    is_city: bool = False
+    is_historic_district: bool = False
+    is_hamlet: bool = False
+    is_farmhouse: bool = False
+    is_stolperstein: bool = False
+    is_station: bool = False
+    is_stadium: bool = False
+    is_mountain_range: bool = False
+    is_cricket_ground: bool = False
+    is_nhle: bool = False
+    has_shop_tag: bool = False
+    has_railway_tag: bool = False
+
+    @classmethod
+    def from_item(cls, item: model.Item) -> "ItemMatchContext":
+        """Collect the facts about an item needed by the matcher."""
+        tags = frozenset(item.tags)
+        instanceof = frozenset(item.instanceof())
+        names = item.names()
+
+        is_hamlet = item.is_hamlet()
+        is_farmhouse = item.is_farmhouse()
+        criteria_endings = get_ending_from_criteria(tags) | item.more_endings_from_isa()
+        endings = set() if is_farmhouse else set(criteria_endings)
+        if is_hamlet:
+            endings.discard("house")
+        endings.discard("street")
+
+        return cls(
+            tags=tags,
+            instanceof=instanceof,
+            names=names,
+            identifiers=item.get_item_identifiers(),
+            endings=frozenset(endings),
+            criteria_endings=frozenset(criteria_endings),
+            place_names=frozenset(item.place_names()),
+            wikidata_tags=frozenset(item.calculate_tags()),
+            operator_countries=frozenset(c["id"] for c in item.get_claim("P137")),
+            extract=item.extract,
+            is_city=any(c.startswith("Cities ") for c in item.categories or []),
+            is_historic_district=item.is_a_historic_district(),
+            is_hamlet=is_hamlet,
+            is_farmhouse=is_farmhouse,
+            is_stolperstein=item.is_stolperstein(),
+            is_station=item.is_a_station(),
+            is_stadium=item.is_a_stadium(),
+            is_mountain_range=item.is_mountain_range(),
+            is_cricket_ground=item.is_cricket_ground(),
+            is_nhle=bool(item.is_nhle),
+            has_shop_tag=any(tag.startswith("shop") for tag in tags),
+            has_railway_tag=any(tag.startswith("railway") for tag in tags),
+        )
 
 
 cat_to_ending = {}
 patterns: dict[str, re.Pattern[str]] = {}
-entity_types: list[EntityType] = []
+entity_type_recheck_seconds = 5  # how often to look for a new entity_types.json
 default_max_dist = 4
+candidate_geom_tolerance = 5  # metres, for simplified candidate geometry
 extract_name_good_enough = True
 
 re_farmhouse = re.compile("^(.*) farm ?house$", re.I)
@@ -63,57 +144,193 @@ def get_pattern(key: str) -> re.Pattern[str]:
     return patterns.setdefault(key, re.compile(r"\b" + re.escape(key) + r"\b", re.I))
 
 
+class CategoryClassifier:
+    """Find the OSM tags for Wikipedia categories.
+
+    The category keys from the entity types are held in a trie, walked from
+    every position of a category to find the keys it contains in one pass.
+    Exclusion patterns are compiled up front and the tags for each category
+    are cached.
+    """
+
+    max_cached = 100_000
+
+    def __init__(self, cat_to_entity: dict[str, EntityType]) -> None:
+        """Build the trie from a map of lowercase category key to entity type."""
+        self.trie: dict[str | None, typing.Any] = {}
+        self.tags: dict[str, frozenset[str]] = {}
+        self.exclude: dict[str, re.Pattern[str]] = {}
+        self.cache: dict[str, frozenset[str]] = {}
+
+        for key, value in cat_to_entity.items():
+            node = self.trie
+            for char in key:
+                node = node.setdefault(char, {})
+            node[None] = key
+            self.tags[key] = frozenset(value["tags"])
+            exclude = value.get("exclude_cats")
+            if exclude:
+                assert isinstance(exclude, list)
+                self.exclude[key] = re.compile(
+                    r"\b(" + "|".join(re.escape(e) for e in exclude) + r")\b", re.I
+                )
+
+    def matching_keys(self, lc_cat: str) -> list[str]:
+        """Keys found in a lowercase category as whole words."""
+        found = []
+        for start in range(len(lc_cat)):
+            node = self.trie
+            for char in lc_cat[start:]:
+                node = node.get(char)
+                if node is None:
+                    break
+                key = node.get(None)
+                if key and get_pattern(key).match(lc_cat, start):
+                    found.append(key)
+        return found
+
+    def category_tags(self, cat: str) -> frozenset[str]:
+        """Tags for a single category."""
+        tags = self.cache.get(cat)
+        if tags is not None:
+            return tags
+        lc_cat = cat.lower()
+        tags = frozenset().union(
+            *(
+                self.tags[key]
+                for key in self.matching_keys(lc_cat)
+                if key not in self.exclude or not self.exclude[key].search(lc_cat)
+            )
+        )
+        if len(self.cache) >= self.max_cached:
+            self.cache.clear()
+        self.cache[cat] = tags
+        return tags
+
+
+@dataclass(frozen=True)
+class EntityTypeRegistry:
+    """Entity types from entity_types.json with the indexes the matcher uses.
+
+    Loaded once per process and shared, it is replaced when the modification
+    time of the file changes.
+    """
+
+    filename: str
+    mtime: float
+    entity_types: tuple[EntityType, ...]
+    cat_map: typing.Mapping[str, EntityType]
+    classifier: CategoryClassifier
+    tag_max_dist: typing.Mapping[str, int]
+    tag_endings: typing.Mapping[str, frozenset[str]]
+    housename_tags: frozenset[str]
+    wikidata_housename: typing.Mapping[str, bool]
+
+    @classmethod
+    def load(cls, filename: str) -> "EntityTypeRegistry":
+        """Parse entity_types.json and build the indexes."""
+        mtime = os.stat(filename).st_mtime
+        with open(filename) as f:
+            entity_types = typing.cast(list[EntityType], json.load(f))
+
+        cat_map: dict[str, EntityType] = {}
+        tag_max_dist: dict[str, int] = {}
+        tag_endings: defaultdict[str, set[str]] = defaultdict(set)
+        housename_tags: set[str] = set()
+        wikidata_housename: dict[str, bool] = {}
+        for t in entity_types:
+            for c in t["cats"]:
+                lc_cat = c.lower()
+                if " by " in lc_cat:
+                    lc_cat = lc_cat[: lc_cat.find(" by ")]
+                cat_map[lc_cat] = t
+            for tag in t["tags"]:
+                if t.get("dist"):
+                    tag_max_dist[tag] = max(tag_max_dist.get(tag, 0), t["dist"])
+                tag_endings[tag].update(t.get("trim", []))
+            if t.get("check_housename"):
+                housename_tags.update(t["tags"])
+            if t.get("wikidata"):
+                qid = t["wikidata"]
+                check = bool(t.get("check_housename"))
+                wikidata_housename[qid] = wikidata_housename.get(qid, False) or check
+
+        return cls(
+            filename=filename,
+            mtime=mtime,
+            entity_types=tuple(entity_types),
+            cat_map=MappingProxyType(cat_map),
+            classifier=CategoryClassifier(cat_map),
+            tag_max_dist=MappingProxyType(tag_max_dist),
+            tag_endings=MappingProxyType(
+                {tag: frozenset(endings) for tag, endings in tag_endings.items()}
+            ),
+            housename_tags=frozenset(housename_tags),
+            wikidata_housename=MappingProxyType(wikidata_housename),
+        )
+
+
+entity_type_registry: EntityTypeRegistry | None = None
+entity_type_checked_at = 0.0
+
+
+def get_entity_type_registry() -> EntityTypeRegistry:
+    """Entity type registry for the process, loaded on first use.
+
+    The modification time of the file is checked at most every
+    entity_type_recheck_seconds, the registry is reloaded if it has changed.
+    """
+    global entity_type_registry, entity_type_checked_at
+
+    filename = os.path.join(current_app.config["DATA_DIR"], "entity_types.json")
+    registry = entity_type_registry
+    now = time.monotonic()
+    if registry and registry.filename == filename:
+        if now - entity_type_checked_at < entity_type_recheck_seconds:
+            return registry
+        if os.stat(filename).st_mtime == registry.mtime:
+            entity_type_checked_at = now
+            return registry
+
+    registry = entity_type_registry = EntityTypeRegistry.load(filename)
+    entity_type_checked_at = now
+    return registry
+
+
+def get_category_classifier() -> CategoryClassifier:
+    """Category classifier for the entity types, shared by the process."""
+    return get_entity_type_registry().classifier
+
+
 def categories_to_tags(
     categories: collections.abc.Collection[str],
     cat_to_entity: dict[str, EntityType] | None = None,
 ) -> list[str]:
     """Return a list of tags based on the given categories."""
     if cat_to_entity is None:
-        cat_to_entity = build_cat_map()
-    tags = set()
+        classifier = get_category_classifier()
+    else:
+        classifier = CategoryClassifier(cat_to_entity)
+    tags: set[str] = set()
     for cat in categories:
-        lc_cat = cat.lower()
-        for key, value in cat_to_entity.items():
-            if not get_pattern(key).search(lc_cat):
-                continue
-            exclude = value.get("exclude_cats")
-            if exclude:
-                assert isinstance(exclude, list)
-                pattern = re.compile(
-                    r"\b(" + "|".join(re.escape(e) for e in exclude) + r")\b", re.I
-                )
-                if pattern.search(lc_cat):
-                    continue
-            tags |= set(value["tags"])
+        tags |= classifier.category_tags(cat)
     return sorted(tags)
 
 
 def categories_to_tags_map(categories: list[str]) -> defaultdict[str, set[str]]:
     """Build mapping from category name to collection of tags."""
-    cat_to_entity = build_cat_map()
+    classifier = get_category_classifier()
     ret: defaultdict[str, set[str]] = defaultdict(set)
     for cat in categories:
-        lc_cat = cat.lower()
-        for key, value in cat_to_entity.items():
-            if not get_pattern(key).search(lc_cat):
-                continue
-            exclude = value.get("exclude_cats")
-            if exclude:
-                assert isinstance(exclude, list)
-                pattern = re.compile(
-                    r"\b(" + "|".join(re.escape(e) for e in exclude) + r")\b", re.I
-                )
-                if pattern.search(lc_cat):
-                    continue
-            ret[cat] |= set(value["tags"])
+        tags = classifier.category_tags(cat)
+        if tags:
+            ret[cat] |= tags
     return ret
 
 
 def load_entity_types() -> list[EntityType]:
-    """Load entity types from JSON file."""
-    data_dir = current_app.config["DATA_DIR"]
-    filename = os.path.join(data_dir, "entity_types.json")
-    return typing.cast(list[EntityType], json.load(open(filename)))
+    """Copy of the entity types, safe for the caller to modify."""
+    return copy.deepcopy(list(get_entity_type_registry().entity_types))
 
 
 def simplify_tags(tags: list[str]) -> list[str]:
@@ -140,29 +357,16 @@ def tag_and_key_if_possible(tags: set[str]) -> set[str]:
 
 def build_cat_map() -> dict[str, EntityType]:
     """Build a map from lowercase category name to entity type."""
-    cat_to_entity: dict[str, EntityType] = {}
-    for i in load_entity_types():
-        for c in i["cats"]:
-            lc_cat = c.lower()
-            if " by " in lc_cat:
-                lc_cat = lc_cat[: lc_cat.find(" by ")]
-            cat_to_entity[lc_cat] = i
-    return cat_to_entity
+    return dict(get_entity_type_registry().cat_map)
 
 
 def get_ending_from_criteria(tags: collections.abc.Collection[str]) -> set[str]:
     """Get endings to trim from tags."""
-    global entity_types
-
-    if not entity_types:
-        entity_types = load_entity_types()
-    tags = set(tags)
-    tags.discard("type=site")  # too generic
-
-    endings = set()
-    for t in entity_types:
-        if tags & set(t["tags"]):
-            endings.update(t.get("trim", []))
+    tag_endings = get_entity_type_registry().tag_endings
+    endings: set[str] = set()
+    for tag in tags:
+        if tag != "type=site":  # too generic
+            endings.update(tag_endings.get(tag, ()))
 
     return endings
 
@@ -182,40 +386,23 @@ def could_be_building(tags: set[str], instanceof: list[str]) -> bool:
     if any(tag.startswith("building") for tag in tags):
         return True
 
-    global entity_types
+    registry = get_entity_type_registry()
 
-    if not entity_types:
-        entity_types = load_entity_types()
-
-    check_housename = False
-    found_instanceof = False
-    if instanceof:
-        for t in entity_types:
-            if t.get("wikidata") not in instanceof:
-                continue
-            found_instanceof = True
-            if t.get("check_housename"):
-                check_housename = True
-    if found_instanceof:
-        return check_housename
+    found = [
+        registry.wikidata_housename[qid]
+        for qid in instanceof or []
+        if qid in registry.wikidata_housename
+    ]
+    if found:
+        return any(found)
 
-    tags = set(tags)
-    return any(t.get("check_housename") and tags & set(t["tags"]) for t in entity_types)
+    return not registry.housename_tags.isdisjoint(tags)
 
 
 def get_max_dist_from_criteria(tags: collections.abc.Collection[str]) -> int | None:
     """Look at the entity types for the given tag criteria and find max distance."""
-    global entity_types
-
-    if not entity_types:
-        entity_types = load_entity_types()
-    tags = set(tags)
-
-    max_dists = []
-    for t in entity_types:
-        type_max_dist = t.get("dist")
-        if type_max_dist and tags & set(t["tags"]):
-            max_dists.append(type_max_dist)
+    tag_max_dist = get_entity_type_registry().tag_max_dist
+    max_dists = [tag_max_dist[tag] for tag in tags if tag in tag_max_dist]
 
     return max(max_dists) if max_dists else None
 
@@ -237,18 +424,26 @@ def hstore_query(tags: list[str]) -> str:
     return " or\n ".join(cond)
 
 
+SqlParams = dict[str, typing.Any]
+
+# subquery for the item location in EPSG:3857, read from the item table
+item_point_sql = (
+    "(select ST_Transform(location::geometry, 3857) as point "
+    "from item where item_id = %(item_id)s) i"
+)
+
+
 def nearby_nodes_sql(
     item: model.Item, prefix: str, max_dist: int = 10, limit: int = 50
-) -> str:
-    """Generate SQL to find nearby nodes."""
-    point = f"ST_TRANSFORM(ST_GeomFromEWKT('{item.ewkt}'), 3857)"
+) -> tuple[str, SqlParams]:
+    """Generate SQL and parameters to find nearby nodes."""
     sql = (
         f"select 'point', osm_id, name, tags, "
-        f"ST_Distance({point}, way) as dist "
-        f"from {prefix}_point "
-        f"where ST_DWithin({point}, way, {max_dist})"
+        f"ST_Distance(i.point, way) as dist "
+        f"from {prefix}_point, {item_point_sql} "
+        f"where ST_DWithin(i.point, way, %(max_dist)s)"
     )
-    return sql
+    return sql, {"item_id": item.item_id, "max_dist": max_dist}
 
 
 def existing_sql(prefix: str) -> str:
@@ -260,6 +455,32 @@ def existing_sql(prefix: str) -> str:
     return f"select * from ({' union '.join(sql_list)}) a where tags ? 'wikidata'"
 
 
+def add_tag_tokens(cur: DbCursor, prefix: str) -> list[str]:
+    """Add the tag_tokens column to place tables loaded before it existed.
+
+    The candidate queries filter on tag_tokens. Tables kept from an earlier
+    run get the column, filled from the tags, and a GIN index. Returns the
+    names of the tables that were changed.
+    """
+    tables = [f"{prefix}_{table}" for table in osm_loader.table_geometry_type]
+    cur.execute(
+        "select c.relname from pg_class c "
+        "where c.relname = any(%s) and c.relkind = 'r' and not exists ("
+        "select 1 from pg_attribute a where a.attrelid = c.oid "
+        "and a.attname = 'tag_tokens' and not a.attisdropped)",
+        [tables],
+    )
+    missing = [row[0] for row in cur.fetchall()]
+    tokens = osm_loader.tag_tokens_sql.format("tags")
+    for table in missing:
+        cur.execute(f"alter table {table} add column tag_tokens text[]")
+        cur.execute(f"update {table} set tag_tokens = {tokens}")
+        cur.execute(f"create index on {table} using gin (tag_tokens)")
+    if missing:
+        cur.connection.commit()
+    return missing
+
+
 def get_existing(cur: DbCursor, prefix: str) -> dict[str, tuple[str, int]]:
     sql = existing_sql(prefix)
     cur.execute(sql)
@@ -280,42 +501,175 @@ def get_existing(cur: DbCursor, prefix: str) -> dict[str, tuple[str, int]]:
 
 def item_match_sql(
     item: model.Item, prefix: str, ignore_tags: set[str] | None = None, limit: int = 50
-) -> str | None:
-    point = "ST_TRANSFORM(ST_GeomFromEWKT('{}'), 3857)".format(item.ewkt)
+) -> tuple[str, SqlParams] | None:
+    """Generate SQL and parameters to find candidates for an item by tag.
+
+    Returns None if the item has no tags to search for.
+    """
     item_max_dist = get_max_dist_from_criteria(item.tags) or default_max_dist
 
     tags = item.calculate_tags(ignore_tags=ignore_tags)
     if not tags:
         return None
 
-    hstore = hstore_query(tags)
-    assert hstore
-
     sql_list = []
     for obj_type in "point", "line", "polygon", "relation":
         obj_sql = (
             f"select '{obj_type}', osm_id, name, tags, "
-            f"ST_Distance({point}, way) as dist "
-            f"from {prefix}_{obj_type} "
-            f"where ST_DWithin({point}, way, {item_max_dist} * 1000)"
+            f"ST_Distance(i.point, way) as dist "
+            f"from {prefix}_{obj_type}, {item_point_sql} "
+            f"where ST_DWithin(i.point, way, %(max_dist)s) "
+            f"and tag_tokens && %(match_tags)s::text[]"
         )
         sql_list.append(obj_sql)
     sql = (
         "select * from ("
         + " union ".join(sql_list)
-        + f") a where ({hstore}) order by dist limit {limit}"
+        + ") a order by dist limit %(limit)s"
+    )
+    params = {
+        "item_id": item.item_id,
+        "max_dist": item_max_dist * 1000,
+        "match_tags": bulk_match_tags(tags),
+        "limit": limit,
+    }
+    return sql, params
+
+
+def bulk_match_tags(tags: collections.abc.Collection[str]) -> list[str]:
+    """Tags to match against tag_tokens, with the same variants as hstore_query."""
+    match_tags = []
+    for tag in sorted(tags):
+        match_tags.append(tag)
+        k, _, v = tag.partition("=")
+        if "_" in v:
+            match_tags.append(k + "=" + v.replace("_", " "))
+    return match_tags
+
+
+bulk_match_arg_types = ["int[]", "float8[]", "int[]", "text[]"]
+bulk_match_statement = "match_candidates"
+
+
+def bulk_match_sql(prefix: str, limit: int = 50, nearby_dist: int = 10) -> str:
+    """Generate SQL to find candidate rows for a batch of items in one query.
+
+    The query takes four arrays: item IDs, the max distance for each item and
+    the match tags for all the items as pairs of item ID and tag. It is the
+    same for every batch of a place, so it is prepared once per place. The item
+    location is read from the item table and transformed to EPSG:3857 once per item.
+    The tag filter is the same test as hstore_query, an overlap between the
+    match tags for each item and the GIN indexed tag_tokens column.
+    """
+    sql_list = []
+    for obj_type in "point", "line", "polygon", "relation":
+        obj_sql = (
+            f"select '{obj_type}' as src_type, osm_id, name, tags, "
+            f"ST_Distance(i.point, way) as dist "
+            f"from {prefix}_{obj_type} "
+            f"where ST_DWithin(i.point, way, i.max_dist) "
+            "and tag_tokens && i.match_tags"
+        )
+        sql_list.append(obj_sql)
+
+    return f"""select i.item_id, c.src_type, c.osm_id, c.name, c.tags, c.dist
+from (
+    select v.item_id, v.max_dist,
+        array(
+            select t.tag from unnest($3, $4) as t(item_id, tag)
+            where t.item_id = v.item_id
+        ) as match_tags,
+        ST_Transform(item.location::geometry, 3857) as point
+    from unnest($1, $2) as v(item_id, max_dist)
+    join item on item.item_id = v.item_id
+) as i
+cross join lateral (
+    select * from (
+        select 0 as part, a.* from ({" union ".join(sql_list)}) a
+        order by a.dist limit {limit:d}
+    ) tag_match
+    union all
+    select 1 as part, 'point', osm_id, name, tags, ST_Distance(i.point, way)
+    from {prefix}_point
+    where ST_DWithin(i.point, way, {nearby_dist:d})
+) c
+order by i.item_id, c.part, c.dist"""
+
+
+def statement_name(base: str, sql: str) -> str:
+    """Prepared statement name for a query, the base name and a hash of the SQL."""
+    return f"{base}_{hashlib.sha1(sql.encode('utf-8')).hexdigest()[:16]}"
+
+
+def prepare(cur: DbCursor, base: str, sql: str, arg_types: list[str]) -> str:
+    """PREPARE a statement unless the database session already has it.
+
+    The name is from statement_name, so queries for different prefixes or of a
+    different shape never share a name. The session's pg_prepared_statements is
+    checked, rather than remembering what was prepared, so a reset session is
+    handled. Statements with the same base name for other queries are
+    deallocated, a pooled connection keeps one however many places it matched.
+    Returns the statement name.
+    """
+    name = statement_name(base, sql)
+    cur.execute(
+        "select name from pg_prepared_statements where starts_with(name, %s)",
+        [base + "_"],
+    )
+    existing = {row[0] for row in cur.fetchall()}
+    if name in existing:
+        return name
+    for old in existing:
+        cur.execute(f"deallocate {old}")
+    cur.execute(f"prepare {name} ({', '.join(arg_types)}) as {sql}")
+    return name
+
+
+def find_candidate_rows(
+    cur: DbCursor, items: collections.abc.Collection[model.Item], prefix: str
+) -> dict[int, list[tuple[str, int, str, dict[str, str], float]]]:
+    """Find raw candidate rows for a batch of items with a single query.
+
+    Returns the same rows as item_match_sql followed by nearby_nodes_sql for
+    each item, grouped by item ID.
+    """
+    item_ids: list[int] = []
+    max_dists: list[int] = []
+    tag_item_ids: list[int] = []
+    match_tags: list[str] = []
+    for item in items:
+        ignore_tags = {"building"} if item.is_a_historic_district() else set()
+        tags = bulk_match_tags(item.calculate_tags(ignore_tags=ignore_tags))
+        max_dist = get_max_dist_from_criteria(item.tags) or default_max_dist
+        item_ids.append(item.item_id)
+        max_dists.append(max_dist * 1000)
+        tag_item_ids += [item.item_id] * len(tags)
+        match_tags += tags
+
+    rows: dict[int, list[tuple[str, int, str, dict[str, str], float]]]
+    rows = {item.item_id: [] for item in items}
+    if not rows:
+        return rows
+
+    sql = bulk_match_sql(prefix)
+    name = prepare(cur, bulk_match_statement, sql, bulk_match_arg_types)
+    cur.execute(
+        f"execute {name} (%s, %s, %s, %s)",
+        [item_ids, max_dists, tag_item_ids, match_tags],
     )
-    return sql
+    for item_id, src_type, src_id, osm_name, osm_tags, dist in cur.fetchall():
+        rows[item_id].append((src_type, src_id, osm_name, osm_tags, dist))
+    return rows
 
 
 def run_sql(
-    cur: DbCursor, sql: str, debug: bool = False
+    cur: DbCursor, sql: str, params: SqlParams | None = None, debug: bool = False
 ) -> list[tuple[typing.Any, ...]]:
-    """Run SQL and return all rows."""
+    """Run SQL, with parameters passed through the cursor, and return all rows."""
     if debug:
-        print(sql)
+        print(sql, params)
 
-    cur.execute(sql)
+    cur.execute(sql, params)
     return cur.fetchall()
 
 
@@ -360,7 +714,7 @@ def find_matching_tags(osm: dict[str, str], wikidata: set[str]) -> set[str]:
 def bad_building_match(
     osm_tags: dict[str, str],
     name_match: match.NameMatchDict,
-    item: model.Item,
+    ctx: ItemMatchContext,
 ) -> bool:
     """Bad building match."""
     if "amenity" in osm_tags:
@@ -371,7 +725,7 @@ def bad_building_match(
     if not name_match:
         return False
 
-    wd_station = item.is_a_station()
+    wd_station = ctx.is_station
     osm_station = any(
         k.endswith("railway") and v in {"station", "halt"} for k, v in osm_tags.items()
     )
@@ -404,10 +758,10 @@ def is_osm_bus_stop(tags: dict[str, str]) -> bool:
 
 
 def station_house_too_far(
-    item: model.Item, osm_tags: dict[str, str], dist: float | None
+    ctx: ItemMatchContext, osm_tags: dict[str, str], dist: float | None
 ) -> bool:
     """A station name alone is insufficient for a distant ordinary house."""
-    if not item.is_a_station() or dist is None or dist <= 50:
+    if not ctx.is_station or dist is None or dist <= 50:
         return False
 
     building = set(osm_tags.get("building", "").split(";"))
@@ -440,22 +794,21 @@ def is_diplomatic_mission(matching_tags: set[str], osm_tags: dict[str, str]) ->
 
 
 def diplomatic_mission_different_country(
-    item: model.Item, tags: dict[str, str]
+    ctx: ItemMatchContext, tags: dict[str, str]
 ) -> bool:
     name = tags.get("name:en") or tags.get("name")
     osm_country = tags.get("diplomatic:sending_country") or tags.get("country")
-    item_countries = {country["id"] for country in item.get_claim("P137")}
 
     if name:
         name_country = embassy.from_name(name)
-        if name_country and name_country.qid not in item_countries:
+        if name_country and name_country.qid not in ctx.operator_countries:
             return True
 
     if not osm_country or len(osm_country) not in (2, 3):
         return False
 
     codes = set()
-    for qid in item_countries:
+    for qid in ctx.operator_countries:
         # no ISO code for 'Embassy of South Ossetia, Moscow'
         # https://www.wikidata.org/wiki/Q4374094
 
@@ -472,19 +825,19 @@ def is_building_only_match(matching_tags: set[str]) -> bool:
     return matching_tags.issubset(building_tags)
 
 
-def is_bad_match(item: model.Item, osm_tags: dict[str, str]) -> bool:
+def is_bad_match(ctx: ItemMatchContext, osm_tags: dict[str, str]) -> bool:
     """Check for bad match."""
     amenity = set(osm_tags["amenity"].split(";") if "amenity" in osm_tags else [])
 
     if (
-        "amenity=post_office" in item.tags
+        "amenity=post_office" in ctx.tags
         and "place_of_worship" in amenity
         and "post_office" not in amenity
     ):
         return True  # post office shouldn't match a church with a similar name
 
     for bad_match_filter in model.BadMatchFilter.query:
-        if bad_match_filter.check(item.tags, osm_tags):
+        if bad_match_filter.check(ctx.tags, osm_tags):
             return True
 
     building = set(osm_tags["building"].split(";") if "building" in osm_tags else [])
@@ -494,24 +847,24 @@ def is_bad_match(item: model.Item, osm_tags: dict[str, str]) -> bool:
 
     for building_type in ("stable", "barn", "farm_auxiliary"):
         if (
-            "building=" + building_type in item.tags
-            and "building=house" not in item.tags
+            "building=" + building_type in ctx.tags
+            and "building=house" not in ctx.tags
             and "house" in building
             and building_type not in building
         ):
             return True  # Wikidata stable shouldn't match OSM house
 
     if (
-        "building=tower" in item.tags
-        and "amenity=pub" not in item.tags
+        "building=tower" in ctx.tags
+        and "amenity=pub" not in ctx.tags
         and "pub" in amenity
         and "man_made" not in osm_tags
     ):
         return True  # Wikidata tower shouldn't match OSM pub
 
     if (
-        "historic=castle" in item.tags
-        and "railway=station" not in item.tags
+        "historic=castle" in ctx.tags
+        and "railway=station" not in ctx.tags
         and (
             osm_tags.get("railway") == "station"
             or osm_tags.get("building") == "train_station"
@@ -521,8 +874,8 @@ def is_bad_match(item: model.Item, osm_tags: dict[str, str]) -> bool:
         return True  # castle shouldn't railway station
 
     if (
-        "railway=station" in item.tags
-        and "amenity=cafe" not in item.tags
+        "railway=station" in ctx.tags
+        and "amenity=cafe" not in ctx.tags
         and "cafe" in amenity
         and osm_tags.get("railway") != "station"
         and osm_tags.get("building") != "train_station"
@@ -530,8 +883,8 @@ def is_bad_match(item: model.Item, osm_tags: dict[str, str]) -> bool:
         return True  # station shouldn't match cafe
 
     if (
-        "railway=station" in item.tags
-        and "shop=supermarket" not in item.tags
+        "railway=station" in ctx.tags
+        and "shop=supermarket" not in ctx.tags
         and "supermarket" == osm_tags.get("shop")
         and osm_tags.get("railway") != "station"
         and osm_tags.get("building") != "train_station"
@@ -539,17 +892,17 @@ def is_bad_match(item: model.Item, osm_tags: dict[str, str]) -> bool:
         return True  # station shouldn't match supermarket
 
     if (
-        "building=train_station" not in item.tags
+        "building=train_station" not in ctx.tags
         and osm_tags.get("building") == "train_station"
     ):
         return True  # non-station shouldn't match station
 
-    if "amenity=fuel" not in item.tags and "fuel" in amenity:
+    if "amenity=fuel" not in ctx.tags and "fuel" in amenity:
         return True  # petrol station
 
     if (
-        "place" in item.tags
-        and not any(t.startswith("railway") for t in item.tags)
+        "place" in ctx.tags
+        and not ctx.has_railway_tag
         and "place" not in osm_tags
         and "railway" in osm_tags
     ):
@@ -600,28 +953,33 @@ where b.osm_id={src_id}
 
 
 def find_item_matches(
-    cur: psycopg2.extensions.cursor, item: model.Item, prefix: str, debug: bool = False
+    cur: psycopg2.extensions.cursor,
+    item: model.Item,
+    prefix: str,
+    debug: bool = False,
+    rows: list[tuple[str, int, str, dict[str, str], float]] | None = None,
 ) -> list[CandidateDict]:
-    """Check database to find list of OSM candidate matches."""
+    """Check database to find list of OSM candidate matches.
+
+    Candidate rows from find_candidate_rows can be passed in, otherwise they are
+    retrieved with queries for this item.
+    """
     if not item or not item.entity:
         return []
-    wikidata_names = item.names()
-    if not wikidata_names:
+    ctx = ItemMatchContext.from_item(item)
+    if not ctx.names:
         return []
 
-    cats = item.categories or []
-
     # point = "ST_GeomFromEWKT('{}')".format(item.ewkt)
 
     # item_max_dist = max(max_dist[cat] for cat in item['cats'])
 
-    item_is_a_historic_district = item.is_a_historic_district()
-    ignore_tags = {"building"} if item_is_a_historic_district else set()
-    sql = item_match_sql(item, prefix, ignore_tags=ignore_tags)
-    rows = run_sql(cur, sql, debug) if sql else []
+    if rows is None:
+        ignore_tags = {"building"} if ctx.is_historic_district else set()
+        query = item_match_sql(item, prefix, ignore_tags=ignore_tags)
+        rows = run_sql(cur, *query, debug=debug) if query else []
 
-    sql = nearby_nodes_sql(item, prefix)
-    rows += run_sql(cur, sql, debug)
+        rows += run_sql(cur, *nearby_nodes_sql(item, prefix), debug=debug)
     if not rows:
         return []
 
@@ -636,25 +994,6 @@ def find_item_matches(
         if found:
             return found
 
-    item_identifiers = item.get_item_identifiers()
-
-    endings = get_ending_from_criteria(item.tags)
-    endings |= item.more_endings_from_isa()
-
-    if item.is_farmhouse():
-        endings = set()
-
-    wikidata_tags = item.calculate_tags()
-
-    place_names = item.place_names()
-    instanceof = set(item.instanceof())
-    is_hamlet = item.is_hamlet()
-    item_is_stolperstein = item.is_stolperstein()
-    if is_hamlet:
-        endings.discard("house")
-
-    endings.discard("street")
-
     check_within = current_app.config.get("HUNT_FOR_MORE_PLACE_NAMES") or False
     match_address_nodes = current_app.config.get("MATCH_ADDRESS_NODES") or False
 
@@ -669,17 +1008,17 @@ def find_item_matches(
 
         if (
             osm_tags.get("locality") == "townland"
-            and "locality=townland" not in item.tags
+            and "locality=townland" not in ctx.tags
         ):
             continue  # only match townlands when specifically searching for one
 
-        if item_is_a_historic_district and "building" in osm_tags:
+        if ctx.is_historic_district and "building" in osm_tags:
             continue  # historic district shouldn't match building
 
         if not match_address_nodes and is_address_node(osm_type, osm_tags):
             continue  # Don't match address nodes. There are lots of these in New York.
 
-        if item_is_stolperstein and not osm_is_stolperstein(osm_tags):
+        if ctx.is_stolperstein and not osm_is_stolperstein(osm_tags):
             continue
 
         try:
@@ -689,22 +1028,22 @@ def find_item_matches(
         except Exception:
             admin_level = None
 
-        identifier_match = match.check_identifier(osm_tags, item_identifiers)
+        identifier_match = match.check_identifier(osm_tags, ctx.identifiers)
 
         if not identifier_match:
-            if any(c.startswith("Cities ") for c in cats) and admin_level == 10:
+            if ctx.is_city and admin_level == 10:
                 continue
 
-            if station_house_too_far(item, osm_tags, dist):
+            if station_house_too_far(ctx, osm_tags, dist):
                 continue
 
-        address_match = match.check_name_matches_address(osm_tags, wikidata_names)
+        address_match = match.check_name_matches_address(osm_tags, ctx.names)
 
         if address_match is False:  # OSM and Wikidata addresses differ
             continue
 
         if not address_match and match.check_for_address_in_extract(
-            osm_tags, item.extract
+            osm_tags, ctx.extract
         ):
             address_match = True
 
@@ -715,23 +1054,23 @@ def find_item_matches(
 
         name_match = match.check_for_match(
             osm_tags,
-            wikidata_names,
-            endings,
-            place_names=place_names | within,
-            trim_house=not is_hamlet,
+            ctx.names,
+            ctx.endings,
+            place_names=ctx.place_names | within,
+            trim_house=not ctx.is_hamlet,
         )
 
-        if "seamark:name" in name_match and "man_made=lighthouse" not in item.tags:
+        if "seamark:name" in name_match and "man_made=lighthouse" not in ctx.tags:
             del name_match["seamark:name"]  # not a lighthouse
 
         if not (identifier_match or address_match or name_match):
             continue
 
-        matching_tags = find_matching_tags(osm_tags, wikidata_tags)
+        matching_tags = find_matching_tags(osm_tags, ctx.wikidata_tags)
 
         if is_diplomatic_mission(
             matching_tags, osm_tags
-        ) and diplomatic_mission_different_country(item, osm_tags):
+        ) and diplomatic_mission_different_country(ctx, osm_tags):
             continue
 
         building_only_match = is_building_only_match(matching_tags)
@@ -739,8 +1078,8 @@ def find_item_matches(
         amenity = set(osm_tags["amenity"].split(";") if "amenity" in osm_tags else [])
 
         if (
-            "building" in item.tags
-            and "amenity=car_sharing" not in item.tags
+            "building" in ctx.tags
+            and "amenity=car_sharing" not in ctx.tags
             and "building" not in osm_tags
             and "car_sharing" in amenity
         ):
@@ -753,8 +1092,8 @@ def find_item_matches(
             and not identifier_match
         ):
             if (
-                "amenity=school" in item.tags
-                and "amenity=restaurant" not in item.tags
+                "amenity=school" in ctx.tags
+                and "amenity=restaurant" not in ctx.tags
                 and "restaurant" in amenity
                 and "school" not in amenity
             ):
@@ -764,7 +1103,7 @@ def find_item_matches(
             building_only_match
             and address_match
             and not identifier_match
-            and "building=train_station" not in item.tags
+            and "building=train_station" not in ctx.tags
             and osm_tags.get("building") == "train_station"
         ):
             continue  # non-station shouldn't match station by address
@@ -774,22 +1113,24 @@ def find_item_matches(
             and not address_match
             and name_match
             and not identifier_match
-            and is_bad_match(item, osm_tags)
+            and is_bad_match(ctx, osm_tags)
         ):
             continue
 
-        if (not matching_tags or building_only_match) and instanceof == {"Q34442"}:
+        if (
+            not matching_tags or building_only_match
+        ) and ctx.instanceof == {"Q34442"}:
             continue  # nearby road match
 
-        if osm_tags.get("amenity") == "parking" and "amenity=parking" not in item.tags:
+        if osm_tags.get("amenity") == "parking" and "amenity=parking" not in ctx.tags:
             continue  # parking garage in OSM should only match parking Wikidata item
 
-        if is_osm_bus_stop(osm_tags) and "Q953806" not in instanceof:
+        if is_osm_bus_stop(osm_tags) and "Q953806" not in ctx.instanceof:
             continue  # nearby match OSM bus stop matching non-bus stop
 
         if (
             "leisure=park" in matching_tags
-            and item.is_cricket_ground()
+            and ctx.is_cricket_ground
             and (
                 osm_tags.get("designation") == "common" or "common" in osm_name.lower()
             )
@@ -802,32 +1143,31 @@ def find_item_matches(
             and not address_match
             and building_only_match
         ):
-            if bad_building_match(osm_tags, name_match, item):
+            if bad_building_match(osm_tags, name_match, ctx):
                 continue
-            wd_stadium = item.is_a_stadium()
             if (
-                wd_stadium
-                and "amenity=restaurant" not in item.tags
+                ctx.is_stadium
+                and "amenity=restaurant" not in ctx.tags
                 and "restaurant" in amenity
             ):
                 continue
-            if wd_stadium and osm_tags.get("shop") == "supermarket":
+            if ctx.is_stadium and osm_tags.get("shop") == "supermarket":
                 continue
 
         if (
             matching_tags == {"natural=peak"}
-            and item.is_mountain_range()
+            and ctx.is_mountain_range
             and dist > 100
         ):
             continue
 
-        if item.is_nhle and dist > 500:
+        if ctx.is_nhle and dist > 500:
             continue  # NHLE items normally have quite precise coordinates
 
         if (
             not identifier_match
-            and "railway=station" in item.tags
-            and "amenity=ferry_terminal" not in item.tags
+            and "railway=station" in ctx.tags
+            and "amenity=ferry_terminal" not in ctx.tags
             and "ferry_terminal" in amenity
             and osm_tags.get("railway") != "station"
             and osm_tags.get("building") != "train_station"
@@ -835,8 +1175,8 @@ def find_item_matches(
             continue  # station shouldn't match ferry terminal
 
         if (
-            "amenity=place_of_worship" in item.tags
-            and "man_made=bridge" not in item.tags
+            "amenity=place_of_worship" in ctx.tags
+            and "man_made=bridge" not in ctx.tags
             and osm_tags.get("man_made") == "bridge"
             and "place_of_worship" not in amenity
         ):
@@ -846,10 +1186,10 @@ def find_item_matches(
             not name_match
             and address_match
             and (
-                "building=apartments" in item.tags
-                or "building=residential" in item.tags
+                "building=apartments" in ctx.tags
+                or "building=residential" in ctx.tags
             )
-            and not any(tag.startswith("shop") for tag in item.tags)
+            and not ctx.has_shop_tag
             and "shop" in osm_tags
             and osm_tags.get("building") not in ("apartments", "residential")
         ):
@@ -858,36 +1198,27 @@ def find_item_matches(
         if (
             not name_match
             and address_match
-            and "studio=audio" in item.tags
-            and not any(tag.startswith("shop") for tag in item.tags)
+            and "studio=audio" in ctx.tags
+            and not ctx.has_shop_tag
             and "shop" in osm_tags
             and osm_tags.get("studio") != "audio"
         ):
             continue  # recording studio shouldn't match shop
 
         if (
-            "artwork_type=statue" in item.tags
-            and "tourism=museum" not in item.tags
+            "artwork_type=statue" in ctx.tags
+            and "tourism=museum" not in ctx.tags
             and osm_tags.get("tourism") == "museum"
             and osm_tags.get("artwork_type") != "statue"
         ):
             continue  # statue shouldn't match museum
 
         if (
-            "historic=memorial" not in item.tags
+            "historic=memorial" not in ctx.tags
             and osm_tags.get("historic") == "memorial"
         ):
             continue  # only memorial should match memorial
 
-        sql = (
-            f"select ST_AsText(ST_Transform(way, 4326)) "
-            f"from {prefix}_{src_type} "
-            f"where osm_id={src_id}"
-        )
-        cur.execute(sql)
-        row = cur.fetchone()
-        geom = row and row[0]
-
         candidate: CandidateDict = {
             "osm_type": osm_type,
             "osm_id": osm_id,
@@ -897,7 +1228,7 @@ def find_item_matches(
             # 'match': match.match_type.name,
             "planet_table": src_type,
             "src_id": src_id,
-            "geom": geom,
+            "geom": None,
             "identifier_match": identifier_match,
             "address_match": address_match,
             "name_match": name_match,
@@ -909,21 +1240,67 @@ def find_item_matches(
     candidates = prefer_key_over_building(candidates, "amenity")
     candidates = prefer_tag_match_over_building_only_match(candidates)
     candidates = prefer_railway_station(candidates)
-    candidates = prefer_stop_area_relation(candidates, wikidata_tags)
-    if candidates and item.is_farmhouse():
+    candidates = prefer_stop_area_relation(candidates, ctx)
+    if candidates and ctx.is_farmhouse:
         candidates = prefer_farmhouse(candidates)
-    if "man_made=bridge" in item.tags:
+    if "man_made=bridge" in ctx.tags:
         candidates = filter_bridge(candidates)
+
+    geom_mode = current_app.config.get("CANDIDATE_GEOM") or "full"
+    load_candidate_geoms(cur, prefix, candidates, geom_mode)
     return candidates
 
 
+def candidate_geom_expr(mode: str = "full") -> str:
+    """SQL expression for the candidate geometry saved in item_candidate.
+
+    The mode is 'full', 'simplified' or 'centroid_bbox'.
+    """
+    if mode == "simplified":
+        way = f"ST_SimplifyPreserveTopology(way, {candidate_geom_tolerance})"
+    elif mode == "centroid_bbox":
+        way = "ST_Collect(ST_Centroid(way), ST_Envelope(way))"
+    elif mode == "full":
+        way = "way"
+    else:
+        raise ValueError(
+            f"unknown candidate geometry mode {mode!r}, "
+            "expected 'full', 'simplified' or 'centroid_bbox'"
+        )
+    return f"ST_AsText(ST_Transform({way}, 4326))"
+
+
+def load_candidate_geoms(
+    cur: DbCursor, prefix: str, candidates: list[CandidateDict], mode: str = "full"
+) -> None:
+    """Fetch the geometry for a list of candidates with a single query."""
+    if not candidates:
+        return
+
+    src_ids = defaultdict(list)
+    for c in candidates:
+        src_ids[c["planet_table"]].append(c["src_id"])
+
+    expr = candidate_geom_expr(mode)
+    sql = " union all ".join(
+        f"select '{src_type}', osm_id, {expr} "
+        f"from {prefix}_{src_type} where osm_id = any(%s)"
+        for src_type in src_ids
+    )
+    cur.execute(sql, list(src_ids.values()))
+    geoms = {(src_type, src_id): geom for src_type, src_id, geom in cur.fetchall()}
+
+    for c in candidates:
+        c["geom"] = geoms.get((c["planet_table"], c["src_id"]))
+
+
 def prefer_stop_area_relation(
-    candidates: list[CandidateDict], wikidata_tags: set[str]
+    candidates: list[CandidateDict], ctx: ItemMatchContext
 ) -> list[CandidateDict]:
     """Prefer a stop_area relation to its stop and platform members."""
     if (
         len(candidates) < 2
-        or "public_transport=stop_area" not in wikidata_tags
+        or "public_transport=stop_area" not in ctx.wikidata_tags
     ):
         return candidates
 
@@ -995,18 +1372,9 @@ def filter_bridge(candidates: list[CandidateDict]) -> list[CandidateDict]:
 def check_item_candidate(
     candidate: model.ItemCandidate,
 ) -> dict[str, str | bool | set[str] | dict[str, str]]:
-    item, osm_tags = candidate.item, candidate.tags
-    cats = item.categories or []
-    item_identifiers = item.get_item_identifiers()
-    wikidata_names = item.names()
-
-    wikidata_tags = item.calculate_tags()
-
-    endings = get_ending_from_criteria(item.tags)
-    endings |= item.more_endings_from_isa()
-
-    place_names = item.place_names()
-    instanceof = set(item.instanceof())
+    osm_tags = candidate.tags
+    ctx = ItemMatchContext.from_item(candidate.item)
+    place_names = ctx.place_names
 
     try:
         admin_level = (
@@ -1015,41 +1383,41 @@ def check_item_candidate(
     except Exception:
         admin_level = None
 
-    if item.is_a_historic_district() and "building" in osm_tags:
+    if ctx.is_historic_district and "building" in osm_tags:
         return {"reject": "historic district shouldn't match building"}
-    identifier_match = match.check_identifier(osm_tags, item_identifiers)
+    identifier_match = match.check_identifier(osm_tags, ctx.identifiers)
     if not identifier_match:
-        if any(c.startswith("Cities ") for c in cats) and admin_level == 10:
+        if ctx.is_city and admin_level == 10:
             return {"reject": "bad city match"}
 
-        if station_house_too_far(item, osm_tags, candidate.dist):
+        if station_house_too_far(ctx, osm_tags, candidate.dist):
             return {"reject": "station shouldn't match a distant house"}
 
-    address_match = match.check_name_matches_address(osm_tags, wikidata_names)
+    address_match = match.check_name_matches_address(osm_tags, ctx.names)
 
     if address_match is False:  # OSM and Wikidata addresses differ
         return {"reject": "OSM and Wikidata addresses differ"}
 
-    if not address_match and match.check_for_address_in_extract(osm_tags, item.extract):
+    if not address_match and match.check_for_address_in_extract(osm_tags, ctx.extract):
         address_match = True
 
-    is_hamlet = item.is_hamlet()
-
-    if is_hamlet:
+    # keeps "street" and the farmhouse endings, unlike find_item_matches
+    endings = set(ctx.criteria_endings)
+    if ctx.is_hamlet:
         endings.discard("house")
 
     name_match = match.check_for_match(
         osm_tags,
-        wikidata_names,
+        ctx.names,
         endings,
         place_names=place_names,
-        trim_house=not is_hamlet,
+        trim_house=not ctx.is_hamlet,
     )
 
     if not (identifier_match or address_match or name_match):
         return {"reject": "no match", "place_names": place_names}
 
-    matching_tags = find_matching_tags(osm_tags, wikidata_tags)
+    matching_tags = find_matching_tags(osm_tags, ctx.wikidata_tags)
 
     building_only_match = is_building_only_match(matching_tags)
 
@@ -1060,8 +1428,8 @@ def check_item_candidate(
         and address_match
         and not name_match
         and not identifier_match
-        and "amenity=school" in item.tags
-        and "amenity=restaurant" not in item.tags
+        and "amenity=school" in ctx.tags
+        and "amenity=restaurant" not in ctx.tags
         and "restaurant" in amenity
         and "school" not in amenity
     ):
@@ -1071,7 +1439,7 @@ def check_item_candidate(
         building_only_match
         and address_match
         and not identifier_match
-        and "building=train_station" not in item.tags
+        and "building=train_station" not in ctx.tags
         and osm_tags.get("building") == "train_station"
     ):
         return {"reject": "non-station shouldn't match station by address"}
@@ -1081,14 +1449,14 @@ def check_item_candidate(
         and not address_match
         and name_match
         and not identifier_match
-        and is_bad_match(item, osm_tags)
+        and is_bad_match(ctx, osm_tags)
     ):
         return {"reject": "bad match"}
 
-    if (not matching_tags or building_only_match) and instanceof == {"Q34442"}:
+    if (not matching_tags or building_only_match) and ctx.instanceof == {"Q34442"}:
         return {"reject": "nearby road match"}
 
-    if is_osm_bus_stop(osm_tags) and "Q953806" not in instanceof:
+    if is_osm_bus_stop(osm_tags) and "Q953806" not in ctx.instanceof:
         return {"reject": "nearby match OSM bus stop matching non-bus stop"}
 
     if (
@@ -1097,7 +1465,7 @@ def check_item_candidate(
         and not address_match
         and building_only_match
     ):
-        if bad_building_match(osm_tags, name_match, item):
+        if bad_building_match(osm_tags, name_match, ctx):
             return {
                 "identifier_match": identifier_match,
                 "address_match": address_match,
@@ -1108,19 +1476,18 @@ def check_item_candidate(
                 "reject": "bad building match",
             }
 
-        wd_stadium = item.is_a_stadium()
         if (
-            wd_stadium
-            and "amenity=restaurant" not in item.tags
+            ctx.is_stadium
+            and "amenity=restaurant" not in ctx.tags
             and "restaurant" in amenity
         ):
             return {"reject": "stadium shouldn't match restaurant"}
-        if wd_stadium and osm_tags.get("shop") == "supermarket":
+        if ctx.is_stadium and osm_tags.get("shop") == "supermarket":
             return {"reject": "stadium shouldn't match supermarket"}
 
     if (
         matching_tags == {"natural=peak"}
-        and item.is_mountain_range()
+        and ctx.is_mountain_range
         and candidate.dist > 100
     ):
         return {"reject": "mountain range shouldn't match peak"}
@@ -0,0 +1,269 @@
+"""Share one LISTEN connection between the matcher progress websockets.
+
+A matcher job sends progress with NOTIFY on a channel for the place. Each web
+worker runs a single hub: one database connection that LISTENs on every
+channel somebody is watching, and a thread that passes each notification to
+the subscribed websockets. The hub also keeps a snapshot of the matcher queue,
+refreshed while there are subscribers, so idle sockets don't each run the
+active jobs query.
+
+Every subscription holds a shared advisory lock keyed on the channel, so the
+admin jobs page can count the subscribers of all web workers from pg_locks.
+"""
+
+import itertools
+import queue
+import select
+import threading
+import time
+import traceback
+import typing
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import sql
+
+StrDict = dict[str, typing.Any]
+PlaceKey = tuple[str, int]
+
+application_name = "owl_places_matcher_hub"
+queue_status_interval = 15.0  # seconds between refreshes of the queue snapshot
+reconnect_delay = 5.0
+
+
+class Subscription:
+    """Notifications on one channel for one websocket."""
+
+    def __init__(self, hub: "NotifyHub", channel: str, lock_id: int) -> None:
+        """Init."""
+        self.hub = hub
+        self.channel = channel
+        self.lock_id = lock_id
+        self.messages: queue.Queue[str] = queue.Queue()
+        self.missed = threading.Event()
+
+    def get(self, timeout: float) -> str | None:
+        """Next notification payload, None if nothing arrives before timeout."""
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def take_missed(self) -> bool:
+        """Check and reset the flag set when the hub reconnected.
+
+        Notifications sent while the hub was disconnected are lost, so the
+        subscriber has to catch up some other way.
+        """
+        if not self.missed.is_set():
+            return False
+        self.missed.clear()
+        return True
+
+    def close(self) -> None:
+        """Stop receiving notifications."""
+        self.hub.unsubscribe(self)
+
+    def __enter__(self) -> "Subscription":
+        """Context manager enter."""
+        return self
+
+    def __exit__(self, *exc: typing.Any) -> None:
+        """Context manager exit."""
+        self.close()
+
+
+class NotifyHub:
+    """LISTEN on many channels over one connection and fan out to subscribers.
+
+    refresh_jobs returns the active matcher jobs in queue order, as from
+    jobs.get_queue_snapshot. It is called from the hub thread.
+    """
+
+    def __init__(
+        self,
+        db_url: str,
+        refresh_jobs: typing.Callable[[], list[StrDict]] | None = None,
+    ) -> None:
+        """Init."""
+        self.db_url = db_url
+        self.refresh_jobs = refresh_jobs
+        self.lock = threading.Lock()
+        self.channels: dict[str, set[Subscription]] = {}
+        self.conn: psycopg2.extensions.connection | None = None
+        self.thread: threading.Thread | None = None
+        self.queue_status: dict[PlaceKey, StrDict] = {}
+        self.queue_status_at = 0.0
+        self.lock_ids = itertools.count(1)
+
+    def connect(self) -> psycopg2.extensions.connection:
+        """Open the LISTEN connection. Called with the lock held.
+
+        Anybody already subscribed was listening on a connection that dropped,
+        they are flagged as having missed notifications.
+        """
+        conn = psycopg2.connect(self.db_url, application_name=application_name)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            for channel, subscribers in self.channels.items():
+                cur.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+                for subscription in subscribers:
+                    lock_subscription(cur, subscription)
+        for subscribers in self.channels.values():
+            for subscription in subscribers:
+                subscription.missed.set()
+        self.conn = conn
+        return conn
+
+    def start(self) -> None:
+        """Start the hub thread if it isn't running."""
+        if self.thread and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self.run, name="notify-hub", daemon=True)
+        self.thread.start()
+
+    def subscribe(self, channel: str) -> Subscription:
+        """Subscribe to a channel.
+
+        The LISTEN has been run by the time this returns, so no notification
+        sent after subscribing is missed.
+        """
+        with self.lock:
+            subscription = Subscription(self, channel, next(self.lock_ids) % 2**31)
+            conn = self.conn if self.conn and not self.conn.closed else self.connect()
+            with conn.cursor() as cur:
+                if channel not in self.channels:
+                    cur.execute(sql.SQL("LISTEN {}").format(sql.Identifier(channel)))
+                    self.channels[channel] = set()
+                lock_subscription(cur, subscription)
+            self.channels[channel].add(subscription)
+        self.start()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Remove a subscription, UNLISTEN when it was the last on the channel."""
+        with self.lock:
+            subscribers = self.channels.get(subscription.channel)
+            if subscribers is None or subscription not in subscribers:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self.channels[subscription.channel]
+            if not self.conn or self.conn.closed:
+                return
+            with self.conn.cursor() as cur:
+                cur.execute(
+                    "SELECT pg_advisory_unlock_shared(hashtext(%s), %s)",
+                    [subscription.channel, subscription.lock_id],
+                )
+                if not subscribers:
+                    cur.execute(
+                        sql.SQL("UNLISTEN {}").format(
+                            sql.Identifier(subscription.channel)
+                        )
+                    )
+
+    def subscriber_count(self, channel: str) -> int:
+        """Number of websockets in this worker subscribed to a channel."""
+        with self.lock:
+            return len(self.channels.get(channel, ()))
+
+    def get_queue_status(self, osm_type: str, osm_id: int) -> StrDict | None:
+        """Queue status for a place from the shared snapshot."""
+        return self.queue_status.get((osm_type, osm_id))
+
+    def dispatch(self) -> None:
+        """Read notifications and pass them to the subscribers."""
+        with self.lock:
+            assert self.conn
+            self.conn.poll()
+            while self.conn.notifies:
+                notify = self.conn.notifies.pop(0)
+                for subscription in self.channels.get(notify.channel, ()):
+                    subscription.messages.put(notify.payload)
+
+    def refresh_queue_status(self) -> None:
+        """Rebuild the queue snapshot if it is due and anybody is watching."""
+        now = time.monotonic()
+        if (
+            not self.refresh_jobs
+            or not self.channels
+            or now - self.queue_status_at < queue_status_interval
+        ):
+            return
+        self.queue_status_at = now
+        self.queue_status = {
+            (job["osm_type"], job["osm_id"]): {
+                "status": job["status"],
+                "jobs_ahead": index,
+            }
+            for index, job in enumerate(self.refresh_jobs())
+        }
+
+    def wait(self) -> None:
+        """Wait for notifications or the next queue refresh.
+
+        With nobody subscribed there is no refresh due, so the wait is a full
+        interval.
+
+        Reconnects first if the connection has gone. A connection that fails
+        is closed and dropped, unless subscribe has already replaced it.
+        """
+        with self.lock:
+            if self.conn is None or self.conn.closed:
+                self.connect()
+            conn = self.conn
+            watched = bool(self.channels)
+        assert conn
+        if self.refresh_jobs and watched:
+            timeout = max(
+                0.0, self.queue_status_at + queue_status_interval - time.monotonic()
+            )
+        else:  # no snapshot to refresh, don't wake up early
+            timeout = queue_status_interval
+        try:
+            readable, _, _ = select.select([conn], [], [], timeout)
+            if readable:
+                self.dispatch()
+        except psycopg2.Error:
+            with self.lock:
+                if self.conn is conn:
+                    self.conn = None
+            conn.close()
+            raise
+        self.refresh_queue_status()
+
+    def run(self) -> None:
+        """Hub thread: wait for notifications, reconnecting if the connection drops."""
+        while True:
+            try:
+                self.wait()
+            except Exception:
+                print(traceback.format_exc())
+                time.sleep(reconnect_delay)
+
+
+def lock_subscription(
+    cur: psycopg2.extensions.cursor, subscription: Subscription
+) -> None:
+    """Take the shared advisory lock that marks a subscriber to a channel."""
+    cur.execute(
+        "SELECT pg_advisory_lock_shared(hashtext(%s), %s)",
+        [subscription.channel, subscription.lock_id],
+    )
+
+
+hub: NotifyHub | None = None
+hub_lock = threading.Lock()
+
+
+def get_hub(
+    db_url: str, refresh_jobs: typing.Callable[[], list[StrDict]] | None = None
+) -> NotifyHub:
+    """The hub for this process, created on first use."""
+    global hub
+
+    with hub_lock:
+        if hub is None:
+            hub = NotifyHub(db_url, refresh_jobs)
+        return hub
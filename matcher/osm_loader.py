@@ -0,0 +1,311 @@
+"""Load Overpass XML into the place tables without running osm2pgsql.
+
+Builds the same {prefix}_point, _line, _polygon and _relation tables as
+data/matcher.lua. For a small place starting osm2pgsql, filling the slim
+tables and building the indexes costs more than loading the data.
+"""
+
+import io
+import typing
+
+import lxml.etree
+
+Coord = tuple[float, float]
+Tags = dict[str, str]
+
+index_threshold = 10_000  # rows, smaller loads skip the GiST and GIN indexes
+
+# Same as polygon_keys in data/matcher.lua
+polygon_keys = {
+    "abandoned:aeroway",
+    "abandoned:amenity",
+    "abandoned:building",
+    "abandoned:landuse",
+    "abandoned:power",
+    "aeroway",
+    "amenity",
+    "area",
+    "area:highway",
+    "building",
+    "harbour",
+    "historic",
+    "landuse",
+    "leisure",
+    "man_made",
+    "military",
+    "natural",
+    "office",
+    "place",
+    "power",
+    "public_transport",
+    "shop",
+    "sport",
+    "tourism",
+    "water",
+    "waterway",
+    "wetland",
+}
+
+# 'key' and 'key=value' tokens for the tags, values split on semicolons, like
+# tag_tokens in data/matcher.lua. Filtering with tag_tokens && array[...] can
+# use a GIN index, unlike an hstore test for each tag.
+tag_tokens_sql = (
+    "array(select distinct t from each({0}) e, lateral ("
+    "select e.key union all select e.key || '=' || v "
+    "from unnest(string_to_array(e.value, ';')) v) x(t))"
+)
+
+table_geometry_type = {
+    "point": "Point",
+    "line": "LineString",
+    "polygon": "Polygon",
+    "relation": "Geometry",
+}
+
+
+def hstore_literal(tags: Tags) -> str:
+    """Tags in hstore text format."""
+
+    def quote(s: str) -> str:
+        return '"' + s.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+    return ", ".join(f"{quote(k)}=>{quote(v)}" for k, v in tags.items())
+
+
+def copy_line(values: typing.Iterable[typing.Any]) -> str:
+    """Row in COPY text format."""
+    fields = []
+    for value in values:
+        if value is None:
+            fields.append("\\N")
+            continue
+        if isinstance(value, bool):
+            value = "t" if value else "f"
+        fields.append(
+            str(value)
+            .replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+        )
+    return "\t".join(fields) + "\n"
+
+
+def coords_wkt(coords: list[Coord]) -> str:
+    """Coordinate list in WKT."""
+    return ",".join(f"{lon} {lat}" for lon, lat in coords)
+
+
+def is_area(tags: Tags, node_ids: list[int]) -> bool:
+    """Way should be a polygon, same rules as is_area in data/matcher.lua."""
+    if len(node_ids) < 2 or node_ids[0] != node_ids[-1] or tags.get("area") == "no":
+        return False
+    return tags.get("area") == "yes" or any(key in tags for key in polygon_keys)
+
+
+class OsmData:
+    """OSM objects parsed from one or more Overpass XML files.
+
+    Objects that appear in more than one file are only kept once.
+    """
+
+    def __init__(self) -> None:
+        """Init."""
+        self.node_coords: dict[int, Coord] = {}
+        self.node_tags: dict[int, Tags] = {}
+        self.way_nodes: dict[int, list[int]] = {}
+        self.way_tags: dict[int, Tags] = {}
+        self.relations: dict[int, tuple[Tags, list[tuple[str, int]]]] = {}
+
+    def parse(self, filename: str) -> None:
+        """Parse an OSM XML file."""
+        context = lxml.etree.iterparse(
+            filename, events=("end",), tag=("node", "way", "relation")
+        )
+        for _, elem in context:
+            osm_id = int(elem.get("id"))
+            tags = {tag.get("k"): tag.get("v") for tag in elem.iterfind("tag")}
+            if elem.tag == "node":
+                lon, lat = float(elem.get("lon")), float(elem.get("lat"))
+                self.node_coords[osm_id] = (lon, lat)
+                if tags:
+                    self.node_tags[osm_id] = tags
+            elif elem.tag == "way":
+                nodes = [int(nd.get("ref")) for nd in elem.iterfind("nd")]
+                self.way_nodes[osm_id] = nodes
+                if tags:
+                    self.way_tags[osm_id] = tags
+            elif tags:
+                members = [
+                    (member.get("type"), int(member.get("ref")))
+                    for member in elem.iterfind("member")
+                ]
+                self.relations[osm_id] = (tags, members)
+            # free the element and the finished siblings still held by the root
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+    def way_coords(self, way_id: int) -> list[Coord]:
+        """Coordinates of a way, skipping missing and repeated nodes."""
+        coords: list[Coord] = []
+        for node_id in self.way_nodes.get(way_id, []):
+            coord = self.node_coords.get(node_id)
+            if coord and (not coords or coords[-1] != coord):
+                coords.append(coord)
+        return coords
+
+    def point_rows(self) -> typing.Iterator[tuple[int, str | None, str, str]]:
+        """Rows for the point table: osm_id, name, tags, WKT."""
+        for osm_id, tags in self.node_tags.items():
+            lon, lat = self.node_coords[osm_id]
+            yield osm_id, tags.get("name"), hstore_literal(tags), f"POINT({lon} {lat})"
+
+    def way_rows(self) -> typing.Iterator[tuple[int, str | None, str, bool, str]]:
+        """Rows for the line and polygon tables: osm_id, name, tags, is_area, WKT.
+
+        The database turns an area into a polygon, an invalid polygon is loaded
+        as a line like osm2pgsql does.
+        """
+        for osm_id, tags in self.way_tags.items():
+            coords = self.way_coords(osm_id)
+            if len(coords) < 2:
+                continue
+            # a missing first or last node leaves the ring open
+            area = (
+                is_area(tags, self.way_nodes[osm_id])
+                and len(coords) >= 4
+                and coords[0] == coords[-1]
+            )
+            wkt = f"LINESTRING({coords_wkt(coords)})"
+            yield osm_id, tags.get("name"), hstore_literal(tags), area, wkt
+
+    def relation_rows(
+        self,
+    ) -> typing.Iterator[tuple[int, str | None, str, str | None, str | None]]:
+        """Rows for the relation table: osm_id, name, tags, area WKT, members WKT.
+
+        The area WKT is the linework of the member ways for a multipolygon or
+        boundary, the database assembles the area. The members WKT is the
+        geometry collection used when there is no area.
+        """
+        for osm_id, (tags, members) in self.relations.items():
+            lines = []
+            parts = []
+            for member_type, ref in members:
+                if member_type == "node" and ref in self.node_coords:
+                    lon, lat = self.node_coords[ref]
+                    parts.append(f"POINT({lon} {lat})")
+                elif member_type == "way":
+                    coords = self.way_coords(ref)
+                    if len(coords) < 2:
+                        continue
+                    lines.append(f"({coords_wkt(coords)})")
+                    parts.append(f"LINESTRING({coords_wkt(coords)})")
+
+            area_wkt = None
+            if tags.get("type") in ("multipolygon", "boundary") and lines:
+                area_wkt = f"MULTILINESTRING({','.join(lines)})"
+            members_wkt = f"GEOMETRYCOLLECTION({','.join(parts)})" if parts else None
+            yield osm_id, tags.get("name"), hstore_literal(tags), area_wkt, members_wkt
+
+
+def copy_rows(cur, table: str, columns: str, rows: typing.Iterable[tuple]) -> None:
+    """Load rows into a table with COPY."""
+    buf = io.StringIO("".join(copy_line(row) for row in rows))
+    cur.copy_expert(f"copy {table} ({columns}) from stdin", buf)
+
+
+def load_sql(prefix: str) -> list[str]:
+    """SQL to move the staged rows into the place tables."""
+    to_3857 = "ST_Transform(ST_GeomFromText({}, 4326), 3857)"
+    tokens = tag_tokens_sql.format("tags")
+    return [
+        f"""insert into {prefix}_point (osm_id, name, tags, tag_tokens, way)
+select osm_id, name, tags, {tokens}, {to_3857.format("wkt")} from load_point""",
+        f"""insert into {prefix}_polygon (osm_id, name, tags, tag_tokens, way)
+select osm_id, name, tags, {tokens}, way from (
+    select osm_id, name, tags,
+        ST_Transform(ST_MakePolygon(ST_GeomFromText(wkt, 4326)), 3857) as way
+    from load_way where is_area
+) a where ST_IsValid(way)""",
+        f"""insert into {prefix}_line (osm_id, name, tags, tag_tokens, way)
+select w.osm_id, w.name, w.tags, {tag_tokens_sql.format("w.tags")},
+    {to_3857.format("w.wkt")}
+from load_way w left join {prefix}_polygon p on p.osm_id = w.osm_id
+where p.osm_id is null""",
+        f"""insert into {prefix}_relation (osm_id, name, tags, tag_tokens, way)
+select osm_id, name, tags, {tokens}, way from (
+    select osm_id, name, tags, coalesce(
+        (
+            select ST_Multi(area) from ST_BuildArea({to_3857.format("area_wkt")}) area
+            where not ST_IsEmpty(area)
+        ),
+        {to_3857.format("members_wkt")}
+    ) as way
+    from load_relation
+) r where way is not null""",
+    ]
+
+
+def load(
+    conn, prefix: str, filenames: list[str], index_threshold: int = index_threshold
+) -> dict[str, int]:
+    """Load OSM XML files into the place tables.
+
+    Returns the number of rows in each table.
+    """
+    data = OsmData()
+    for filename in filenames:
+        data.parse(filename)
+
+    cur = conn.cursor()
+    for table, geometry_type in table_geometry_type.items():
+        cur.execute(f"drop table if exists {prefix}_{table}")
+        cur.execute(
+            f"create table {prefix}_{table} (osm_id int8 not null, name text, "
+            f"tags hstore, tag_tokens text[], "
+            f"way geometry({geometry_type}, 3857) not null)"
+        )
+
+    cur.execute(
+        "create temp table load_point "
+        "(osm_id int8, name text, tags hstore, wkt text) on commit drop"
+    )
+    cur.execute(
+        "create temp table load_way "
+        "(osm_id int8, name text, tags hstore, is_area bool, wkt text) on commit drop"
+    )
+    cur.execute(
+        "create temp table load_relation (osm_id int8, name text, tags hstore, "
+        "area_wkt text, members_wkt text) on commit drop"
+    )
+    copy_rows(cur, "load_point", "osm_id, name, tags, wkt", data.point_rows())
+    copy_rows(cur, "load_way", "osm_id, name, tags, is_area, wkt", data.way_rows())
+    copy_rows(
+        cur,
+        "load_relation",
+        "osm_id, name, tags, area_wkt, members_wkt",
+        data.relation_rows(),
+    )
+    for sql in load_sql(prefix):
+        cur.execute(sql)
+
+    counts = {}
+    for table in table_geometry_type:
+        cur.execute(f"select count(*) from {prefix}_{table}")
+        counts[table] = cur.fetchone()[0]
+
+    if sum(counts.values()) >= index_threshold:
+        for table in table_geometry_type:
+            cur.execute(f"create index on {prefix}_{table} using gist (way)")
+            cur.execute(f"create index on {prefix}_{table} using gin (tags)")
+            cur.execute(f"create index on {prefix}_{table} using gin (tag_tokens)")
+
+    conn.commit()
+    for table in table_geometry_type:
+        cur.execute(f"analyze {prefix}_{table}")
+    conn.commit()
+    cur.close()
+
+    return counts
@@ -0,0 +1,183 @@
+"""Shared store of OSM objects loaded for earlier places.
+
+Every matcher run loads OSM objects into its own {prefix}_* tables, which are
+dropped when the run finishes. With OSM_STORE enabled the objects are also
+saved in a set of shared osm_store_* tables. Coverage is recorded for each
+Overpass chunk: the part of the place inside the chunk bounding box and the
+tags that chunk was downloaded for. A later run for an area that is already
+covered by fresh data, like a county after its cities, skips Overpass and
+osm2pgsql. Its {prefix}_* names become views on the shared tables, clipped to
+the chunk bounding boxes its own Overpass queries would have used, so
+item_match_sql and get_existing query the store without any changes.
+"""
+
+import typing
+from datetime import timedelta
+
+import psycopg2
+
+from .osm_loader import tag_tokens_sql
+
+DbCursor = psycopg2.extensions.cursor
+BBox = tuple[typing.Any, typing.Any, typing.Any, typing.Any]  # south, north, west, east
+ChunkTags = tuple[BBox, list[str]]
+
+tables = {
+    "point": "Point",
+    "line": "LineString",
+    "polygon": "Polygon",
+    "relation": "Geometry",
+}
+
+default_max_age = timedelta(days=1)
+
+place_geom_sql = (
+    "(select ST_Transform(geom::geometry, 3857) from place where place_id = {})"
+)
+
+
+def envelope_sql(bbox: BBox) -> str:
+    """Chunk bounding box as an EPSG:3857 polygon."""
+    south, north, west, east = (float(i) for i in bbox)
+    return (
+        f"ST_Transform(ST_MakeEnvelope({west!r}, {south!r}, {east!r}, {north!r}, "
+        "4326), 3857)"
+    )
+
+
+def extent_sql(bboxes: list[BBox]) -> str:
+    """Area covered by a list of chunk bounding boxes."""
+    return f"ST_Union(array[{', '.join(envelope_sql(bbox) for bbox in bboxes)}])"
+
+
+def add_tag_tokens(cur: DbCursor, table: str) -> None:
+    """Add and fill the tag_tokens column for a table made before it existed."""
+    cur.execute(
+        "select 1 from information_schema.columns "
+        "where table_name = %s and column_name = 'tag_tokens'",
+        [table],
+    )
+    if cur.fetchone():
+        return
+    tokens = tag_tokens_sql.format("tags")
+    cur.execute(f"alter table {table} add column tag_tokens text[]")
+    cur.execute(f"update {table} set tag_tokens = {tokens}")
+
+
+def create_tables(cur: DbCursor) -> None:
+    """Create the shared tables if they don't exist yet."""
+    for table, geometry_type in tables.items():
+        cur.execute(
+            f"create table if not exists osm_store_{table} ("
+            "osm_id int8 primary key, name text, tags hstore, "
+            f"way geometry({geometry_type}, 3857) not null, "
+            "loaded_at timestamptz not null, tag_tokens text[])"
+        )
+        add_tag_tokens(cur, f"osm_store_{table}")
+        cur.execute(
+            f"create index if not exists osm_store_{table}_way_idx "
+            f"on osm_store_{table} using gist (way)"
+        )
+        cur.execute(
+            f"create index if not exists osm_store_{table}_tags_idx "
+            f"on osm_store_{table} using gin (tags)"
+        )
+        cur.execute(
+            f"create index if not exists osm_store_{table}_tag_tokens_idx "
+            f"on osm_store_{table} using gin (tag_tokens)"
+        )
+
+    cur.execute(
+        "create table if not exists osm_store_coverage ("
+        "id serial primary key, place_id int not null, tags text[] not null, "
+        "geom geometry(Geometry, 3857) not null, loaded_at timestamptz not null)"
+    )
+    cur.execute(
+        "create index if not exists osm_store_coverage_geom_idx "
+        "on osm_store_coverage using gist (geom)"
+    )
+
+
+def save_place(
+    cur: DbCursor, prefix: str, place_id: int, chunks: list[ChunkTags]
+) -> None:
+    """Copy the objects loaded for a place into the shared tables.
+
+    Objects already in the store are replaced with the fresh copy. For every
+    chunk the part of the place inside the chunk bounding box is recorded
+    with the tags used for that chunk's Overpass query, so later runs know
+    what the store holds.
+    """
+    create_tables(cur)
+    for table in tables:
+        cur.execute(
+            f"insert into osm_store_{table} "
+            "(osm_id, name, tags, tag_tokens, way, loaded_at) "
+            f"select distinct on (osm_id) osm_id, name, tags, tag_tokens, way, now() "
+            f"from {prefix}_{table} "
+            "on conflict (osm_id) do update set name = excluded.name, "
+            "tags = excluded.tags, tag_tokens = excluded.tag_tokens, "
+            "way = excluded.way, loaded_at = excluded.loaded_at"
+        )
+
+    place_geom = place_geom_sql.format("%s")
+    for bbox, tags in chunks:
+        if not tags:
+            continue  # nothing was downloaded for this chunk
+        cur.execute(
+            "insert into osm_store_coverage (place_id, tags, geom, loaded_at) "
+            f"select %s, %s, ST_Intersection({envelope_sql(bbox)}, {place_geom}), "
+            "now()",
+            [place_id, sorted(tags), place_id],
+        )
+
+
+def is_covered(
+    cur: DbCursor,
+    place_id: int,
+    chunks: list[ChunkTags],
+    max_age: timedelta = default_max_age,
+) -> bool:
+    """Fresh data in the store covers every chunk of the place for its tags.
+
+    The part of the place inside each chunk bounding box has to be covered by
+    coverage records that include all the tags for that chunk.
+    """
+    chunks = [(bbox, tags) for bbox, tags in chunks if tags]
+    if not chunks:
+        return False
+    create_tables(cur)
+    place_geom = place_geom_sql.format("%s")
+    for bbox, tags in chunks:
+        cur.execute(
+            "select ST_Covers((select ST_Union(c.geom) from osm_store_coverage c "
+            "where c.loaded_at > now() - %s and c.tags @> %s::text[] "
+            "and ST_Intersects(c.geom, n.geom)), n.geom) "
+            f"from (select ST_Intersection({envelope_sql(bbox)}, {place_geom})) n(geom)",
+            [max_age, sorted(tags), place_id],
+        )
+        row = cur.fetchone()
+        if not (row and row[0]):
+            return False
+    return True
+
+
+def create_place_views(cur: DbCursor, prefix: str, bboxes: list[BBox]) -> None:
+    """Make the place table names views on the objects in the store.
+
+    The views hold the objects inside the chunk bounding boxes, the same
+    extent as the Overpass queries that would have loaded the place tables.
+    """
+    extent = f"(select {extent_sql(bboxes)})"
+    for table in tables:
+        cur.execute(
+            f"create or replace view {prefix}_{table} as "
+            f"select osm_id, name, tags, way, tag_tokens from osm_store_{table} "
+            f"where ST_Intersects(way, {extent})"
+        )
+
+
+def drop_place_views(cur: DbCursor, prefix: str) -> None:
+    """Drop views created by create_place_views."""
+    for table in tables:
+        cur.execute(f"drop view if exists {prefix}_{table}")
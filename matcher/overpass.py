@@ -3,6 +3,7 @@
 import json
 import os.path
 import re
+import tempfile
 import typing
 from collections import defaultdict
 from time import sleep
@@ -18,6 +19,9 @@ re_slot_available = re.compile(
 )
 re_available_now = re.compile(r"^\d+ slots available now.$")
 
+write_block_size = 1024 * 1024  # bytes per write when saving a streamed response
+error_check_bytes = 2000  # error replies fit in this, checked at both ends
+
 name_only_tag = {
     "area=yes",
     "type=tunnel",
@@ -70,10 +74,31 @@ class OverpassError(Exception):
         self.r = r
 
 
-def run_query(oql: str, error_on_rate_limit: bool = True) -> requests.models.Response:
-    """Run overpass query."""
+class ResponseEnds(typing.NamedTuple):
+    """Start and end of a response body saved to disk."""
+
+    head: bytes
+    tail: bytes
+    size: int
+
+    @property
+    def content(self) -> bytes | None:
+        """Complete body, if it is short enough to be held in the head."""
+        return self.head if self.size <= len(self.head) else None
+
+
+def run_query(
+    oql: str, error_on_rate_limit: bool = True, stream: bool = False
+) -> requests.models.Response:
+    """Run overpass query.
+
+    With stream the body isn't read, use save_response to write it to disk.
+    """
     r = requests.post(
-        endpoint(), data=oql.encode("utf-8"), headers=user_agent_headers()
+        endpoint(),
+        data=oql.encode("utf-8"),
+        headers=user_agent_headers(),
+        stream=stream,
     )
 
     if error_on_rate_limit and r.status_code == 429 and "rate_limited" in r.text:
@@ -82,6 +107,63 @@ def run_query(oql: str, error_on_rate_limit: bool = True) -> requests.models.Res
     return r
 
 
+def save_response(
+    r: requests.models.Response, filename: str, block_size: int = write_block_size
+) -> ResponseEnds:
+    """Write a streamed response to disk in blocks, then move it into place.
+
+    Only the first and last error_check_bytes of the body are kept in memory,
+    enough for response_error to spot an error reply.
+    """
+    head = tail = b""
+    size = 0
+    fd, tmp_filename = tempfile.mkstemp(
+        dir=os.path.dirname(filename) or ".",
+        prefix=os.path.basename(filename) + ".",
+        suffix=".part",
+    )
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for block in r.iter_content(chunk_size=block_size):
+                if len(head) < error_check_bytes:
+                    head += block[: error_check_bytes - len(head)]
+                tail = (tail + block)[-error_check_bytes:]
+                size += len(block)
+                out.write(block)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        os.unlink(tmp_filename)
+        raise
+    finally:
+        r.close()
+
+    return ResponseEnds(head, tail, size)
+
+
+def response_error(ends: ResponseEnds) -> str | None:
+    """Classify an error reply from the start and end of the body.
+
+    Returns "too_busy", "runtime_error", "out_of_memory", "timeout" or
+    "server_error", None for a good reply. Overpass can add a runtime error
+    remark after partial output, so the tail is checked as well as the head.
+    """
+    if b"<!DOCTYPE html" in ends.head:
+        text = ends.head + ends.tail
+        if b"too busy" in text:
+            return "too_busy"
+        if b"<title>504 Gateway" in text:
+            return "timeout"
+        if b"runtime error" in text:
+            return "runtime_error"
+        return "server_error"
+    for part in ends.head, ends.tail:
+        if b"<remark> runtime error: Query run out of memory" in part:
+            return "out_of_memory"
+        if b"<remark> runtime error" in part:
+            return "runtime_error"
+    return None
+
+
 ElementsList = list[dict[str, typing.Any]]
 
 
@@ -359,6 +441,13 @@ def parse_status(r: requests.models.Response) -> OverpassStatus:
     }
 
 
+def free_slots(status: OverpassStatus) -> int | None:
+    """Number of query slots free now, None if the server has no rate limit."""
+    if not status["rate_limit"]:
+        return None
+    return max(status["rate_limit"] - len(status["slots"]), 0)
+
+
 def status_url() -> str:
     """Get the Overpass status URL."""
     return typing.cast(str, current_app.config["OVERPASS_URL"]) + "/api/status"
@@ -465,6 +554,36 @@ out qt tags;
     return get_elements(oql)
 
 
+def run_query_to_file(
+    oql: str, filename: str, attempts: int = 3, via_web: bool = True
+) -> bool:
+    """Run an overpass query and stream the reply to filename.
+
+    Memory use doesn't depend on the size of the reply. Runtime errors and
+    timeouts are retried, False if every attempt failed.
+    """
+    for attempt in range(attempts):
+        wait_for_slot()
+        print("calling overpass")
+        r = run_query(oql, error_on_rate_limit=False, stream=True)
+        ends = save_response(r, filename)
+        error = response_error(ends)
+        if not error:
+            return True
+
+        os.remove(filename)
+        msg = "overpass timeout" if error == "timeout" else "runtime error"
+        reply = (ends.content or ends.head + b"\n...\n" + ends.tail).decode(
+            "utf-8", errors="replace"
+        )
+        mail.error_mail(msg, oql, r, via_web=via_web, reply=reply)
+        print(msg)
+        if error == "out_of_memory":
+            return False
+
+    return False
+
+
 def run_query_persistent(
     oql: str, attempts: int = 3, via_web: bool = True
 ) -> requests.models.Response | None:
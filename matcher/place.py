@@ -2,19 +2,22 @@
 
 import json
 import math
+import multiprocessing
 import os.path
 import re
 import subprocess
 import typing
+from concurrent.futures import ProcessPoolExecutor
 from urllib.parse import urlparse, urlunparse
 from collections import Counter
 from decimal import Decimal
 from time import time
 
 import user_agents
-from flask import abort, current_app, g, redirect, url_for
+from flask import Flask, abort, current_app, g, redirect, url_for
 from geoalchemy2 import Geography, Geometry
-from sqlalchemy import cast, func, select, text
+from sqlalchemy import bindparam, cast, func, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import (
     backref,
@@ -23,6 +26,7 @@ from sqlalchemy.orm import (
     load_only,
     object_session,
     relationship,
+    selectinload,
 )
 from sqlalchemy.orm.exc import MultipleResultsFound
 from sqlalchemy.schema import Column, ForeignKey, ForeignKeyConstraint, UniqueConstraint
@@ -40,13 +44,14 @@ from . import (
     wikidata_api,
     wikipedia,
 )
-from .database import get_tables, now_utc, session
+from .database import get_tables, init_db, now_utc, session
 from .model import (
     Base,
     Changeset,
     IsA,
     Item,
     ItemCandidate,
+    ItemIsA,
     ItemTag,
     LanguageCount,
     PlaceItem,
@@ -58,7 +63,12 @@ from .overpass import oql_from_tag
 radius_default = 1_000  # in metres, only for nodes
 
 place_chunk_size = 32
+matcher_batch_size = 100  # items per candidate search query
+bulk_batch_size = 1_000  # rows per bulk INSERT
+candidate_save_interval = 100  # items between matcher checkpoints
 wikidata_unchunked_area_max = 1_000  # square kilometres
+wikidata_chunk_target_items = 1_500  # aim for chunk queries returning this many items
+wikidata_chunk_min_side = 2  # kilometres
 degrees = "(-?[0-9.]+)"
 re_box = re.compile(rf"^BOX\({degrees} {degrees},{degrees} {degrees}\)$")
 re_geonames_spring = re.compile(r"^\d[0-9A-Z_]{13} Spring$")
@@ -67,6 +77,8 @@ base_osm_url = "https://api.openstreetmap.org"
 
 overpass_types = {"way": "way", "relation": "rel", "node": "node"}
 
+candidate_columns = set(ItemCandidate.__table__.columns.keys())
+
 skip_tags = {
     "route:road",
     "highway=primary",
@@ -149,6 +161,37 @@ def bbox_chunk(bbox: BBox, n: int) -> list[BBox]:
     return chunks
 
 
+class WikidataDensity(typing.NamedTuple):
+    """Recorded Wikidata item density for a place or the place containing it."""
+
+    items_per_sq_km: float | None  # densest chunk that didn't time out
+    timeout_area: float | None  # smallest chunk that timed out, square kilometres
+
+
+def bbox_area_sq_km(bbox: BBox) -> float:
+    """Approximate area of a bounding box in square kilometres."""
+    south, north, west, east = map(float, bbox)
+    km_per_degree = 111.32
+    height = abs(north - south) * km_per_degree
+    midpoint_latitude = (south + north) / 2
+    width = abs(east - west) * km_per_degree * math.cos(math.radians(midpoint_latitude))
+    return height * width
+
+
+bbox_unnest_sql = (
+    "unnest(cast(:south as float8[]), cast(:north as float8[]), "
+    "cast(:west as float8[]), cast(:east as float8[])) "
+    "with ordinality as b(south, north, west, east, n)"
+)
+bbox_envelope_sql = "ST_MakeEnvelope(b.west, b.south, b.east, b.north, 4326)"
+
+
+def bbox_unnest_params(bboxes: list[BBox]) -> dict[str, list[Decimal]]:
+    """Query parameters for bbox_unnest_sql, one array per side."""
+    south, north, west, east = (list(side) for side in zip(*bboxes))
+    return {"south": south, "north": north, "west": west, "east": east}
+
+
 def envelope(bbox: BBox):
     """Make envelope from bbox."""
     # note: different order for coordinates, xmin first, not ymin
@@ -156,6 +199,63 @@ def envelope(bbox: BBox):
     return func.ST_MakeEnvelope(xmin, ymin, xmax, ymax, 4326)
 
 
+def candidate_row(item_id: int, candidate: typing.Any) -> dict[str, typing.Any]:
+    """Item candidate table row for a candidate found by the matcher."""
+    row = {k: v for k, v in candidate.items() if k in candidate_columns}
+    row["item_id"] = item_id
+    return row
+
+
+def bulk_upsert(
+    table: typing.Any,
+    rows: list[dict[str, typing.Any]],
+    index_elements: list[str],
+    batch_size: int = bulk_batch_size,
+) -> None:
+    """Insert rows in batches, updating the other given columns on conflict.
+
+    Rows with the same set of columns share an INSERT statement, a column that
+    is missing from a row is left alone when the row already exists.
+    """
+    by_columns: dict[frozenset[str], list[dict[str, typing.Any]]] = {}
+    for row in rows:
+        by_columns.setdefault(frozenset(row), []).append(row)
+
+    for columns, column_rows in by_columns.items():
+        insert = pg_insert(table)
+        changes = {
+            c: insert.excluded[c] for c in sorted(columns) if c not in index_elements
+        }
+        if changes:
+            stmt = insert.on_conflict_do_update(
+                index_elements=index_elements, set_=changes
+            )
+        else:
+            stmt = insert.on_conflict_do_nothing()
+        for batch in utils.chunk(column_rows, batch_size):
+            session.execute(stmt, list(batch))
+
+
+def wikidata_item_tags(v: dict[str, typing.Any]) -> set[str]:
+    """OSM tags to search for, from the Wikidata item and Wikipedia categories."""
+    tags = set(v["tags"])
+    # if wikidata says this is a place then adding tags
+    # from wikipedia can just confuse things
+    # Wikipedia articles sometimes combine a village and a windmill
+    # or a neighbourhood and a light rail station.
+    # Exception for place tags, we always add place tags from
+    # Wikipedia categories.
+    if "categories" in v:
+        is_place = any(t.startswith("place") for t in tags)
+        for t in matcher.categories_to_tags(v["categories"]):
+            if t.startswith("place") or not is_place:
+                tags.add(t)
+
+    # drop_building_tag(tags)
+
+    return tags - skip_tags
+
+
 class Place(Base):
     """Place model."""
 
@@ -559,9 +659,19 @@ class Place(Base):
         if bbox is None:
             bbox = self.bbox
 
+        items = self.query_bbox_items(bbox, want_isa=want_isa)
+        return self.filter_bbox_items(items)
+
+    def query_bbox_items(self, bbox, want_isa=None):
+        """Run the Wikidata queries for items in a bounding box.
+
+        Doesn't touch the database, so it can run in a worker thread.
+        """
         query_map = wikidata.bbox_query_map(*bbox, want_isa=want_isa)
-        items = self.items_from_wikidata(query_map, want_isa=want_isa)
+        return self.items_from_wikidata(query_map, want_isa=want_isa)
 
+    def filter_bbox_items(self, items):
+        """Drop items from a bounding box query that are outside this place."""
         # Would be nice to include OSM chunk information with each
         # item. Not doing it at this point because it means lots
         # of queries. Easier once the items are loaded into the database.
@@ -656,6 +766,8 @@ class Place(Base):
             if not t.startswith(self.prefix):
                 continue
             session.execute(text(f"drop table if exists {t}"))
+        for t in self.gis_tables:  # views on the shared OSM store
+            session.execute(text(f"drop view if exists {t}"))
         session.commit()
 
         overpass_dir = current_app.config["OVERPASS_DIR"]
@@ -737,8 +849,21 @@ class Place(Base):
     def items_with_instanceof(self):
         return [item for item in self.items if item.instanceof()]
 
-    def osm2pgsql_cmd(self, filename: str | None = None) -> list[str]:
-        """Get osm2pgsql command."""
+    @property
+    def osm2pgsql_middle_tables(self) -> set[str]:
+        """Slim mode tables kept by osm2pgsql between incremental loads."""
+        return {f"{self.prefix}_{table}" for table in ("nodes", "ways", "rels")}
+
+    def osm2pgsql_cmd(
+        self, filename: str | None = None, append: bool = False, keep_middle=False
+    ) -> list[str]:
+        """Get osm2pgsql command.
+
+        With append the file is added to the existing tables, objects already
+        loaded from an earlier chunk are replaced. The first chunk of an
+        incremental load uses keep_middle so the slim tables are available for
+        the following chunks.
+        """
         if filename is None:
             filename = self.overpass_filename
         style = os.path.join(current_app.config["DATA_DIR"], "matcher.lua")
@@ -750,11 +875,15 @@ class Place(Base):
         if parsed.username:
             netloc = f"{parsed.username}@{netloc}"
         safe_db_url = urlunparse(parsed._replace(netloc=netloc))
+        if append:
+            mode = ["--append", "--slim"]
+        elif keep_middle:
+            mode = ["--create", "--slim"]
+        else:
+            mode = ["--create", "--slim", "--drop"]
         return [
             "osm2pgsql",
-            "--create",
-            "--slim",
-            "--drop",
+            *mode,
             "--cache=500",
             "--prefix=" + self.prefix,
             "--output=flex",
@@ -791,13 +920,21 @@ class Place(Base):
         with open(self.overpass_filename, "wb") as out:
             out.write(content)
 
+    def item_overpass_tags(self) -> dict[int, set[str]]:
+        """OSM tags to search for, worked out once for each item.
+
+        The item tags plus the extra tags for the item types and the lifecycle
+        prefixed versions, like disused:shop.
+        """
+        q = self.items.options(selectinload(Item.db_tags))
+        return {
+            item.item_id: set(item.tags) | item.get_extra_tags() | item.disused_tags()
+            for item in q
+        }
+
     @property
     def all_tags(self):
-        tags = set()
-        for item in self.items:
-            tags |= set(item.tags)
-            tags |= item.get_extra_tags()
-            tags |= item.disused_tags()
+        tags = set().union(*self.item_overpass_tags().values())
         tags.difference_update(skip_tags)
         return matcher.simplify_tags(tags)
 
@@ -939,63 +1076,81 @@ class Place(Base):
         q = self.items.filter(Item.entity.isnot(None)).order_by(Item.item_id)
         return [{"id": i.item_id, "name": i.label(lang=lang)} for i in q]
 
-    def save_items(self, items, debug=None):
+    def save_items(self, items, debug=None, batch_size=bulk_batch_size):
+        """Save Wikidata items, their tags and links to this place.
+
+        Items, tags and links are written with INSERT ... ON CONFLICT in
+        batches, links to items no longer found for the place are removed with
+        a single DELETE. Returns a dict mapping QID to item ID.
+        """
         if debug is None:
 
             def debug(msg):
                 pass
 
         debug("save items")
+        session.flush()
+
         seen = {}
+        item_rows: list[dict[str, typing.Any]] = []
+        tag_item_ids: list[int] = []
+        tag_values: list[str] = []
         for qid, v in items.items():
             wikidata_id = int(qid[1:])
-            item = Item.query.get(wikidata_id)
-
-            debug(f"saving: {qid}")
+            seen[qid] = wikidata_id
 
-            if item:
-                item.location = v["location"]
-            else:
-                item = Item(item_id=wikidata_id, location=v["location"])
-                session.add(item)
+            row = {"item_id": wikidata_id, "location": v["location"]}
             for k in "enwiki", "categories", "query_label":
                 if k in v:
-                    setattr(item, k, v[k])
-
-            tags = set(v["tags"])
-            # if wikidata says this is a place then adding tags
-            # from wikipedia can just confuse things
-            # Wikipedia articles sometimes combine a village and a windmill
-            # or a neighbourhood and a light rail station.
-            # Exception for place tags, we always add place tags from
-            # Wikipedia categories.
-            if "categories" in v:
-                is_place = any(t.startswith("place") for t in tags)
-                for t in matcher.categories_to_tags(v["categories"]):
-                    if t.startswith("place") or not is_place:
-                        tags.add(t)
-
-            # drop_building_tag(tags)
-
-            tags -= skip_tags
-
-            item.tags = tags
-            if qid in seen:
-                continue
-
-            seen[qid] = item
+                    row[k] = v[k]
+            item_rows.append(row)
+
+            for tag in sorted(wikidata_item_tags(v)):
+                tag_item_ids.append(wikidata_id)
+                tag_values.append(tag)
+
+        bulk_upsert(Item.__table__, item_rows, ["item_id"], batch_size)
+        debug(f"saved {len(seen)} items")
+
+        item_ids = list(seen.values())
+        # an item gets exactly the new tags, like assigning to Item.tags
+        session.execute(
+            text(
+                "delete from item_tag where item_id = any(:item_ids) "
+                "and (item_id, tag_or_key) not in "
+                "(select unnest(cast(:tag_item_ids as integer[])), "
+                "unnest(cast(:tag_values as text[])))"
+            ),
+            {
+                "item_ids": item_ids,
+                "tag_item_ids": tag_item_ids,
+                "tag_values": tag_values,
+            },
+        )
+        tag_rows = [
+            {"item_id": item_id, "tag_or_key": tag}
+            for item_id, tag in zip(tag_item_ids, tag_values)
+        ]
+        tag_key = ["item_id", "tag_or_key"]
+        bulk_upsert(ItemTag.__table__, tag_rows, tag_key, batch_size)
 
-            existing = PlaceItem.query.filter_by(item=item, place=self).one_or_none()
-            if not existing:
-                place_item = PlaceItem(item=item, place=self)
-                session.add(place_item)
-            debug(f"saved: {qid}")
+        link_rows = [
+            {"item_id": item_id, "osm_type": self.osm_type, "osm_id": self.osm_id}
+            for item_id in item_ids
+        ]
+        link_key = ["item_id", "osm_type", "osm_id"]
+        bulk_upsert(PlaceItem.__table__, link_rows, link_key, batch_size)
+
+        session.execute(
+            text(
+                "delete from place_item where osm_type = :osm_type "
+                "and osm_id = :osm_id and item_id <> all(:item_ids)"
+            ),
+            {"osm_type": self.osm_type, "osm_id": self.osm_id, "item_ids": item_ids},
+        )
 
-        for item in self.items:
-            if item.qid in seen:
-                continue
-            link = PlaceItem.query.filter_by(item=item, place=self).one()
-            session.delete(link)
+        # objects loaded before the bulk statements are out of date
+        session.expire_all()
         debug("done")
 
         return seen
@@ -1171,6 +1326,15 @@ class Place(Base):
         )
 
     def run_matcher(self, debug=False, progress=None, want_isa=None):
+        """Run the matcher for every item in this place that isn't done.
+
+        Candidate rows are retrieved with one query per batch of items, the
+        batch size comes from MATCHER_BATCH_SIZE, a batch size of 0 means one
+        query per item. With MATCHER_WORKERS above 1 the batches are matched in
+        a pool of worker processes, candidates are still saved in item order.
+
+        Returns the number of candidate search queries.
+        """
         if want_isa is None:
             want_isa = set()
         if progress is None:
@@ -1178,111 +1342,297 @@ class Place(Base):
             def progress(candidates, item):
                 pass
 
+        batch_size = current_app.config.get("MATCHER_BATCH_SIZE", matcher_batch_size)
+        workers = current_app.config.get("MATCHER_WORKERS") or 1
+
         conn = session.bind.raw_connection()
         cur = conn.cursor()
 
+        matcher.add_tag_tokens(cur, self.prefix)
         self.existing_wikidata = matcher.get_existing(cur, self.prefix)
 
         place_items = self.matcher_query()
         total = place_items.count()
         # too many items means something has gone wrong
         assert total < 200_000
-        for num, place_item in enumerate(place_items):
-            item = place_item.item
-
-            if debug:
-                print("searching for", item.label())
-                print(item.tags)
-
-            item_isa_set = set(item.instanceof())
-            skip_item = want_isa and not (item_isa_set & want_isa)
 
-            if skip_item and item.skip_item_during_match():
-                candidates = []
-            else:
-                t0 = time()
-                candidates = matcher.find_item_matches(
-                    cur, item, self.prefix, debug=debug
-                )
-                seconds = time() - t0
-                if debug:
-                    print("find_item_matches took {:.1f}".format(seconds))
-                    print("{}: {}".format(len(candidates), item.label()))
+        stats: Counter[str] = Counter()
+        place_items = place_items.all()
+        if workers > 1:
+            found = self.iter_candidates_parallel(
+                place_items, want_isa, workers, batch_size or matcher_batch_size, stats
+            )
+        else:
+            found = self.iter_candidates(
+                cur, place_items, want_isa, batch_size, stats, debug=debug
+            )
 
+        existing = self.existing_candidates()
+        removed: list[tuple[int, int, str]] = []
+        rows: dict[tuple[int, int, str], dict[str, typing.Any]] = {}
+        done: list[int] = []
+        for num, (place_item, candidates) in enumerate(found):
+            item = place_item.item
+            item_id = item.item_id
             progress(candidates, item)
 
             # if this is a refresh we remove candidates that no longer match
             as_set = {(i["osm_type"], i["osm_id"]) for i in candidates}
-            for c in item.candidates[:]:
-                if c.edits.count():
+            for (osm_type, osm_id), has_edits in existing.get(item_id, {}).items():
+                if has_edits:
                     continue  # foreign keys mean we can't remove saved candidates
-                if (c.osm_type, c.osm_id) not in as_set:
-                    c.bad_matches.delete()
-                    session.delete(c)
-
-            if not candidates:
-                continue
+                if (osm_type, osm_id) not in as_set:
+                    removed.append((item_id, osm_id, osm_type))
 
-            for i in candidates:
-                c = ItemCandidate.query.get((item.item_id, i["osm_id"], i["osm_type"]))
-                if c:
-                    c.update(i)
-                else:
-                    c = ItemCandidate(**i, item=item)
-                    session.add(c)
+            if candidates:
+                for i in candidates:
+                    key = (item_id, i["osm_id"], i["osm_type"])
+                    rows[key] = candidate_row(item_id, i)
+                done.append(item_id)
 
-            place_item.done = True
+            if num % candidate_save_interval == 0:
+                self.save_candidates(removed, list(rows.values()), done)
+                removed, rows, done = [], {}, []
 
-            if num % 100 == 0:
-                session.commit()
+        self.save_candidates(removed, list(rows.values()), done)
 
         self.item_count = self.items.count()
         self.candidate_count = self.items_with_candidates_count()
         session.commit()
 
         conn.close()
+        if debug:
+            print(f"candidate search queries: {stats['queries']:,d}")
+        return stats["queries"]
+
+    def existing_candidates(self) -> dict[int, dict[tuple[str, int], bool]]:
+        """Candidates already saved for items in this place.
+
+        Maps item ID to the (osm_type, osm_id) of each candidate and whether it
+        has been used in an edit.
+        """
+        sql = text(
+            "select c.item_id, c.osm_type, c.osm_id, exists("
+            "select 1 from changeset_edit e where e.item_id = c.item_id "
+            "and e.osm_id = c.osm_id and e.osm_type = c.osm_type) "
+            "from item_candidate c join place_item pi on pi.item_id = c.item_id "
+            "where pi.osm_type = :osm_type and pi.osm_id = :osm_id"
+        )
+        params = {"osm_type": self.osm_type, "osm_id": self.osm_id}
+        existing: dict[int, dict[tuple[str, int], bool]] = {}
+        for item_id, osm_type, osm_id, has_edits in session.execute(sql, params):
+            existing.setdefault(item_id, {})[(osm_type, osm_id)] = has_edits
+        return existing
+
+    def save_candidates(
+        self,
+        removed: list[tuple[int, int, str]],
+        rows: list[dict[str, typing.Any]],
+        done: list[int],
+    ) -> None:
+        """Save matcher results for a run of items and commit.
+
+        Deletes candidates that no longer match along with their bad match
+        reports, upserts the new candidates and marks the items as done, so an
+        interrupted run carries on from the last commit.
+        """
+        if removed:
+            item_ids, osm_ids, osm_types = (list(i) for i in zip(*removed))
+            params = {"item_ids": item_ids, "osm_ids": osm_ids, "osm_types": osm_types}
+            for table in "bad_match", "item_candidate":
+                session.execute(
+                    text(
+                        f"delete from {table} "
+                        "where (item_id, osm_id, osm_type) in (select "
+                        "unnest(cast(:item_ids as integer[])), "
+                        "unnest(cast(:osm_ids as bigint[])), "
+                        "unnest(cast(:osm_types as osm_type_enum[])))"
+                    ),
+                    params,
+                )
+
+        index_elements = ["item_id", "osm_id", "osm_type"]
+        bulk_upsert(ItemCandidate.__table__, rows, index_elements)
+
+        if done:
+            session.execute(
+                text(
+                    "update place_item set done = true "
+                    "where osm_type = :osm_type and osm_id = :osm_id "
+                    "and item_id = any(:item_ids)"
+                ),
+                {"osm_type": self.osm_type, "osm_id": self.osm_id, "item_ids": done},
+            )
+        session.commit()
+
+    @staticmethod
+    def skip_item(item: Item, want_isa: set[str]) -> bool:
+        """Item should be skipped when only matching some types of item."""
+        skip_item = want_isa and not (set(item.instanceof()) & want_isa)
+        return bool(skip_item and item.skip_item_during_match())
+
+    def iter_candidates(
+        self,
+        cur,
+        place_items: list[PlaceItem],
+        want_isa: set[str],
+        batch_size: int,
+        stats: Counter[str],
+        debug: bool = False,
+    ) -> typing.Iterator[tuple[PlaceItem, list[matcher.CandidateDict]]]:
+        """Find candidates for each item in this process."""
+        batch_rows = {}
+        for num, place_item in enumerate(place_items):
+            item = place_item.item
+
+            if debug:
+                print("searching for", item.label())
+                print(item.tags)
+
+            if batch_size and num % batch_size == 0:
+                batch = [
+                    i.item
+                    for i in place_items[num : num + batch_size]
+                    if not self.skip_item(i.item, want_isa)
+                ]
+                batch_rows = matcher.find_candidate_rows(cur, batch, self.prefix)
+                stats["queries"] += 1 if batch else 0
+
+            if self.skip_item(item, want_isa):
+                yield place_item, []
+                continue
+
+            t0 = time()
+            candidates = matcher.find_item_matches(
+                cur,
+                item,
+                self.prefix,
+                debug=debug,
+                rows=batch_rows.get(item.item_id) if batch_size else None,
+            )
+            if not batch_size:
+                stats["queries"] += 2
+            seconds = time() - t0
+            if debug:
+                print("find_item_matches took {:.1f}".format(seconds))
+                print("{}: {}".format(len(candidates), item.label()))
+            yield place_item, candidates
+
+    def iter_candidates_parallel(
+        self,
+        place_items: list[PlaceItem],
+        want_isa: set[str],
+        workers: int,
+        batch_size: int,
+        stats: Counter[str],
+    ) -> typing.Iterator[tuple[PlaceItem, list[matcher.CandidateDict]]]:
+        """Find candidates using a pool of worker processes.
+
+        Items are split into shards of batch_size, each worker process has its
+        own database connection. Results are yielded in the original item order.
+
+        Workers are started with spawn rather than fork, the web and job worker
+        processes run threads and have pooled connections that a forked child
+        would inherit.
+        """
+        item_ids = [
+            place_item.item_id
+            for place_item in place_items
+            if not self.skip_item(place_item.item, want_isa)
+        ]
+        shards = list(utils.chunk(item_ids, batch_size))
+        stats["queries"] += len(shards)
+        to_match = set(item_ids)
+
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_matcher_worker,
+            initargs=(dict(current_app.config),),
+        ) as executor:
+            results = executor.map(
+                match_item_batch, [self.prefix] * len(shards), shards
+            )
+            found: dict[int, list[matcher.CandidateDict]] = {}
+            for place_item in place_items:
+                if place_item.item_id not in to_match:
+                    yield place_item, []
+                    continue
+                while place_item.item_id not in found:
+                    found.update(next(results))
+                yield place_item, found.pop(place_item.item_id)
 
     def load_isa(self, progress=None) -> None:
+        """Link items in this place to their 'instance of' entities.
+
+        Existing IsA rows are looked up with one query, missing rows are
+        inserted in bulk and item_isa is brought up to date with one DELETE and
+        a bulk INSERT. Only IsA entities that are missing or empty are
+        downloaded from Wikidata.
+        """
         if progress is None:
 
             def progress(msg):
                 pass
 
-        isa_map = {
-            item.qid: [isa_qid for isa_qid in item.instanceof()] for item in self.items
-        }
-        isa_map = {qid: l for qid, l in isa_map.items() if l}
-
-        if not isa_map:
-            return
-
-        download_isa = set()
-        isa_obj_map = {}
-        for qid, isa_list in isa_map.items():
-            isa_objects = []
+        isa_map: dict[int, list[int]] = {}
+        for item in self.items.options(load_only(Item.item_id, Item.entity)):
             # some Wikidata items feature two 'instance of' statements that point to
             # the same item.
             # Example: Cambridge University Museum of Zoology (Q5025605)
             # https://www.wikidata.org/wiki/Q5025605
-            seen_isa_qid = set()
-            for isa_qid in isa_list:
-                if isa_qid in seen_isa_qid:
-                    continue
-                seen_isa_qid.add(isa_qid)
-                item_id = int(isa_qid[1:])
-                isa = IsA.query.get(item_id)
-                if not isa or not isa.entity:
-                    download_isa.add(isa_qid)
-                if not isa:
-                    isa = IsA(item_id=item_id)
-                    session.add(isa)
-                isa_obj_map[isa_qid] = isa
-                isa_objects.append(isa)
-            item = Item.query.get(qid[1:])
-            item.isa = isa_objects
-
-        for qid, entity in wikidata_api.entity_iter(download_isa):
-            isa_obj_map[qid].entity = entity
+            isa_ids = list(dict.fromkeys(int(qid[1:]) for qid in item.instanceof()))
+            if isa_ids:
+                isa_map[item.item_id] = isa_ids
+
+        if not isa_map:
+            return
+
+        all_isa_ids = sorted({isa_id for ids in isa_map.values() for isa_id in ids})
+        has_entity = dict(
+            session.execute(
+                text(
+                    "select item_id, entity is not null "
+                    "and entity::text not in ('null', '{}') "
+                    "from isa where item_id = any(:isa_ids)"
+                ),
+                {"isa_ids": all_isa_ids},
+            ).all()
+        )
+        missing = [
+            {"item_id": isa_id} for isa_id in all_isa_ids if isa_id not in has_entity
+        ]
+        bulk_upsert(IsA.__table__, missing, ["item_id"])
+
+        item_ids = [item_id for item_id, ids in isa_map.items() for _ in ids]
+        isa_ids = [isa_id for ids in isa_map.values() for isa_id in ids]
+        session.execute(
+            text(
+                "delete from item_isa where item_id = any(:items) "
+                "and (item_id, isa_id) not in (select "
+                "unnest(cast(:item_ids as integer[])), "
+                "unnest(cast(:isa_ids as integer[])))"
+            ),
+            {"items": list(isa_map), "item_ids": item_ids, "isa_ids": isa_ids},
+        )
+        links = [
+            {"item_id": item_id, "isa_id": isa_id}
+            for item_id, isa_id in zip(item_ids, isa_ids)
+        ]
+        bulk_upsert(ItemIsA.__table__, links, ["item_id", "isa_id"])
+
+        download_isa = {
+            f"Q{isa_id}" for isa_id in all_isa_ids if not has_entity.get(isa_id)
+        }
+        stmt = (
+            update(IsA.__table__)
+            .where(IsA.__table__.c.item_id == bindparam("isa_id"))
+            .values(entity=bindparam("entity"))
+        )
+        entities = wikidata_api.entity_iter(download_isa)
+        for batch in utils.chunk(entities, bulk_batch_size):
+            rows = [{"isa_id": int(qid[1:]), "entity": entity} for qid, entity in batch]
+            session.execute(stmt, rows)
 
         session.commit()
 
@@ -1332,9 +1682,8 @@ class Place(Base):
     def get_overpass(self):
         oql = self.get_oql()
         if self.area_in_sq_km < 800:
-            r = overpass.run_query_persistent(oql)
-            assert r
-            self.save_overpass(r.content)
+            ok = overpass.run_query_to_file(oql, self.overpass_filename)
+            assert ok
         else:
             self.chunk()
 
@@ -1398,11 +1747,27 @@ class Place(Base):
         return add_tags
 
     def chunk_n(self, n):
-        return [
-            chunk
-            for chunk in bbox_chunk(self.bbox, n)
-            if self.intersects_bbox(chunk)
-        ]
+        return [chunk for chunk, _ in self.chunk_cells(bbox_chunk(self.bbox, n))]
+
+    def chunk_cells(
+        self, bboxes: list[BBox], clip: bool = False
+    ) -> list[tuple[BBox, str | None]]:
+        """Grid cells that intersect this place, checked in one query.
+
+        With clip the GeoJSON of the part of the place inside each cell is
+        returned too. Cells keep the order of the bboxes.
+        """
+        if not bboxes:
+            return []
+        clip_sql = "ST_AsGeoJSON(ST_Intersection(p.geom, c.env), 4)" if clip else "null"
+        sql = text(
+            f"select c.n, {clip_sql} from place p, lateral ("
+            f"select b.n, {bbox_envelope_sql} env from {bbox_unnest_sql}"
+            ") c where p.place_id = :place_id and ST_Intersects(p.geom, c.env) "
+            "order by c.n"
+        )
+        params = {"place_id": self.place_id, **bbox_unnest_params(bboxes)}
+        return [(bboxes[n - 1], geojson) for n, geojson in session.execute(sql, params)]
 
     def intersects_bbox(self, bbox: BBox) -> bool:
         """Return whether a bounding box intersects this place's geometry."""
@@ -1419,17 +1784,20 @@ class Place(Base):
         if skip is None:
             skip = set()
         bbox_chunks = list(self.polygon_chunk(size=chunk_size))
+        chunk_tags = self.chunk_tags(bbox_chunks, skip=skip)
 
         chunks = []
         need_self = True  # include self in first non-empty chunk
-        for num, chunk in enumerate(bbox_chunks):
+        for num, (chunk, tags) in enumerate(zip(bbox_chunks, chunk_tags)):
             filename = self.chunk_filename(num, bbox_chunks)
-            oql = self.oql_for_chunk(chunk, include_self=need_self, skip=skip)
+            oql = self.oql_for_chunk(chunk, include_self=need_self, tags=tags)
             chunks.append(
                 {
                     "num": num,
                     "oql": oql,
                     "filename": filename,
+                    "bbox": chunk,
+                    "tags": sorted(tags),
                 }
             )
             if need_self and oql:
@@ -1444,41 +1812,71 @@ class Place(Base):
     def chunk(self):
         chunk_size = utils.calc_chunk_size(self.area_in_sq_km)
         chunks = self.chunk_n(chunk_size)
+        chunk_tags = self.chunk_tags(chunks)
 
         print("chunk size:", chunk_size)
 
         files = []
-        for num, chunk in enumerate(chunks):
+        for num, (chunk, tags) in enumerate(zip(chunks, chunk_tags)):
             filename = self.chunk_filename(num, len(chunks))
             # print(num, q.count(), len(tags), filename, list(tags))
             full = os.path.join("overpass", filename)
             files.append(full)
             if os.path.exists(full):
                 continue
-            oql = self.oql_for_chunk(chunk, include_self=(num == 0))
+            oql = self.oql_for_chunk(chunk, include_self=(num == 0), tags=tags)
 
-            r = overpass.run_query_persistent(oql)
-            if not r:
+            ok = overpass.run_query_to_file(oql, full)
+            if not ok:
                 print(oql)
-            assert r
-            open(full, "wb").write(r.content)
+            assert ok
 
         cmd = ["osmium", "merge"] + files + ["-o", self.overpass_filename]
         print(" ".join(cmd))
         subprocess.run(cmd)
 
-    def oql_for_chunk(self, chunk, include_self=False, skip=None):
-        skip = set(skip or [])
-        q = self.items.filter(cast(Item.location, Geometry).contained(envelope(chunk)))
+    def chunk_item_ids(self, chunks: list[BBox]) -> list[set[int]]:
+        """IDs of the items located inside each chunk, found with one query."""
+        found: list[set[int]] = [set() for _ in chunks]
+        if not chunks:
+            return found
+        sql = text(
+            f"select b.n, pi.item_id from place_item pi "
+            f"join item on item.item_id = pi.item_id, {bbox_unnest_sql} "
+            "where pi.osm_type = :osm_type and pi.osm_id = :osm_id "
+            f"and cast(item.location as geometry) @ {bbox_envelope_sql}"
+        )
+        params = {
+            "osm_type": self.osm_type,
+            "osm_id": self.osm_id,
+            **bbox_unnest_params(chunks),
+        }
+        for n, item_id in session.execute(sql, params):
+            found[n - 1].add(item_id)
+        return found
+
+    def chunk_tags(self, chunks: list[BBox], skip=None) -> list[set[str]]:
+        """Tags to search for in each chunk.
+
+        The items in every chunk are found with a single spatial join and the
+        tags for each item are worked out once, however many chunks there are.
+        """
+        skip = skip_tags | set(skip or [])
+        chunk_items = self.chunk_item_ids(chunks)
+        if not any(chunk_items):
+            return [set() for _ in chunks]
+        item_tags = self.item_overpass_tags()
+        return [
+            matcher.simplify_tags(
+                set().union(*(item_tags.get(item_id, ()) for item_id in item_ids))
+                - skip
+            )
+            for item_ids in chunk_items
+        ]
 
-        tags = set()
-        for item in q:
-            tags |= set(item.tags)
-            tags |= item.get_extra_tags()
-            tags |= item.disused_tags()
-        tags.difference_update(skip_tags)
-        tags.difference_update(skip)
-        tags = matcher.simplify_tags(tags)
+    def oql_for_chunk(self, chunk, include_self=False, skip=None, tags=None):
+        if tags is None:
+            tags = self.chunk_tags([chunk], skip=skip)[0]
         if not (tags):
             return
 
@@ -1491,32 +1889,92 @@ class Place(Base):
         return oql
 
     def chunk_count(self):
-        return sum(1 for _ in self.polygon_chunk(size=place_chunk_size))
+        return len(self.polygon_chunk(size=place_chunk_size))
 
     def geojson_chunks(self):
-        chunks = []
-        for chunk in self.polygon_chunk(size=place_chunk_size):
-            clip = func.ST_Intersection(Place.geom, envelope(chunk))
+        grid = self.polygon_grid(size=place_chunk_size)
+        return [geojson for _, geojson in self.chunk_cells(grid, clip=True)]
 
-            geojson = (
-                session.query(func.ST_AsGeoJSON(clip, 4))
-                .filter(Place.place_id == self.place_id)
-                .scalar()
-            )
-
-            chunks.append(geojson)
-        return chunks
-
-    def wikidata_chunk_size(self, size=22):
+    def wikidata_chunk_size(self, size=22, density: WikidataDensity | None = None):
         if self.osm_type == "node":
             return 1
 
         area = self.area_in_sq_km
-        if area < wikidata_unchunked_area_max and not self.wikidata_query_timeout:
+        if density and density.timeout_area and area >= density.timeout_area:
+            expect_timeout = True
+        elif density and density.items_per_sq_km:
+            expected_items = area * density.items_per_sq_km
+            expect_timeout = expected_items > wikidata_chunk_target_items
+        else:
+            expect_timeout = False
+        if (
+            area < wikidata_unchunked_area_max
+            and not self.wikidata_query_timeout
+            and not expect_timeout
+        ):
             return 1
         return utils.calc_chunk_size(area, size=size)
 
+    def wikidata_density(self, want_isa: bool = False) -> WikidataDensity | None:
+        """Item density recorded for this place, or the smallest place covering it.
+
+        Used to plan the chunks for the Wikidata queries.
+        """
+        sql = text(
+            "select max(c.item_count / greatest(c.area, 1)) "
+            "filter (where not c.timed_out), "
+            "min(c.area) filter (where c.timed_out) "
+            "from wikidata_chunk c "
+            "join place p on p.osm_type = c.osm_type and p.osm_id = c.osm_id "
+            "where c.want_isa = :want_isa and (p.place_id = :place_id or ST_Covers("
+            "p.geom, (select geom from place where place_id = :place_id))) "
+            "group by p.place_id, p.area "
+            "order by p.place_id = :place_id desc, p.area limit 1"
+        )
+        params = {"want_isa": want_isa, "place_id": self.place_id}
+        row = session.execute(sql, params).first()
+        return WikidataDensity(*row) if row else None
+
+    def wikidata_chunk_side(
+        self, default_size: float, density: WikidataDensity | None
+    ) -> float:
+        """Side of a Wikidata query chunk in kilometres.
+
+        Chosen from the recorded item density so each chunk returns about
+        wikidata_chunk_target_items items, and smaller than any chunk that
+        timed out before.
+        """
+        if not density:
+            return default_size
+        side = default_size * 4
+        if density.items_per_sq_km:
+            side = math.sqrt(wikidata_chunk_target_items / density.items_per_sq_km)
+        if density.timeout_area:
+            side = min(side, math.sqrt(density.timeout_area) / 2)
+        return max(wikidata_chunk_min_side, min(side, default_size * 4))
+
+    def save_wikidata_chunk_stats(
+        self, stats: list["WikidataChunkStat"], want_isa: bool
+    ) -> None:
+        """Record the results of Wikidata chunk queries for planning later runs."""
+        for bbox, item_count, seconds, timed_out in stats:
+            chunk = WikidataChunk(
+                osm_type=self.osm_type,
+                osm_id=self.osm_id,
+                want_isa=want_isa,
+                area=bbox_area_sq_km(bbox),
+                item_count=item_count,
+                seconds=seconds,
+                timed_out=timed_out,
+            )
+            session.add(chunk)
+        session.commit()
+
     def polygon_chunk(self, size=64):
+        return [chunk for chunk, _ in self.chunk_cells(self.polygon_grid(size=size))]
+
+    def polygon_grid(self, size=64) -> list[BBox]:
+        """Grid over the bounding box of each polygon of this place."""
         stmt = (
             session.query(func.ST_Dump(Place.geom.cast(Geometry())).label("x"))
             .filter_by(place_id=self.place_id)
@@ -1529,12 +1987,12 @@ class Place(Base):
             func.Box2D(stmt.c.x.geom),
         )
 
+        grid = []
         for num, area, box2d in q:
             chunk_size = utils.calc_chunk_size(area, size=size)
             west, south, east, north = map(float, re_box.match(box2d).groups())
-            for chunk in bbox_chunk((south, north, west, east), chunk_size):
-                if self.intersects_bbox(chunk):
-                    yield chunk
+            grid += bbox_chunk((south, north, west, east), chunk_size)
+        return grid
 
     def latest_matcher_run(self):
         return self.matcher_runs.order_by(PlaceMatcher.start.desc()).first()
@@ -1676,6 +2134,71 @@ class Place(Base):
         return items
 
 
+def init_matcher_worker(config: dict[str, typing.Any]) -> None:
+    """Set up a matcher worker process with an app context and its own engine."""
+    app = Flask("matcher_worker")
+    app.config.update(config)
+    init_db(config["DB_URL"])
+    app.app_context().push()
+
+
+def match_item_batch(
+    prefix: str, item_ids: tuple[int, ...]
+) -> list[tuple[int, list[matcher.CandidateDict]]]:
+    """Find candidates for a shard of items, runs in a matcher worker process.
+
+    The worker only reads from the database, the parent process saves the
+    candidates.
+    """
+    items = Item.query.filter(Item.item_id.in_(item_ids)).all()
+    by_id = {item.item_id: item for item in items}
+
+    conn = session.bind.raw_connection()
+    cur = conn.cursor()
+    rows = matcher.find_candidate_rows(cur, items, prefix)
+    found = [
+        (
+            item_id,
+            matcher.find_item_matches(cur, by_id[item_id], prefix, rows=rows[item_id]),
+        )
+        for item_id in item_ids
+    ]
+    conn.close()
+    session.rollback()
+    return found
+
+
+class WikidataChunkStat(typing.NamedTuple):
+    """Outcome of one Wikidata chunk query."""
+
+    bbox: BBox
+    item_count: int | None
+    seconds: float
+    timed_out: bool
+
+
+class WikidataChunk(Base):
+    """Wikidata chunk query result size and time, used to plan chunk sizes."""
+
+    __tablename__ = "wikidata_chunk"
+    id = Column(Integer, primary_key=True)
+    osm_type = Column(osm_type_enum, nullable=False)
+    osm_id = Column(BigInteger, nullable=False)
+    recorded = Column(DateTime, default=now_utc(), nullable=False)
+    want_isa = Column(Boolean, nullable=False)
+    area = Column(Float, nullable=False)  # square kilometres
+    item_count = Column(Integer)
+    seconds = Column(Float)
+    timed_out = Column(Boolean, nullable=False)
+
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ["osm_type", "osm_id"],
+            ["place.osm_type", "place.osm_id"],
+        ),
+    )
+
+
 class PlaceMatcher(Base):
     __tablename__ = "place_matcher"
     start = Column(DateTime, default=now_utc(), primary_key=True)
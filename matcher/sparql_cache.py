@@ -0,0 +1,154 @@
+"""Cache for Wikidata Query Service results.
+
+Results are gzip compressed in CACHE_DIR/sparql/<family>/<key>.json.gz. Each
+query family has its own time to live, the modification time of a file is
+the time it was saved and the access time is bumped on every hit, so pruning
+can drop the least recently used results once the cache is too big.
+"""
+
+import gzip
+import os
+import tempfile
+import time
+import typing
+from datetime import timedelta
+
+import flask
+
+default_ttl = {
+    "browse": timedelta(days=1),  # next level places on the browse pages
+    "hierarchy": timedelta(days=7),  # located in and admin area queries
+    "item_types": timedelta(days=7),  # item_types_graph
+    "default": timedelta(days=7),
+}
+default_max_bytes = 1024**3
+prune_interval = 100  # saves between size checks
+
+saves_since_prune = 0
+
+
+class Entry(typing.NamedTuple):
+    """Cached query result file."""
+
+    family: str
+    key: str
+    path: str
+    size: int
+    saved: float
+    accessed: float
+
+
+def cache_root() -> str:
+    """Directory holding the cached results."""
+    return os.path.join(flask.current_app.config["CACHE_DIR"], "sparql")
+
+
+def get_ttl(family: str) -> timedelta:
+    """Time to live for a query family, SPARQL_CACHE_TTL overrides the default.
+
+    The browse family uses BROWSE_CACHE_TTL when it is set.
+    """
+    config = flask.current_app.config
+    ttl = {**default_ttl, **config.get("SPARQL_CACHE_TTL", {})}
+    if config.get("BROWSE_CACHE_TTL"):
+        ttl["browse"] = config["BROWSE_CACHE_TTL"]
+    return ttl.get(family, ttl["default"])
+
+
+def get_max_bytes() -> int:
+    """Size limit for the cache."""
+    max_bytes: int = flask.current_app.config.get(
+        "SPARQL_CACHE_MAX_BYTES", default_max_bytes
+    )
+    return max_bytes
+
+
+def entry_path(family: str, key: str) -> str:
+    """Filename for a cached result."""
+    return os.path.join(cache_root(), family, key + ".json.gz")
+
+
+def get(family: str, key: str, ttl: timedelta | None = None) -> bytes | None:
+    """Cached result, None if it is missing, expired or unreadable."""
+    path = entry_path(family, key)
+    try:
+        saved = os.stat(path).st_mtime
+        if time.time() - saved > (ttl or get_ttl(family)).total_seconds():
+            return None
+        with gzip.open(path, "rb") as f:
+            data = f.read()
+        os.utime(path, (time.time(), saved))
+    except (OSError, EOFError):
+        return None
+    return data
+
+
+def put(family: str, key: str, data: bytes) -> None:
+    """Save a result, written to a temporary file and renamed into place."""
+    global saves_since_prune
+
+    path = entry_path(family, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f, gzip.GzipFile(fileobj=f, mode="wb") as gz:
+            gz.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+    saves_since_prune += 1
+    if saves_since_prune >= prune_interval:
+        saves_since_prune = 0
+        prune()
+
+
+def entries() -> list[Entry]:
+    """Every cached result."""
+    root = cache_root()
+    if not os.path.isdir(root):
+        return []
+    found = []
+    for family in sorted(os.listdir(root)):
+        family_dir = os.path.join(root, family)
+        for entry in os.scandir(family_dir):
+            if not entry.name.endswith(".json.gz"):
+                continue
+            st = entry.stat()
+            key = entry.name[: -len(".json.gz")]
+            found.append(
+                Entry(family, key, entry.path, st.st_size, st.st_mtime, st.st_atime)
+            )
+    return found
+
+
+def prune(max_bytes: int | None = None, expired: bool = True) -> list[Entry]:
+    """Remove expired results and the least recently used beyond max_bytes.
+
+    Returns the removed entries.
+    """
+    if max_bytes is None:
+        max_bytes = get_max_bytes()
+    now = time.time()
+    removed = []
+    keep = []
+    for entry in entries():
+        if expired and now - entry.saved > get_ttl(entry.family).total_seconds():
+            removed.append(entry)
+        else:
+            keep.append(entry)
+
+    total = sum(entry.size for entry in keep)
+    for entry in sorted(keep, key=lambda entry: entry.accessed):
+        if total <= max_bytes:
+            break
+        removed.append(entry)
+        total -= entry.size
+
+    for entry in removed:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+    return removed
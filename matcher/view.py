@@ -2347,6 +2347,7 @@ def single_item_match(osm_type: str, osm_id: int, item_id: int) -> Response | st
     conn = database.session.bind.raw_connection()
     cur = conn.cursor()
 
+    matcher.add_tag_tokens(cur, place.prefix)
     candidates = matcher.find_item_matches(cur, item, place.prefix, debug=False)
 
     for c in candidates:
@@ -2,19 +2,27 @@
 
 import json
 import re
-import select
 import traceback
 
-import psycopg2
 import requests
 from flask import current_app, g, request
 from flask_login import current_user
 from flask_sock import Sock
 from lxml import etree
 from procrastinate.exceptions import AlreadyEnqueued
+from sqlalchemy import text
 from sqlalchemy.orm.attributes import flag_modified
 
-from . import database, edit, jobs, mail, tasks, wikidata_api, wikidata_edit
+from . import (
+    database,
+    edit,
+    jobs,
+    mail,
+    notify_hub,
+    tasks,
+    wikidata_api,
+    wikidata_edit,
+)
 from .model import ChangesetEdit, ItemCandidate
 from .place import Place
 from .procrastinate_app import procrastinate_app
@@ -81,15 +89,36 @@ def recent_matcher_messages(place: Place) -> list[str]:
     return messages
 
 
-def queue_status_message(osm_type: str, osm_id: int) -> str | None:
-    """Build a websocket queue status message for a place."""
+def queue_status_message(
+    osm_type: str, osm_id: int, hub: notify_hub.NotifyHub | None = None
+) -> str | None:
+    """Build a websocket queue status message for a place.
 
-    status = jobs.get_queue_status(osm_type, osm_id)
+    With a hub the status comes from its shared snapshot instead of a query.
+    """
+    if hub:
+        status = hub.get_queue_status(osm_type, osm_id)
+    else:
+        status = jobs.get_queue_status(osm_type, osm_id)
     if status is None:
         return None
     return json.dumps({"type": "queue_status", **status})
 
 
+def get_notify_hub() -> notify_hub.NotifyHub:
+    """LISTEN hub for this web worker, shared by every matcher websocket."""
+    app = current_app._get_current_object()
+
+    def refresh_jobs():
+        with app.app_context():
+            try:
+                return jobs.get_queue_snapshot()
+            finally:
+                database.session.remove()
+
+    return notify_hub.get_hub(app.config["DB_URL"], refresh_jobs)
+
+
 def reject_anonymous_matcher(ws_sock) -> bool:
     """Reject an anonymous matcher socket before it can enqueue a job."""
     if current_user.is_authenticated:
@@ -110,7 +139,7 @@ def reject_anonymous_matcher(ws_sock) -> bool:
 def ws_matcher(ws_sock, osm_type, osm_id):
     """Run matcher for given place."""
     place = None
-    listen_conn = None
+    subscription = None
 
     def send(msg):
         return ws_sock.send(msg)
@@ -139,26 +168,24 @@ def ws_matcher(ws_sock, osm_type, osm_id):
         user_agent = request.headers.get("User-Agent")
         user_id = current_user.id
 
-        channel = f"matcher_{osm_type}_{osm_id}"
-        db_url = current_app.config["DB_URL"]
+        channel = jobs.matcher_channel(osm_type, osm_id)
 
-        # Set up LISTEN before deferring so we don't miss any notifications.
+        # Subscribe before deferring so we don't miss any notifications.
 
-        listen_conn = psycopg2.connect(
-            db_url,
-            application_name=jobs.subscriber_application_name(osm_type, osm_id),
-        )
-        listen_conn.autocommit = True
-        listen_cur = listen_conn.cursor()
-        listen_cur.execute(f"LISTEN {channel}")
+        hub = get_notify_hub()
+        subscription = hub.subscribe(channel)
         send(json.dumps({"type": "connected"}))
 
         # Defer the matcher task. Use lock+queueing_lock so at most one job
         # runs at a time and at most one more can be queued.
 
+        # The lock is transaction level: the commit or rollback releases it, so
+        # it can't stay held on a pooled connection if something fails.
+
         job_already_exists = False
-        listen_cur.execute("SELECT pg_advisory_lock(hashtext(%s))", [channel])
+        advisory_lock = "SELECT pg_advisory_xact_lock(hashtext(:channel))"
         try:
+            database.session.execute(text(advisory_lock), {"channel": channel})
             if jobs.get_queue_status(osm_type, osm_id) is None:
                 try:
                     procrastinate_app.configure_task(
@@ -180,8 +207,10 @@ def ws_matcher(ws_sock, osm_type, osm_id):
                     job_already_exists = True
             else:
                 job_already_exists = True
-        finally:
-            listen_cur.execute("SELECT pg_advisory_unlock(hashtext(%s))", [channel])
+        except BaseException:
+            database.session.rollback()
+            raise
+        database.session.commit()
 
         if job_already_exists:
             # A job is already queued or running – just listen for updates.
@@ -193,24 +222,27 @@ def ws_matcher(ws_sock, osm_type, osm_id):
             send(queue_message)
 
         while ws_sock.connected:
-            readable, _, _ = select.select([listen_conn], [], [], QUEUE_STATUS_INTERVAL)
-            if readable:
-                listen_conn.poll()
-                while listen_conn.notifies and ws_sock.connected:
-                    notify = listen_conn.notifies.pop(0)
-                    item = notify.payload
-                    send(item)
-                    if not ws_sock.connected:
-                        break
-                    reply = ws_sock.receive()
-                    if reply is None:
-                        break
-                    data = json.loads(item)
-                    if data["type"] in ("done", "failed"):
-                        return
+            item = subscription.get(timeout=QUEUE_STATUS_INTERVAL)
+            if subscription.take_missed():
+                # The hub reconnected, progress sent in the meantime is lost.
+                if jobs.get_queue_status(osm_type, osm_id) is None:
+                    send(json.dumps({"type": "done"}))
+                    return
+                for msg in recent_matcher_messages(place):
+                    send(msg)
+            if item is not None:
+                send(item)
+                if not ws_sock.connected:
+                    break
+                reply = ws_sock.receive()
+                if reply is None:
+                    break
+                data = json.loads(item)
+                if data["type"] in ("done", "failed"):
+                    return
             else:
                 # Keep the queue position fresh while also keeping the socket alive.
-                queue_message = queue_status_message(osm_type, osm_id)
+                queue_message = queue_status_message(osm_type, osm_id, hub)
                 send(queue_message or json.dumps({"type": "ping"}))
                 if not ws_sock.connected:
                     break
@@ -235,8 +267,8 @@ exception in matcher websocket
 """
         mail.send_traceback(info)
     finally:
-        if listen_conn:
-            listen_conn.close()
+        if subscription:
+            subscription.close()
 
 
 def check_if_already_tagged(r, osm) -> bool:
@@ -2,7 +2,6 @@
 
 import hashlib
 import json
-import os
 import random
 import re
 import typing
@@ -16,9 +15,9 @@ import requests.exceptions
 from flask import render_template, render_template_string, request
 
 from . import (Entity, commons, language, mail, match, matcher, overpass,
-               user_agent_headers)
+               sparql_cache, user_agent_headers)
 from .language import get_language_label
-from .utils import cache_filename, drop_start
+from .utils import drop_start
 from .wikimedia_api_logging import logged_post
 from .wikidata_api import (
     QueryError,
@@ -761,23 +760,27 @@ def run_query(
     name: str | None = None,
     timeout: int | None = None,
     send_error_mail: bool = False,
+    family: str = "default",
 ) -> list[QueryRow]:
-    """Run query, return JSON."""
-    filename: str
+    """Run query, return JSON.
+
+    With a name the result is kept in the SPARQL cache, expiring after the
+    TTL of the given query family.
+    """
     bindings: list[QueryRow]
     if name:
-        filename = cache_filename(name + ".json")
-        if os.path.exists(filename):
+        data = sparql_cache.get(family, name)
+        if data is not None:
             try:
-                bindings = json.load(open(filename))["results"]["bindings"]
-            except json.decoder.JSONDecodeError:
+                bindings = json.loads(data)["results"]["bindings"]
+            except (json.decoder.JSONDecodeError, KeyError):
                 pass
             else:
                 return bindings
 
     r = run_query_raw(query, name, timeout, send_error_mail)
     if name:
-        open(filename, "wb").write(r.content)
+        sparql_cache.put(family, name, r.content)
     bindings = r.json()["results"]["bindings"]
     return bindings
 
@@ -1347,7 +1350,7 @@ def item_types_graph(
 ) -> dict[str, dict[str, set | str]]:
     if rows is None:
         query = query_for_items(item_types_tree, items)
-        rows = run_query(query, name=name, send_error_mail=False)
+        rows = run_query(query, name=name, send_error_mail=False, family="item_types")
     graph = {}
     for row in rows:
         item_qid = wd_to_qid(row["item"])
@@ -1795,10 +1798,10 @@ def row_to_item(row: QueryRow) -> Item:
     }
 
 
-def run_query_with_cache(query: str) -> list[QueryRow]:
+def run_query_with_cache(query: str, family: str = "hierarchy") -> list[QueryRow]:
     """Run query and cache results."""
     md5_query = md5sum(query)
-    return run_query(query, name=md5_query)
+    return run_query(query, name=md5_query, family=family)
 
 
 def items_from_query(query: str, qid: str) -> list[Item]:
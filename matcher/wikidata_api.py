@@ -1,19 +1,23 @@
 import json
 import os
+import threading
 import time
 import typing
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import flask
 import requests
+import requests.adapters
 import requests.exceptions
 import simplejson.errors
 
-from . import Entity, mail, user_agent_headers, wikidata_oauth
+from . import Entity, entity_cache, mail, user_agent_headers, wikidata_oauth
 from .utils import chunk
 from .wikimedia_api_logging import logged_get, logged_request
 
 wikidata_url = "https://www.wikidata.org/w/api.php"
 page_size = 50
+entity_workers = 1  # wbgetentities requests in flight, WIKIDATA_API_WORKERS
 
 
 class TooManyEntities(Exception):
@@ -22,6 +26,18 @@ class TooManyEntities(Exception):
     pass
 
 
+class EntityFetchError(Exception):
+    """wbgetentities reply without any entities."""
+
+    def __init__(self, r: requests.Response) -> None:
+        """Init."""
+        self.r = r
+
+    def __str__(self) -> str:
+        """Return the start of the reply."""
+        return f"error fetching wikidata entities: {self.r.text[:300]}"
+
+
 CallParams = typing.Mapping[str, str | int]
 RetryCallback = typing.Callable[[int, int, int], None]
 
@@ -62,14 +78,25 @@ class QueryServiceUnavailable(QueryError):
     """The Wikidata Query Service is temporarily unavailable."""
 
 
-def api_call(params: CallParams) -> requests.Response:
-    """Call the wikidata API."""
+def api_call(
+    params: CallParams, session: requests.Session | None = None
+) -> requests.Response:
+    """Call the wikidata API.
+
+    Uses the given session, otherwise the OAuth session of the current user
+    if there is one.
+    """
     call_params: CallParams = {
         "format": "json",
         "formatversion": 2,
         **params,
     }
 
+    if session is not None:
+        return logged_request(
+            session, "GET", wikidata_url, params=call_params, timeout=10
+        )
+
     oauth_session = wikidata_oauth.get_request_session()
     if oauth_session is not None:
         return logged_request(
@@ -84,57 +111,218 @@ def api_call(params: CallParams) -> requests.Response:
     return r
 
 
+class Backoff:
+    """Retry-After delay shared by threads fetching pages of entities."""
+
+    def __init__(self) -> None:
+        """Init."""
+        self.lock = threading.Lock()
+        self.resume_at = 0.0
+
+    def wait(self) -> None:
+        """Sleep until the last Retry-After delay has passed."""
+        with self.lock:
+            delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def delay(self, seconds: int) -> None:
+        """Hold back every thread for the given number of seconds."""
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+
+def pooled_session(workers: int) -> requests.Session:
+    """Session with a connection for each worker thread."""
+    session = requests.Session()
+    session.headers.update(user_agent_headers())
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_entity_workers() -> int:
+    """Number of concurrent wbgetentities requests from the app config."""
+    if not flask.has_app_context():
+        return entity_workers
+    workers: int = flask.current_app.config.get("WIKIDATA_API_WORKERS", entity_workers)
+    return max(1, workers)
+
+
+def fetch_entity_page(
+    ids: tuple[str, ...],
+    attempts: int = 5,
+    retry_callback: RetryCallback | None = None,
+    session: requests.Session | None = None,
+    backoff: Backoff | None = None,
+) -> list[tuple[str, dict[str, typing.Any]]]:
+    """Fetch one page of entities, retrying truncated and rate-limited requests.
+
+    Requested IDs missing from the reply are returned as missing entities, the
+    same way wbgetentities reports a deleted item. A reply without entities
+    raises EntityFetchError, this can run in a worker thread without an app
+    context so the caller reports it.
+    """
+    params: CallParams = {"action": "wbgetentities", "ids": "|".join(ids)}
+    for attempt in range(attempts):
+        if backoff:
+            backoff.wait()
+        try:
+            if session is None:
+                r = api_call(params)
+            else:
+                r = api_call(params, session=session)
+        except requests.exceptions.ChunkedEncodingError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(1)
+            continue
+
+        if r.status_code != 429 or attempt == attempts - 1:
+            break
+
+        try:
+            delay = max(1, int(r.headers.get("Retry-After", "60")))
+        except ValueError:
+            delay = 60
+        if backoff:
+            backoff.delay(delay)
+        if retry_callback is not None:
+            retry_callback(delay, attempt + 1, attempts)
+        time.sleep(delay)
+
+    r.raise_for_status()
+    json_data = r.json()
+    if "entities" not in json_data:
+        raise EntityFetchError(r)
+
+    entities: dict[str, dict[str, typing.Any]] = json_data["entities"]
+    found = set(entities)
+    for entity in entities.values():
+        if "redirects" in entity:
+            found.add(entity["redirects"]["from"])
+
+    page = list(entities.items())
+    page += [(qid, {"id": qid, "missing": ""}) for qid in ids if qid not in found]
+    return page
+
+
 def entity_iter(
-    ids: set[str],
+    ids: typing.Collection[str],
     debug: bool = False,
     attempts: int = 5,
     retry_callback: RetryCallback | None = None,
+    workers: int | None = None,
 ) -> typing.Iterator[tuple[str, dict[str, typing.Any]]]:
-    """Yield Wikidata entities, retrying truncated and rate-limited requests."""
-    for num, cur in enumerate(chunk(ids, page_size)):
+    """Yield Wikidata entities, retrying truncated and rate-limited requests.
+
+    Entities in the local entity cache that haven't been edited since they
+    were saved come from the cache, the rest are downloaded and cached.
+
+    With more than one worker, pages of entities are fetched concurrently on a
+    shared session and yielded as they arrive. Every requested ID is yielded,
+    an ID unknown to Wikidata comes back as a missing entity.
+    """
+    cache = entity_cache.get_entity_cache()
+    if cache is None:
+        for page in fetch_entity_pages(ids, debug, attempts, retry_callback, workers):
+            yield from page
+        return
+
+    try:
+        cached = cache.current(ids, get_lastrevids)
+        yield from cached.items()
+        missing = [qid for qid in ids if qid not in cached]
+        for page in fetch_entity_pages(
+            missing, debug, attempts, retry_callback, workers
+        ):
+            cache.put_many(entity for _, entity in page)
+            yield from page
         if debug:
-            print(f"entity_iter: {num * page_size}/{len(ids)}")
-        str_ids = "|".join(cur)
-        for attempt in range(attempts):
-            try:
-                r = api_call({"action": "wbgetentities", "ids": str_ids})
-            except requests.exceptions.ChunkedEncodingError:
-                if attempt == attempts - 1:
-                    raise
-                time.sleep(1)
-                continue
+            print(f"entity cache: {dict(cache.stats)}")
+    finally:
+        cache.close()
 
-            if r.status_code != 429 or attempt == attempts - 1:
-                break
 
-            try:
-                delay = max(1, int(r.headers.get("Retry-After", "60")))
-            except ValueError:
-                delay = 60
-            if retry_callback is not None:
-                retry_callback(delay, attempt + 1, attempts)
-            time.sleep(delay)
+def fetch_entity_pages(
+    ids: typing.Collection[str],
+    debug: bool = False,
+    attempts: int = 5,
+    retry_callback: RetryCallback | None = None,
+    workers: int | None = None,
+) -> typing.Iterator[list[tuple[str, dict[str, typing.Any]]]]:
+    """Download entities from Wikidata, yield each page of results.
+
+    A reply without entities is reported by mail from the calling thread.
+    """
+    try:
+        yield from download_entity_pages(ids, debug, attempts, retry_callback, workers)
+    except EntityFetchError as e:
+        mail.send_mail("error fetching wikidata entities", e.r.text)
+        raise
 
-        r.raise_for_status()
-        json_data = r.json()
-        if "entities" not in json_data:
-            mail.send_mail("error fetching wikidata entities", r.text)
 
-        for qid, entity in json_data["entities"].items():
-            yield qid, entity
+def download_entity_pages(
+    ids: typing.Collection[str],
+    debug: bool = False,
+    attempts: int = 5,
+    retry_callback: RetryCallback | None = None,
+    workers: int | None = None,
+) -> typing.Iterator[list[tuple[str, dict[str, typing.Any]]]]:
+    """Fetch the pages of entities, concurrently with more than one worker."""
+    if workers is None:
+        workers = get_entity_workers()
+    pages = list(chunk(ids, page_size))
+
+    if workers <= 1 or len(pages) <= 1:
+        for num, cur in enumerate(pages):
+            if debug:
+                print(f"entity_iter: {num * page_size}/{len(ids)}")
+            yield fetch_entity_page(cur, attempts, retry_callback)
+        return
+
+    session = wikidata_oauth.get_request_session() or pooled_session(workers)
+    backoff = Backoff()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = [
+            executor.submit(
+                fetch_entity_page, cur, attempts, retry_callback, session, backoff
+            )
+            for cur in pages
+        ]
+        for num, future in enumerate(as_completed(futures)):
+            if debug:
+                print(f"entity_iter: {num * page_size}/{len(ids)}")
+            yield future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
 
 
 def get_entity(qid: str) -> Entity | None:
-    json_data = api_call({"action": "wbgetentities", "ids": qid}).json()
-
+    """Get an entity, from the entity cache if it is the latest revision."""
+    cache = entity_cache.get_entity_cache()
     try:
-        entity: Entity = list(json_data["entities"].values())[0]
-    except KeyError:
-        return None
-    if "missing" not in entity:
+        if cache:
+            cached = cache.current([qid], get_lastrevids)
+            if qid in cached:
+                return typing.cast(Entity, cached[qid])
+
+        json_data = api_call({"action": "wbgetentities", "ids": qid}).json()
+
+        try:
+            entity: Entity = list(json_data["entities"].values())[0]
+        except KeyError:
+            return None
+        if "missing" in entity:
+            return None
+
+        if cache:
+            cache.put_many([typing.cast(dict[str, typing.Any], entity)])
         return entity
-
-    return None
+    finally:
+        if cache:
+            cache.close()
 
 
 def get_lastrevid(qid: str) -> int:
@@ -156,7 +344,11 @@ def get_lastrevids(qid_list: list[str]) -> dict[str, int]:
     json_data = r.json()
     if "query" not in json_data:
         print(r.text)
-    return {page["title"]: page["lastrevid"] for page in json_data["query"]["pages"]}
+    return {
+        page["title"]: page["lastrevid"]
+        for page in json_data["query"]["pages"]
+        if "lastrevid" in page  # missing pages have no revision
+    }
 
 
 def get_entities(ids: list[str], attempts: int = 5) -> list[Entity]:
@@ -181,7 +373,31 @@ def get_entities(ids: list[str], attempts: int = 5) -> list[Entity]:
 
 
 def get_entity_with_cache(qid: str) -> Entity:
-    """Get an item from Wikidata."""
+    """Get an item from Wikidata, using the entity cache.
+
+    Without the entity cache the JSON file cache in CACHE_DIR is used. A QID
+    unknown to Wikidata comes back as a missing entity.
+    """
+    if not entity_cache.cache_enabled():
+        return get_entity_with_file_cache(qid)
+    entity = get_entity(qid)
+    if entity is None:
+        return typing.cast(Entity, {"id": qid, "missing": ""})
+    return entity
+
+
+def get_entities_with_cache(qids: list[str]) -> list[Entity]:
+    """Get items from Wikidata, using the entity cache.
+
+    Without the entity cache the JSON file cache in CACHE_DIR is used.
+    """
+    if not entity_cache.cache_enabled():
+        return get_entities_with_file_cache(qids)
+    return [typing.cast(Entity, entity) for _, entity in entity_iter(set(qids))]
+
+
+def get_entity_with_file_cache(qid: str) -> Entity:
+    """Get an item from Wikidata, cached as a JSON file in CACHE_DIR."""
     cache_dir = flask.current_app.config["CACHE_DIR"]
     cache_filename = os.path.join(cache_dir, qid + ".json")
     entity: Entity
@@ -196,8 +412,8 @@ def get_entity_with_cache(qid: str) -> Entity:
     return entity
 
 
-def get_entities_with_cache(qids: list[str]) -> list[Entity]:
-    """Get an item from Wikidata."""
+def get_entities_with_file_cache(qids: list[str]) -> list[Entity]:
+    """Get items from Wikidata, cached as JSON files in CACHE_DIR."""
     items: list[Entity] = []
     missing: list[str] = []
     cache_dir = flask.current_app.config["CACHE_DIR"]
@@ -1,7 +1,7 @@
 import pytest
 from flask import Flask
 from testing.postgresql import Postgresql
-from matcher import database
+from matcher import database, osm_loader
 from matcher.place import Place  # noqa: F401
 from matcher.model import Base, Item  # noqa: F401
 
@@ -41,3 +41,63 @@ def app(request, postgresql):
     yield app
 
     ctx.pop()
+
+candidate_osm_xml = '''<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lat="51.0" lon="0.0002">
+    <tag k="amenity" v="pub"/>
+    <tag k="name" v="Red Lion"/>
+  </node>
+  <node id="2" lat="51.0" lon="0.0101"/>
+  <node id="3" lat="51.0001" lon="0.0101"/>
+  <node id="4" lat="51.0001" lon="0.0102"/>
+  <node id="5" lat="51.0" lon="0.0102"/>
+  <node id="6" lat="51.0" lon="0.0004">
+    <tag k="amenity" v="pub"/>
+    <tag k="name" v="Black Horse"/>
+  </node>
+  <way id="10">
+    <nd ref="2"/><nd ref="3"/><nd ref="4"/><nd ref="5"/><nd ref="2"/>
+    <tag k="amenity" v="cafe"/>
+    <tag k="building" v="yes"/>
+    <tag k="name" v="Blue Cafe"/>
+  </way>
+</osm>
+'''
+
+
+def label_entity(label):
+    return {'labels': {'en': {'language': 'en', 'value': label}},
+            'sitelinks': {}, 'claims': {}}
+
+
+@pytest.fixture(scope='session')
+def candidate_place(app, tmp_path_factory):
+    """Place with items and loaded OSM tables for candidate search tests."""
+    place = Place(place_id=3,
+                  osm_type='relation',
+                  osm_id=3,
+                  display_name='candidate test place',
+                  category='boundary',
+                  type='administrative',
+                  place_rank=16,
+                  south=50.99, west=-0.01, north=51.01, east=0.02)
+    place.items.extend([
+        Item(item_id=301, tags={'amenity=pub'}, location='Point(0.0 51.0)',
+             entity=label_entity('Red Lion')),
+        Item(item_id=302, tags={'amenity=cafe'}, location='Point(0.01 51.0)',
+             entity=label_entity('Blue Cafe')),
+        Item(item_id=303, tags={'amenity=pub'}, location='Point(0.015 51.0)',
+             entity=label_entity('White Hart')),
+    ])
+    database.session.add(place)
+    database.session.commit()
+
+    filename = tmp_path_factory.mktemp('overpass') / 'candidates.xml'
+    filename.write_text(candidate_osm_xml)
+    conn = database.session.bind.raw_connection()
+    conn.cursor().execute('create extension if not exists hstore')
+    osm_loader.load(conn, place.prefix, [str(filename)])
+    conn.close()
+
+    return place
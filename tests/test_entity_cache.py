@@ -0,0 +1,39 @@
+from matcher import entity_cache
+
+
+def entity(qid, lastrevid):
+    return {"id": qid, "lastrevid": lastrevid, "labels": {}}
+
+
+def test_current_skips_edited_and_missing(tmp_path):
+    cache = entity_cache.EntityCache(str(tmp_path / "entities.sqlite"))
+    cache.put_many([entity("Q1", 10), entity("Q2", 20), {"id": "Q3", "missing": ""}])
+
+    checked = []
+
+    def get_lastrevids(qids):
+        checked.extend(qids)
+        return {"Q1": 10, "Q2": 21}
+
+    fresh = cache.current(["Q1", "Q2", "Q3"], get_lastrevids)
+    assert fresh == {"Q1": entity("Q1", 10)}
+    assert sorted(checked) == ["Q1", "Q2"]
+    assert cache.stats == {"stored": 2, "hit": 1, "stale": 1, "miss": 1}
+    cache.close()
+
+
+def test_evict_least_recently_used(tmp_path, monkeypatch):
+    clock = iter(range(100))
+    monkeypatch.setattr(entity_cache.time, "time", lambda: next(clock))
+    cache = entity_cache.EntityCache(str(tmp_path / "entities.sqlite"), compress=False)
+    size = len(entity_cache.encode(entity("Q1", 1), compress=False)[1])
+    cache.max_bytes = int(size * 2.5)
+
+    cache.put_many([entity("Q1", 1)])
+    cache.put_many([entity("Q2", 1)])
+    cache.get_many(["Q1"])
+    cache.put_many([entity("Q3", 1)])
+
+    assert set(cache.lastrevids(["Q1", "Q2", "Q3"])) == {"Q1", "Q3"}
+    assert cache.stats["evicted"] == 1
+    cache.close()
@@ -1,3 +1,7 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import requests
 import pytest
 
@@ -33,7 +37,7 @@ def test_wikidata_chunk_splitting_is_bounded(monkeypatch):
     response.url = "https://query.wikidata.org/sparql"
 
     class TimeoutPlace:
-        def bbox_wikidata_items(self, bbox, want_isa):
+        def query_bbox_items(self, bbox, want_isa):
             raise wikidata_api.QueryTimeout("query", response)
 
     job = MatcherJob("relation", 1)
@@ -44,3 +48,156 @@ def test_wikidata_chunk_splitting_is_bounded(monkeypatch):
 
     with pytest.raises(wikidata_api.QueryServiceUnavailable):
         job.wikidata_chunked([(1, 2, 3, 4)])
+
+
+def test_wikidata_chunks_split_and_retry_in_parallel(monkeypatch):
+    timeout = requests.Response()
+    timeout.status_code = 500
+    rate_limited = requests.Response()
+    rate_limited.status_code = 429
+    rate_limited.headers["Retry-After"] = "0"
+
+    lock = threading.Lock()
+    calls = []
+
+    class ChunkPlace:
+        def query_bbox_items(self, bbox, want_isa):
+            with lock:
+                calls.append(bbox)
+                attempt = calls.count(bbox)
+            time.sleep(0.05)
+            if bbox == (0, 2, 0, 2):
+                raise wikidata_api.QueryTimeout("query", timeout)
+            if bbox == (10, 11, 10, 11) and attempt == 1:
+                raise wikidata_api.QueryRateLimited("query", rate_limited)
+            return {f"Q{bbox[0]}{bbox[2]}": {"bbox": bbox}}
+
+        def filter_bbox_items(self, items):
+            return items
+
+    sent = []
+    job = MatcherJob("relation", 1)
+    job.place = ChunkPlace()
+    job.want_isa = set()
+    job.send = lambda msg_type, **data: sent.append((msg_type, data))
+    job.status = lambda msg: None
+    monkeypatch.setitem(job_queue.app.config, "WIKIDATA_CHUNK_WORKERS", 3)
+
+    items = job.wikidata_chunked([(0, 2, 0, 2), (10, 11, 10, 11), (20, 21, 20, 21)])
+
+    assert len(items) == 6  # four parts of the split chunk and two others
+    requested = [data["chunk_num"] for msg, data in sent if msg == "wikidata_chunk"]
+    done = [data["chunk_num"] for msg, data in sent if msg == "wikidata_chunk_done"]
+    split = [data["chunk_num"] for msg, data in sent if msg == "wikidata_chunk_split"]
+    assert sorted(set(requested)) == list(range(1, 8))
+    assert len(requested) == 8  # the rate limited chunk is requested twice
+    assert sorted(done) == [num for num in range(1, 8) if num not in split]
+    assert len(split) == 1
+
+
+OVERPASS_STATUS = """Connected as: 1
+Current time: 2024-01-01T00:00:00Z
+Rate limit: 4
+4 slots available now.
+Currently running queries (pid, space limit, time limit, start time):
+"""
+
+
+class StandInOverpass(BaseHTTPRequestHandler):
+    """Local stand-in for the Overpass API, each query takes 0.2 seconds."""
+
+    def do_GET(self):
+        self.reply(OVERPASS_STATUS.encode("utf-8"))
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(0.2)
+        self.reply(b"<osm>" + b" " * 5000 + b"</osm>")
+
+    def reply(self, body):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_overpass_request_downloads_chunks_in_parallel(monkeypatch, tmp_path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInOverpass)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setitem(job_queue.app.config, "OVERPASS_URL", url)
+    monkeypatch.setattr(job_queue.space_alert, "check_free_space", lambda config: None)
+
+    def run(workers):
+        overpass_dir = tmp_path / str(workers)
+        overpass_dir.mkdir()
+        monkeypatch.setitem(job_queue.app.config, "OVERPASS_DIR", str(overpass_dir))
+        monkeypatch.setitem(job_queue.app.config, "OVERPASS_WORKERS", workers)
+        chunks = [
+            {"filename": f"{num}.xml", "num": num, "oql": "[out:xml];out;"}
+            for num in range(16)
+        ]
+        sent = []
+        job = MatcherJob("relation", 1)
+        job.place = object()
+        job.send = lambda msg_type, **data: sent.append((msg_type, data))
+        t0 = time.time()
+        assert job.overpass_request(chunks)
+        seconds = time.time() - t0
+        assert len(list(overpass_dir.glob("*.xml"))) == 16
+        done = [data["chunk_num"] for msg, data in sent if msg == "chunk_done"]
+        assert sorted(done) == list(range(16))
+        assert sent[-1][0] == "overpass_done"
+        return seconds
+
+    try:
+        serial = run(1)
+        parallel = run(4)
+    finally:
+        server.shutdown()
+
+    assert parallel < serial / 2
+
+
+class PartialReply:
+    def __init__(self, body):
+        self.body = body
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start : start + chunk_size]
+
+    def close(self):
+        pass
+
+
+def test_large_chunk_ending_in_runtime_error_fails(monkeypatch, tmp_path):
+    nodes = b"".join(
+        b'<node id="%d" lat="51.0" lon="0.0"/>\n' % num for num in range(200)
+    )
+    remark = b"<remark> runtime error: Query timed out in \"query\" at line 3 </remark>"
+    body = b'<?xml version="1.0"?>\n<osm version="0.6">\n' + nodes + remark + b"</osm>"
+    assert len(body) > 2000
+
+    monkeypatch.setattr(
+        job_queue.overpass, "run_query", lambda oql, stream: PartialReply(body)
+    )
+    monkeypatch.setattr(job_queue.mail, "send_mail", lambda subject, body: None)
+    sent = []
+    job = MatcherJob("relation", 1)
+    job.send = lambda msg_type, **data: sent.append((msg_type, data))
+
+    filename = tmp_path / "0.xml"
+    assert not job.fetch_overpass_chunk("[out:xml];out;", str(filename))
+    assert not filename.exists()
+    error = next(data for msg, data in sent if msg == "error")
+    assert error["stage"] == "overpass"
+    assert "Query timed out" in error["msg"]
+
+    filename.write_bytes(body)
+    assert job_queue.error_in_overpass_chunk(str(filename))
+    filename.write_bytes(body.replace(remark, b""))
+    assert not job_queue.error_in_overpass_chunk(str(filename))
@@ -44,3 +44,68 @@ def test_run_osm2pgsql_reports_output_and_failed_stage(monkeypatch):
     error = next(message for message in messages if message["type"] == "error")
     assert error["stage"] == "matching"
     assert "malformed XML near line 42" in error["msg"]
+
+
+def test_load_chunk_creates_then_appends(monkeypatch):
+    calls = []
+    job = job_queue.MatcherJob(osm_type="relation", osm_id=176069)
+    job.send = lambda *args, **kwargs: None
+    job.overpass_chunk_error = lambda chunk: None
+    job.place = SimpleNamespace(
+        prefix="osm_test",
+        osm2pgsql_cmd=lambda filename, **kwargs: calls.append((filename, kwargs)),
+    )
+    monkeypatch.setitem(job_queue.app.config, "DB_PASS", "secret")
+    monkeypatch.setitem(job_queue.app.config, "OVERPASS_DIR", "overpass")
+    monkeypatch.setattr(
+        job_queue.subprocess,
+        "run",
+        lambda *args, **kwargs: SimpleNamespace(returncode=0, stdout=""),
+    )
+
+    for num in range(3):
+        job.load_chunk({"filename": f"{num}.xml", "num": num, "oql": "out;"})
+
+    assert [kwargs["append"] for filename, kwargs in calls] == [False, True, True]
+    assert all(kwargs["keep_middle"] for filename, kwargs in calls)
+    assert calls[0][0].endswith("0.xml")
+    assert job.loaded_chunks == 3
+
+
+def test_failed_incremental_load_drops_middle_tables(monkeypatch):
+    dropped = []
+    job = job_queue.MatcherJob(osm_type="relation", osm_id=176069)
+    job.send = lambda *args, **kwargs: None
+    job.overpass_chunk_error = lambda chunk: None
+    job.drop_middle_tables = lambda: dropped.append(True)
+    job.place = SimpleNamespace(
+        prefix="osm_test",
+        osm2pgsql_cmd=lambda filename, **kwargs: ["osm2pgsql", filename],
+    )
+
+    def overpass_request(chunks, on_chunk=None):
+        for chunk in chunks:
+            on_chunk(chunk)
+        return True
+
+    job.overpass_request = overpass_request
+    monkeypatch.setitem(job_queue.app.config, "OSM_LOADER", "osm2pgsql")
+    monkeypatch.setitem(job_queue.app.config, "OSM2PGSQL_INCREMENTAL", True)
+    monkeypatch.setitem(job_queue.app.config, "DB_PASS", "secret")
+    monkeypatch.setitem(job_queue.app.config, "OVERPASS_DIR", "overpass")
+    results = iter([0, 1])
+    monkeypatch.setattr(
+        job_queue.subprocess,
+        "run",
+        lambda *args, **kwargs: SimpleNamespace(
+            returncode=next(results),
+            stdout="",
+        ),
+    )
+
+    chunks = [{"filename": f"{num}.xml", "num": num, "oql": "out;"} for num in range(2)]
+    with pytest.raises(job_queue.MatcherJobFailed, match="exit status 1"):
+        job.download_osm_data(chunks)
+
+    assert job.loaded_chunks == 1
+    assert dropped == [True]
@@ -107,11 +107,8 @@ def test_get_queue_status_reports_jobs_ahead(monkeypatch):
     assert jobs.get_queue_status("relation", 99) is None
 
 
-def test_subscriber_application_name():
-    assert (
-        jobs.subscriber_application_name("relation", 51827)
-        == "owl_places_matcher_relation_51827"
-    )
+def test_matcher_channel():
+    assert jobs.matcher_channel("relation", 51827) == "matcher_relation_51827"
 
 
 def test_matcher_job_priority_schedules_smaller_places_first():
@@ -24,6 +24,15 @@ def test_tidy_name():
     assert match.tidy_name("four crosses, powys") == "four cros, powy"
 
 
+def test_tidy_name_repeated_token():
+    assert match.tidy_name("school no. no. 5") == "school number no. 5"
+    assert match.tidy_name("school nr nr 5") == "school number nr 5"
+    assert match.tidy_name("school no. nr 5") == "school number number 5"
+    assert match.tidy_name("the nativity of the blessed virgin mary") == (
+        "the nativity of the st mary"
+    )
+
+
 def test_drop_article():
     assert match.drop_article("the old shop") == "old shop"
 
@@ -1,17 +1,22 @@
+import json
 from matcher import matcher
 from matcher.model import Item, IsA, ItemCandidate
 import os.path
+import pytest
 
 class MockApp:
     config = {'DATA_DIR': os.path.normpath(os.path.split(__file__)[0] + '/../data')}
 
 class MockDatabase:
-    def execute(self, sql):
+    def execute(self, sql, params=None):
         pass
 
     def fetchone(self):
         pass
 
+    def fetchall(self):
+        return []
+
 entity = {
   "claims": {
     "P17": [
@@ -137,6 +142,45 @@ def test_get_pattern():
 
     matcher.get_pattern('test')
 
+def test_category_classifier():
+    cat_map = {
+        'churches': {'tags': ['amenity=place_of_worship']},
+        'church buildings': {'tags': ['building=church']},
+        'schools': {'tags': ['amenity=school'], 'exclude_cats': ['former']},
+    }
+    classifier = matcher.CategoryClassifier(cat_map)
+
+    cat = 'Church buildings in Suffolk'
+    assert classifier.category_tags(cat) == {'building=church'}
+    assert classifier.category_tags('Schools in Kent') == {'amenity=school'}
+    assert classifier.category_tags('Former schools in Kent') == frozenset()
+    assert classifier.category_tags('Preschools in Kent') == frozenset()
+    assert cat in classifier.cache
+
+    tags = matcher.categories_to_tags(['Churches in Kent', cat], cat_map)
+    assert tags == ['amenity=place_of_worship', 'building=church']
+
+def test_entity_type_registry_reloads_on_mtime_change(app, monkeypatch, tmp_path):
+    filename = tmp_path / 'entity_types.json'
+    entity_type = {'cats': ['Windmills by country'], 'tags': ['man_made=windmill'],
+                   'trim': ['mill'], 'dist': 50}
+    filename.write_text(json.dumps([entity_type]))
+    monkeypatch.setitem(app.config, 'DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(matcher, 'entity_type_registry', None)
+    monkeypatch.setattr(matcher, 'entity_type_recheck_seconds', 0)
+
+    registry = matcher.get_entity_type_registry()
+    assert matcher.get_entity_type_registry() is registry
+    assert dict(registry.cat_map) == {'windmills': entity_type}
+    assert matcher.get_max_dist_from_criteria({'man_made=windmill'}) == 50
+    assert matcher.get_ending_from_criteria({'man_made=windmill'}) == {'mill'}
+
+    entity_type['dist'] = 100
+    filename.write_text(json.dumps([entity_type]))
+    os.utime(filename, (registry.mtime + 10, registry.mtime + 10))
+    assert matcher.get_entity_type_registry() is not registry
+    assert matcher.get_max_dist_from_criteria({'man_made=windmill'}) == 100
+
 def test_get_osm_id_and_type():
     assert matcher.get_osm_id_and_type('point', 1) == ('node', 1)
     assert matcher.get_osm_id_and_type('line', 1) == ('way', 1)
@@ -168,9 +212,88 @@ def test_simplify_tags():
 def test_item_match_sql(monkeypatch):
     item = Item(entity=entity, tags=['building'])
     monkeypatch.setattr(matcher, 'current_app', MockApp)
-    sql = matcher.item_match_sql(item, 'test')
-    assert "(tags ? 'building')" in sql
+    sql, params = matcher.item_match_sql(item, 'test')
+    assert "tag_tokens && %(match_tags)s::text[]" in sql
     assert "from test_relation" in sql
+    assert params["match_tags"] == ['building']
+    assert params["max_dist"] == matcher.default_max_dist * 1000
+
+    item = Item(item_id=1, entity=entity, tags=["name=O'Neill's"])
+    sql, params = matcher.item_match_sql(item, 'test')
+    assert "O'Neill" not in sql
+    assert params["item_id"] == 1
+    assert "name=O'Neill's" in params["match_tags"]
+
+
+def test_item_match_sql_uses_tag_tokens_index(app):
+    from matcher import database, osm_loader
+
+    conn = database.session.bind.raw_connection()
+    cur = conn.cursor()
+    cur.execute('create extension if not exists hstore')
+    for table, geometry_type in osm_loader.table_geometry_type.items():
+        cur.execute(f'drop table if exists explain_{table}')
+        cur.execute(f'create table explain_{table} (osm_id int8, name text, '
+                    'tags hstore, tag_tokens text[], '
+                    f'way geometry({geometry_type}, 3857))')
+    tokens = osm_loader.tag_tokens_sql.format('tags')
+    cur.execute('insert into explain_point (osm_id, tags, way) '
+                "select n, hstore('highway', 'street_lamp'), "
+                'ST_Transform(ST_SetSRID(ST_MakePoint(0, 51), 4326), 3857) '
+                'from generate_series(1, 20000) n')
+    cur.execute("update explain_point set tags = 'amenity=>\"pub;cafe\"' "
+                'where osm_id <= 5')
+    for table in osm_loader.table_geometry_type:
+        cur.execute(f'update explain_{table} set tag_tokens = {tokens}')
+        cur.execute(f'create index explain_{table}_way_idx '
+                    f'on explain_{table} using gist (way)')
+        cur.execute(f'create index explain_{table}_tag_tokens_idx '
+                    f'on explain_{table} using gin (tag_tokens)')
+        cur.execute(f'analyze explain_{table}')
+
+    cur.execute("insert into item (item_id, location) "
+                "values (-1, 'SRID=4326;POINT(0 51)')")
+    item = Item(item_id=-1, entity=entity, tags=['amenity=cafe'])
+    sql, params = matcher.item_match_sql(item, 'explain')
+
+    cur.execute('explain ' + sql, params)
+    plan = '\n'.join(row[0] for row in cur.fetchall())
+    assert 'explain_point_tag_tokens_idx' in plan
+
+    cur.execute(sql, params)
+    assert sorted(row[1] for row in cur.fetchall()) == [1, 2, 3, 4, 5]
+
+    conn.rollback()
+    conn.close()
+
+
+def test_add_tag_tokens_to_old_place_tables(app):
+    from matcher import database, osm_loader
+
+    conn = database.session.bind.raw_connection()
+    cur = conn.cursor()
+    cur.execute('create extension if not exists hstore')
+    for table, geometry_type in osm_loader.table_geometry_type.items():
+        cur.execute(f'drop table if exists osm_old_{table}')
+        cur.execute(f'create table osm_old_{table} (osm_id int8, name text, '
+                    f'tags hstore, way geometry({geometry_type}, 3857))')
+    cur.execute("insert into osm_old_point (osm_id, tags, way) "
+                "select 1, 'amenity=>\"pub;cafe\"', "
+                'ST_Transform(ST_SetSRID(ST_MakePoint(0, 51), 4326), 3857)')
+    conn.commit()
+
+    changed = matcher.add_tag_tokens(cur, 'osm_old')
+    assert sorted(changed) == sorted(f'osm_old_{table}'
+                                     for table in osm_loader.table_geometry_type)
+    assert matcher.add_tag_tokens(cur, 'osm_old') == []
+
+    cur.execute('select tag_tokens from osm_old_point')
+    assert sorted(cur.fetchone()[0]) == ['amenity', 'amenity=cafe', 'amenity=pub']
+
+    for table in osm_loader.table_geometry_type:
+        cur.execute(f'drop table osm_old_{table}')
+    conn.commit()
+    conn.close()
 
 
 def test_prefer_stop_area_relation():
@@ -183,9 +306,13 @@ def test_prefer_stop_area_relation():
         "tags": {"public_transport": "platform"},
     }
 
+    ctx = matcher.ItemMatchContext(
+        wikidata_tags=frozenset({"public_transport=stop_area"})
+    )
+    assert matcher.prefer_stop_area_relation([platform, relation], ctx) == [relation]
     assert matcher.prefer_stop_area_relation(
-        [platform, relation], {"public_transport=stop_area"}
-    ) == [relation]
+        [platform, relation], matcher.ItemMatchContext()
+    ) == [platform, relation]
 
 
 def test_tram_stop_extra_tags_are_not_truncated():
@@ -226,7 +353,7 @@ def test_extra_tag_key_and_tag_prefixes_are_removed():
 
 
 def find_item_matches(monkeypatch, osm_tags, item):
-    def mock_run_sql(cur, sql, debug):
+    def mock_run_sql(cur, sql, params=None, debug=False):
         if not sql.startswith('select * from'):
             return []
         return [('node', 1, None, osm_tags, 0)]
@@ -298,7 +425,7 @@ def test_station_shouldnt_match_distant_house(monkeypatch):
         tags=['railway=station', 'building=train_station', 'building'],
     )
 
-    def mock_run_sql(cur, sql, debug):
+    def mock_run_sql(cur, sql, params=None, debug=False):
         if not sql.startswith('select * from'):
             return []
         return [('polygon', 566746255, None, osm_tags, 349.9)]
@@ -331,7 +458,7 @@ def test_church_is_not_school(monkeypatch):
         'denomination': 'catholic',
     }
 
-    def mock_run_sql(cur, sql, debug):
+    def mock_run_sql(cur, sql, params=None, debug=False):
         if not sql.startswith('select * from'):
             return []
         return [('polygon', 1, None, osm_tags, 0)]
@@ -392,7 +519,7 @@ def test_match_operator_at_start_of_name(monkeypatch):
     tags = ['highway=services']
     item = Item(entity=test_entity, tags=tags)
 
-    def mock_run_sql(cur, sql, debug):
+    def mock_run_sql(cur, sql, params=None, debug=False):
         if not sql.startswith('select * from'):
             return []
         return [('polygon', 64002602, None, osm_tags, 0)]
@@ -438,7 +565,7 @@ def test_find_item_matches_parking(monkeypatch):
     tags = ['amenity=arts_centre', 'building']
     item = Item(entity=test_entity, tags=tags)
 
-    def mock_run_sql(cur, sql, debug):
+    def mock_run_sql(cur, sql, params=None, debug=False):
         if not sql.startswith('select * from'):
             return []
         return [('polygon', 116620439, None, osm_tags, 253.7)]
@@ -499,7 +626,7 @@ def test_embassy_no_match(monkeypatch):
     tags = ['amenity=embassy']
     item = Item(entity=test_entity, tags=tags, extract=extract)
 
-    def mock_run_sql(cur, sql, debug):
+    def mock_run_sql(cur, sql, params=None, debug=False):
         if not sql.startswith('select * from'):
             return []
         return [('point', 1, None, osm_tags1, 0),
@@ -529,7 +656,7 @@ def test_find_item_matches_pub(monkeypatch):
     tags = ['building', 'amenity=pub']
     item = Item(entity=test_entity, tags=tags)
 
-    def mock_run_sql(cur, sql, debug):
+    def mock_run_sql(cur, sql, params=None, debug=False):
         return [('polygon', -295355, None, osm_tags, 12.75)]
 
     monkeypatch.setattr(matcher, 'run_sql', mock_run_sql)
@@ -550,7 +677,7 @@ def test_find_item_matches(monkeypatch):
         'addr:housenumber': '450',
     }
 
-    def mock_run_sql(cur, sql, debug):
+    def mock_run_sql(cur, sql, params=None, debug=False):
         if not sql.startswith('select * from'):
             return []
         return [('polygon', 265273006, None, osm_tags, 0.0)]
@@ -605,7 +732,7 @@ def test_name_and_location_better_than_address_and_building(monkeypatch):
     tags = ['man_made=tower', 'building=tower', 'height']
     item = Item(entity=test_entity, tags=tags, extract=extract)
 
-    def mock_run_sql(cur, sql, debug):
+    def mock_run_sql(cur, sql, params=None, debug=False):
         if sql.startswith('select * from'):
             return [('polygon', 29191381, None, hotel_tags, 0)]
         else:
@@ -650,7 +777,7 @@ def test_alcatraz_lighthouse(monkeypatch):
     tags = ['tourism=attraction', 'building', 'man_made=lighthouse']
     item = Item(entity=test_entity, tags=tags)
 
-    def mock_run_sql(cur, sql, debug):
+    def mock_run_sql(cur, sql, params=None, debug=False):
         if not sql.startswith('select * from'):
             return []
         return [
@@ -710,7 +837,7 @@ def test_filter_distant():
 
 def test_bad_building_match():
 
-    item = Item()
+    item = matcher.ItemMatchContext()
 
     assert not matcher.bad_building_match({}, {}, item)
 
@@ -805,7 +932,7 @@ def test_cottage_church_bad_match(monkeypatch):
     tags = ['building', 'building=yes']
     item = Item(entity=entity, tags=tags, isa=[isa])
 
-    def mock_run_sql(cur, sql, debug):
+    def mock_run_sql(cur, sql, params=None, debug=False):
         if not sql.startswith('select * from'):
             return []
         return [
@@ -841,7 +968,7 @@ def test_lifeboat_station_church_bad_match(monkeypatch):
             'emergency=lifeboat_station']
     item = Item(entity=entity, tags=tags)
 
-    def mock_run_sql(cur, sql, debug):
+    def mock_run_sql(cur, sql, params=None, debug=False):
         if not sql.startswith('select * from'):
             return []
         return [
@@ -876,7 +1003,7 @@ def test_castle_station_bad_match(monkeypatch):
     tags = ['historic=castle', 'building']
     item = Item(entity=entity, tags=tags)
 
-    def mock_run_sql(cur, sql, debug):
+    def mock_run_sql(cur, sql, params=None, debug=False):
         if not sql.startswith('select * from'):
             return []
         return [
@@ -917,7 +1044,7 @@ def test_art_space_address_shouldnt_match_train_station(monkeypatch):
         extract='The art space is at Schwarzwaldallee 200, 4058 Basel.',
     )
 
-    def mock_run_sql(cur, sql, debug):
+    def mock_run_sql(cur, sql, params=None, debug=False):
         if not sql.startswith('select * from'):
             return []
         return [
@@ -970,7 +1097,7 @@ def test_church_pub_bad_match(monkeypatch):
         return ['West Sussex']
     monkeypatch.setattr(item, 'place_names', place_names)
 
-    def mock_run_sql(cur, sql, debug):
+    def mock_run_sql(cur, sql, params=None, debug=False):
         if not sql.startswith('select * from'):
             return []
         return [
@@ -1025,7 +1152,7 @@ def test_railway_station_cafe_bad_match(monkeypatch):
     tags = ['building=train_station', 'railway=station', 'railway=halt']
     item = Item(entity=entity, tags=tags)
 
-    def mock_run_sql(cur, sql, debug):
+    def mock_run_sql(cur, sql, params=None, debug=False):
         if not sql.startswith('select * from'):
             return []
         return [
@@ -1063,7 +1190,7 @@ def test_prefer_tag_match_over_building_only_match(monkeypatch):
     tags = ['building=train_station', 'railway=station', 'building']
     item = Item(entity=entity, tags=tags)
 
-    def mock_run_sql(cur, sql, debug):
+    def mock_run_sql(cur, sql, params=None, debug=False):
         if not sql.startswith('select * from'):
             return []
         return [
@@ -1327,3 +1454,237 @@ def test_school_shouldnt_match_church(monkeypatch):
 
     ret = matcher.check_item_candidate(candidate)
     assert 'reject' in ret
+
+
+def test_bulk_match_tags():
+    tags = {'building', 'amenity=place_of_worship', 'historic=wayside_cross'}
+    assert matcher.bulk_match_tags(tags) == [
+        'amenity=place_of_worship',
+        'amenity=place of worship',
+        'building',
+        'historic=wayside_cross',
+        'historic=wayside cross',
+    ]
+
+
+def test_bulk_match_sql():
+    sql = matcher.bulk_match_sql('test')
+    assert "from unnest($1, $2) as v(item_id, max_dist)" in sql
+    assert "from test_relation" in sql
+    assert "join item on item.item_id = v.item_id" in sql
+    assert sql.count('ST_Transform') == 1
+
+
+def test_prepare_once_per_session():
+    class Cursor:
+        """Keeps the prepared statement names like a database session."""
+
+        def __init__(self):
+            self.prepared = set()
+            self.sql = []
+
+        def execute(self, sql, params=None):
+            if sql.startswith('select name from pg_prepared_statements'):
+                self.rows = [(n,) for n in self.prepared if n.startswith(params[0])]
+                return
+            self.sql.append(sql)
+            command, name = sql.split()[:2]
+            if command == 'prepare':
+                self.prepared.add(name)
+            else:
+                self.prepared.discard(name)
+
+        def fetchall(self):
+            return self.rows
+
+    cur = Cursor()
+    first = matcher.prepare(cur, 'test_candidates', 'select $1', ['int[]'])
+    assert first == matcher.statement_name('test_candidates', 'select $1')
+    assert matcher.prepare(cur, 'test_candidates', 'select $1', ['int[]']) == first
+    assert cur.sql == [f'prepare {first} (int[]) as select $1']
+
+    second = matcher.prepare(cur, 'test_candidates', 'select $1 || 1', ['int[]'])
+    assert second != first and second.startswith('test_candidates_')
+    assert cur.sql[1:] == [
+        f'deallocate {first}',
+        f'prepare {second} (int[]) as select $1 || 1',
+    ]
+
+    cur.prepared.clear()  # session reset
+    matcher.prepare(cur, 'test_candidates', 'select $1 || 1', ['int[]'])
+    assert cur.sql[-1] == f'prepare {second} (int[]) as select $1 || 1'
+
+
+def test_find_candidate_rows_prepares_one_statement(candidate_place):
+    from matcher import database, osm_loader
+
+    items = candidate_place.items.order_by(Item.item_id).all()
+    conn = database.session.bind.raw_connection()
+    cur = conn.cursor()
+    for table in osm_loader.table_geometry_type:
+        cur.execute(f'drop table if exists osm_copy_{table}')
+        cur.execute(f'create table osm_copy_{table} as '
+                    f'select * from {candidate_place.prefix}_{table}')
+
+    rows = matcher.find_candidate_rows(cur, items, candidate_place.prefix)
+    assert matcher.find_candidate_rows(cur, items, candidate_place.prefix) == rows
+    assert matcher.find_candidate_rows(cur, items, 'osm_copy') == rows
+    assert [row[1] for row in rows[301]][:2] == [1, 6]  # nearest pub first
+
+    cur.execute('select name from pg_prepared_statements')
+    name = matcher.statement_name(
+        matcher.bulk_match_statement, matcher.bulk_match_sql('osm_copy')
+    )
+    assert [row[0] for row in cur.fetchall()] == [name]
+
+    conn.rollback()
+    conn.close()
+
+
+def test_find_candidate_rows_matches_per_item_queries(candidate_place):
+    from matcher import database
+
+    items = candidate_place.items.order_by(Item.item_id).all()
+    prefix = candidate_place.prefix
+    conn = database.session.bind.raw_connection()
+    cur = conn.cursor()
+
+    def row_key(row):
+        return (row[0], row[1], row[4])
+
+    rows = matcher.find_candidate_rows(cur, items, prefix)
+    assert rows.keys() == {item.item_id for item in items}
+    for item in items:
+        ignore_tags = {"building"} if item.is_a_historic_district() else set()
+        query = matcher.item_match_sql(item, prefix, ignore_tags=ignore_tags)
+        tag_rows = matcher.run_sql(cur, *query) if query else []
+        nearby = matcher.run_sql(cur, *matcher.nearby_nodes_sql(item, prefix))
+        expect = tag_rows + nearby
+
+        assert rows[item.item_id][: len(tag_rows)] == tag_rows
+        assert sorted(rows[item.item_id], key=row_key) == sorted(expect, key=row_key)
+
+    assert rows[301] and rows[302]
+
+    conn.rollback()
+    conn.close()
+
+
+def test_find_item_matches_with_rows(monkeypatch):
+    osm_tags = {
+        'landuse': 'retail',
+        'name': 'Oxmoor Mall',
+    }
+
+    test_entity = {
+        'claims': {},
+        'labels': {
+            'en': {'language': 'en', 'value': 'Oxmoor Center'},
+        },
+        'sitelinks': {
+            'enwiki': {
+                'site': 'enwiki',
+                'title': 'Oxmoor Center',
+            }
+        },
+    }
+
+    def mock_run_sql(cur, sql, params=None, debug=False):
+        raise AssertionError('candidate rows should not be queried')
+
+    monkeypatch.setattr(matcher, 'run_sql', mock_run_sql)
+    monkeypatch.setattr(matcher, 'current_app', MockApp)
+
+    item = Item(entity=test_entity, tags=['landuse=retail'])
+    rows = [('point', 1, None, osm_tags, 0)]
+    candidates = matcher.find_item_matches(MockDatabase(), item, 'prefix', rows=rows)
+    assert len(candidates) == 1
+
+
+def test_item_match_context():
+    entity = {
+        "claims": {
+            "P31": [{"mainsnak": {"datavalue": {"value": {"id": "Q5084"}}}}],
+            "P137": [{"mainsnak": {"datavalue": {"value": {"id": "Q145"}}}}],
+        },
+        "labels": {"en": {"language": "en", "value": "Test Cricket Ground"}},
+        "sitelinks": {},
+    }
+    item = Item(
+        item_id=1,
+        entity=entity,
+        categories=["Cities in Test"],
+    )
+    item.tags.add("shop=books")
+
+    ctx = matcher.ItemMatchContext.from_item(item)
+    assert ctx.tags == {"shop=books"}
+    assert ctx.instanceof == {"Q5084"}
+    assert ctx.operator_countries == {"Q145"}
+    assert ctx.is_hamlet and ctx.is_city and ctx.is_cricket_ground
+    assert ctx.has_shop_tag and not ctx.has_railway_tag
+    assert "house" not in ctx.endings and "street" not in ctx.endings
+
+    with pytest.raises(AttributeError):
+        ctx.is_hamlet = False  # type: ignore
+
+
+def test_check_item_candidate_endings(monkeypatch):
+    monkeypatch.setattr(
+        matcher, "get_ending_from_criteria", lambda tags: {"house", "street"}
+    )
+    used = []
+
+    def check_for_match(osm_tags, names, endings, **kwargs):
+        used.append(endings)
+
+    monkeypatch.setattr(matcher.match, "check_for_match", check_for_match)
+    entity = {
+        "claims": {
+            "P31": [{"mainsnak": {"datavalue": {"value": {"id": "Q5084"}}}}],
+        },
+        "labels": {"en": {"language": "en", "value": "Test Street"}},
+        "sitelinks": {},
+    }
+    item = Item(item_id=1, entity=entity)
+    candidate = ItemCandidate(item=item, tags={"name": "Test"}, dist=0)
+
+    ctx = matcher.ItemMatchContext.from_item(item)
+    assert ctx.endings == set()  # no street, and no house for a hamlet
+    assert ctx.criteria_endings == {"house", "street"}
+
+    assert matcher.check_item_candidate(candidate)["reject"] == "no match"
+    assert used == [{"street"}]
+
+
+def test_load_candidate_geoms():
+    class MockCursor:
+        def execute(self, sql, params=None):
+            self.sql, self.params = sql, params
+
+        def fetchall(self):
+            return [("polygon", 2, "POLYGON((0 0,0 1,1 1,0 0))")]
+
+    candidates = [
+        {"planet_table": "point", "src_id": 1},
+        {"planet_table": "polygon", "src_id": 2},
+        {"planet_table": "point", "src_id": 3},
+    ]
+    cur = MockCursor()
+    matcher.load_candidate_geoms(cur, "test", candidates, "simplified")
+    assert cur.sql.count(" union all ") == 1
+    assert "ST_SimplifyPreserveTopology" in cur.sql
+    assert cur.params == [[1, 3], [2]]
+    assert [c["geom"] for c in candidates] == [
+        None,
+        "POLYGON((0 0,0 1,1 1,0 0))",
+        None,
+    ]
+
+
+def test_candidate_geom_expr():
+    assert matcher.candidate_geom_expr() == "ST_AsText(ST_Transform(way, 4326))"
+    assert "ST_Envelope" in matcher.candidate_geom_expr("centroid_bbox")
+
+    with pytest.raises(ValueError, match="centroid_bbox"):
+        matcher.candidate_geom_expr("centroid")
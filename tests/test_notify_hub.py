@@ -0,0 +1,194 @@
+"""Tests for the shared LISTEN connection used by the matcher websockets."""
+
+from types import SimpleNamespace
+
+import psycopg2
+import pytest
+
+from matcher import notify_hub
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, statement, params=None):
+        self.conn.statements.append(str(statement))
+        if params:
+            self.conn.params.append(params)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.statements = []
+        self.params = []
+        self.notifies = []
+        self.error = None
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def poll(self):
+        if self.error:
+            raise self.error
+
+    def close(self):
+        self.closed = True
+
+
+def listens(conn):
+    return [s for s in conn.statements if "LISTEN" in s]
+
+
+def make_hub(monkeypatch, refresh_jobs=None, connections=None):
+    if connections is None:
+        connections = []
+
+    def connect(*args, **kwargs):
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    monkeypatch.setattr(notify_hub.psycopg2, "connect", connect)
+    monkeypatch.setattr(
+        notify_hub.select, "select", lambda r, w, x, timeout: (r, [], [])
+    )
+    hub = notify_hub.NotifyHub("postgresql:///test", refresh_jobs)
+    monkeypatch.setattr(hub, "start", lambda: None)
+    hub.subscribe("matcher_relation_0").close()
+    return hub, connections[0]
+
+
+def test_one_listen_per_channel_shared_by_subscribers(monkeypatch):
+    hub, conn = make_hub(monkeypatch)
+
+    conn.statements.clear()
+    first = hub.subscribe("matcher_relation_1")
+    second = hub.subscribe("matcher_relation_1")
+    other = hub.subscribe("matcher_relation_2")
+    assert len(listens(conn)) == 2
+    assert hub.subscriber_count("matcher_relation_1") == 2
+
+    conn.notifies += [
+        SimpleNamespace(channel="matcher_relation_1", payload='{"type": "msg"}'),
+        SimpleNamespace(channel="matcher_relation_3", payload='{"type": "msg"}'),
+    ]
+    hub.dispatch()
+    assert first.get(timeout=0) == second.get(timeout=0) == '{"type": "msg"}'
+    assert other.get(timeout=0) is None
+
+    first.close()
+    assert len(listens(conn)) == 2
+    second.close()
+    other.close()
+    assert len(listens(conn)) == 4
+    assert hub.subscriber_count("matcher_relation_1") == 0
+
+
+def test_queue_snapshot_refreshed_only_while_subscribed(monkeypatch):
+    calls = []
+
+    def refresh_jobs():
+        calls.append(1)
+        return [
+            {"osm_type": "relation", "osm_id": 10, "status": "doing"},
+            {"osm_type": "relation", "osm_id": 20, "status": "todo"},
+        ]
+
+    hub, conn = make_hub(monkeypatch, refresh_jobs)
+    hub.refresh_queue_status()
+    assert not calls
+
+    with hub.subscribe("matcher_relation_20"):
+        hub.refresh_queue_status()
+        hub.refresh_queue_status()
+    assert len(calls) == 1
+    assert hub.get_queue_status("relation", 20) == {"status": "todo", "jobs_ahead": 1}
+    assert hub.get_queue_status("relation", 99) is None
+
+
+def test_reconnect_relistens_and_flags_missed_notifications(monkeypatch):
+    connections = []
+    hub, first_conn = make_hub(monkeypatch, connections=connections)
+    subscription = hub.subscribe("matcher_relation_1")
+    assert not subscription.take_missed()
+
+    first_conn.error = psycopg2.OperationalError("server closed the connection")
+    with pytest.raises(psycopg2.OperationalError):
+        hub.wait()
+    assert first_conn.closed and hub.conn is None
+
+    hub.wait()
+    assert len(connections) == 2
+    second_conn = connections[1]
+    assert listens(second_conn) == [second_conn.statements[0]]
+    assert "matcher_relation_1" in second_conn.statements[0]
+    assert second_conn.params == [["matcher_relation_1", subscription.lock_id]]
+    assert subscription.take_missed()
+    assert not subscription.take_missed()
+
+    second_conn.notifies.append(
+        SimpleNamespace(channel="matcher_relation_1", payload='{"type": "done"}')
+    )
+    hub.wait()
+    assert subscription.get(timeout=0) == '{"type": "done"}'
+
+
+def test_wait_keeps_connection_opened_by_subscribe(monkeypatch):
+    connections = []
+    hub, first_conn = make_hub(monkeypatch, connections=connections)
+    first_conn.closed = True
+
+    hub.subscribe("matcher_relation_1")
+    assert len(connections) == 2
+    hub.wait()
+    assert len(connections) == 2
+    assert hub.conn is connections[1] and not connections[1].closed
+
+
+def test_idle_hub_waits_instead_of_spinning(monkeypatch):
+    timeouts = []
+
+    def select(r, w, x, timeout):
+        timeouts.append(timeout)
+        return [], [], []
+
+    hub, conn = make_hub(monkeypatch, refresh_jobs=lambda: [])
+    monkeypatch.setattr(notify_hub.select, "select", select)
+    hub.queue_status_at = 0.0
+
+    hub.wait()
+    hub.wait()
+    assert timeouts == [notify_hub.queue_status_interval] * 2
+
+    with hub.subscribe("matcher_relation_1"):
+        hub.wait()
+        hub.wait()
+    assert timeouts[2] == 0.0
+    assert 0.0 < timeouts[3] <= notify_hub.queue_status_interval
+
+
+def test_each_subscription_holds_an_advisory_lock(monkeypatch):
+    hub, conn = make_hub(monkeypatch)
+    conn.params.clear()
+
+    first = hub.subscribe("matcher_relation_1")
+    second = hub.subscribe("matcher_relation_1")
+    assert first.lock_id != second.lock_id
+    assert conn.params == [
+        ["matcher_relation_1", first.lock_id],
+        ["matcher_relation_1", second.lock_id],
+    ]
+    lock = conn.statements[-1]
+    assert "pg_advisory_lock_shared" in lock
+
+    first.close()
+    first.close()
+    assert "pg_advisory_unlock_shared" in conn.statements[-1]
+    assert conn.params[2:] == [["matcher_relation_1", first.lock_id]]
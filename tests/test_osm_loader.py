@@ -0,0 +1,180 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from matcher import osm_loader
+
+osm_xml = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lat="51.0" lon="0.0">
+    <tag k="amenity" v="pub"/>
+    <tag k="name" v="The &quot;Bell&quot;"/>
+  </node>
+  <node id="2" lat="51.0" lon="0.1"/>
+  <node id="3" lat="51.1" lon="0.1"/>
+  <node id="4" lat="51.1" lon="0.0"/>
+  <way id="10">
+    <nd ref="1"/><nd ref="2"/><nd ref="3"/><nd ref="4"/><nd ref="1"/>
+    <tag k="building" v="yes"/>
+  </way>
+  <way id="11">
+    <nd ref="1"/><nd ref="2"/><nd ref="2"/>
+    <tag k="highway" v="footway"/>
+  </way>
+  <way id="12">
+    <nd ref="1"/><nd ref="2"/><nd ref="3"/><nd ref="4"/><nd ref="1"/>
+  </way>
+  <relation id="20">
+    <member type="way" ref="12" role="outer"/>
+    <tag k="type" v="multipolygon"/>
+    <tag k="landuse" v="grass"/>
+  </relation>
+  <relation id="21">
+    <member type="node" ref="3" role="stop"/>
+    <tag k="type" v="route"/>
+  </relation>
+</osm>
+"""
+
+
+def test_hstore_literal():
+    tags = {"name": 'The "Bell"', "note": "a\\b"}
+    assert osm_loader.hstore_literal(tags) == (
+        '"name"=>"The \\"Bell\\"", "note"=>"a\\\\b"'
+    )
+
+
+def test_copy_line():
+    line = osm_loader.copy_line([1, None, True, "a\tb\\c"])
+    assert line == "1\t\\N\tt\ta\\tb\\\\c\n"
+
+
+def test_parse_rows(tmp_path):
+    filename = tmp_path / "chunk.xml"
+    filename.write_text(osm_xml)
+
+    data = osm_loader.OsmData()
+    data.parse(str(filename))
+    data.parse(str(filename))  # objects in more than one chunk are kept once
+
+    points = list(data.point_rows())
+    assert len(points) == 1
+    assert points[0][:2] == (1, 'The "Bell"')
+    assert points[0][3] == "POINT(0.0 51.0)"
+
+    ways = {row[0]: row for row in data.way_rows()}
+    assert set(ways) == {10, 11}  # untagged way 12 is only a relation member
+    assert ways[10][3] is True
+    assert ways[11][3] is False
+    assert ways[11][4] == "LINESTRING(0.0 51.0,0.1 51.0)"
+
+    relations = {row[0]: row for row in data.relation_rows()}
+    assert relations[20][3].startswith("MULTILINESTRING((0.0 51.0,")
+    assert relations[21][3] is None
+    assert relations[21][4] == "GEOMETRYCOLLECTION(POINT(0.1 51.1))"
+
+
+def test_way_missing_closing_node_is_a_line(tmp_path):
+    filename = tmp_path / "chunk.xml"
+    filename.write_text(
+        osm_xml.replace(
+            "  <relation id=\"20\">",
+            "  <way id=\"13\">\n"
+            "    <nd ref=\"9\"/><nd ref=\"1\"/><nd ref=\"2\"/><nd ref=\"3\"/>"
+            "<nd ref=\"4\"/><nd ref=\"9\"/>\n"
+            "    <tag k=\"building\" v=\"yes\"/>\n"
+            "  </way>\n"
+            "  <relation id=\"20\">",
+        )
+    )
+
+    data = osm_loader.OsmData()
+    data.parse(str(filename))
+
+    ways = {row[0]: row for row in data.way_rows()}
+    assert ways[13][3] is False  # node 9 isn't in the chunk, the ring is open
+    assert ways[13][4] == "LINESTRING(0.0 51.0,0.1 51.0,0.1 51.1,0.0 51.1)"
+
+
+def loaded_rows(cur, prefix):
+    """Rows in the place tables, for comparing two loads."""
+    found = {}
+    for table in osm_loader.table_geometry_type:
+        cur.execute(
+            f"select osm_id, name, tags::text, "
+            "array(select t from unnest(tag_tokens) t order by t), "
+            f"GeometryType(way) from {prefix}_{table} order by osm_id"
+        )
+        found[table] = cur.fetchall()
+    return found
+
+
+def geometry_differences(cur, prefix_a, prefix_b):
+    """Objects with a geometry that differs by more than a centimetre."""
+    found = []
+    for table in osm_loader.table_geometry_type:
+        cur.execute(
+            f"select a.osm_id from {prefix_a}_{table} a "
+            f"join {prefix_b}_{table} b using (osm_id) "
+            "where ST_HausdorffDistance(a.way, b.way) > 0.01"
+        )
+        found += [(table, row[0]) for row in cur.fetchall()]
+    return found
+
+
+def python_load(app, tmp_path, prefix):
+    from matcher import database
+
+    filename = tmp_path / "chunk.xml"
+    filename.write_text(osm_xml)
+    conn = database.session.bind.raw_connection()
+    conn.cursor().execute("create extension if not exists hstore")
+    counts = osm_loader.load(conn, prefix, [str(filename)])
+    return conn, counts
+
+
+def test_load_into_postgis(app, tmp_path):
+    conn, counts = python_load(app, tmp_path, "osm_pyload")
+    assert counts == {"point": 1, "line": 1, "polygon": 1, "relation": 2}
+
+    cur = conn.cursor()
+    rows = loaded_rows(cur, "osm_pyload")
+    assert rows["point"] == [
+        (1, 'The "Bell"', '"name"=>"The \\"Bell\\"", "amenity"=>"pub"',
+         ["amenity", "amenity=pub", "name", 'name=The "Bell"'], "POINT"),
+    ]
+    assert [row[::4] for row in rows["line"]] == [(11, "LINESTRING")]
+    assert [row[::4] for row in rows["polygon"]] == [(10, "POLYGON")]
+    assert [row[::4] for row in rows["relation"]] == [
+        (20, "MULTIPOLYGON"),
+        (21, "GEOMETRYCOLLECTION"),
+    ]
+    conn.close()
+
+
+@pytest.mark.skipif(not shutil.which("osm2pgsql"), reason="needs osm2pgsql")
+def test_load_matches_osm2pgsql(app, tmp_path):
+    conn, counts = python_load(app, tmp_path, "osm_pyload")
+
+    env = dict(os.environ, OWL_PLACES_OSM2PGSQL_PREFIX="osm_luaload")
+    subprocess.run(
+        [
+            "osm2pgsql",
+            "--create",
+            "--slim",
+            "--drop",
+            "--output=flex",
+            "--style=" + os.path.join("data", "matcher.lua"),
+            "--database=" + app.config["DB_URL"],
+            str(tmp_path / "chunk.xml"),
+        ],
+        env=env,
+        check=True,
+    )
+
+    cur = conn.cursor()
+    assert loaded_rows(cur, "osm_pyload") == loaded_rows(cur, "osm_luaload")
+    assert geometry_differences(cur, "osm_pyload", "osm_luaload") == []
+    conn.close()
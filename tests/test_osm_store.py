@@ -0,0 +1,95 @@
+from matcher import database, osm_loader, osm_store
+from matcher.place import Place
+
+
+class MockCursor:
+    def __init__(self):
+        self.sql = []
+
+    def execute(self, sql, params=None):
+        self.sql.append(sql)
+
+
+def test_create_place_views():
+    cur = MockCursor()
+    osm_store.create_place_views(cur, "osm_123", [(51, 51.5, 0, 0.5)])
+    assert len(cur.sql) == len(osm_store.tables)
+    assert cur.sql[0].startswith("create or replace view osm_123_point as ")
+    assert "from osm_store_point " in cur.sql[0]
+    assert "ST_MakeEnvelope(0.0, 51.0, 0.5, 51.5, 4326)" in cur.sql[0]
+
+
+def test_drop_place_views():
+    cur = MockCursor()
+    osm_store.drop_place_views(cur, "osm_123")
+    assert cur.sql == [
+        "drop view if exists osm_123_point",
+        "drop view if exists osm_123_line",
+        "drop view if exists osm_123_polygon",
+        "drop view if exists osm_123_relation",
+    ]
+
+
+store_osm_xml = """<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6">
+  <node id="1" lat="51.001" lon="0.001">
+    <tag k="amenity" v="pub"/>
+    <tag k="name" v="Inside"/>
+  </node>
+  <node id="2" lat="51.009" lon="0.009">
+    <tag k="amenity" v="pub"/>
+    <tag k="name" v="Outside the boundary, inside the chunk"/>
+  </node>
+  <node id="3" lat="51.05" lon="0.05">
+    <tag k="amenity" v="pub"/>
+    <tag k="name" v="Outside the chunk"/>
+  </node>
+</osm>
+"""
+
+# south, north, west, east
+chunk_a = (51, 51.01, 0, 0.01)
+chunk_b = (51, 51.01, 0.01, 0.02)
+
+
+def test_store_coverage_and_views(app, tmp_path):
+    # boundary is a triangle, the top right corner of chunk_a is outside it
+    place = Place(place_id=5,
+                  osm_type="relation",
+                  osm_id=5,
+                  display_name="store test place",
+                  category="boundary",
+                  type="administrative",
+                  place_rank=16,
+                  south=51, west=0, north=51.015, east=0.015,
+                  geom="SRID=4326;POLYGON((0 51, 0.015 51, 0 51.015, 0 51))")
+    database.session.add(place)
+    database.session.commit()
+
+    filename = tmp_path / "store.xml"
+    filename.write_text(store_osm_xml)
+    conn = database.session.bind.raw_connection()
+    cur = conn.cursor()
+    cur.execute("create extension if not exists hstore")
+    osm_loader.load(conn, place.prefix, [str(filename)])
+
+    chunks = [(chunk_a, ["amenity=pub"]), (chunk_b, ["amenity=cafe"])]
+    assert not osm_store.is_covered(cur, 5, chunks)
+    osm_store.save_place(cur, place.prefix, 5, chunks)
+
+    assert osm_store.is_covered(cur, 5, chunks)
+    assert osm_store.is_covered(cur, 5, [(chunk_a, ["amenity=pub"])])
+    # chunk_b was only downloaded for cafes
+    assert not osm_store.is_covered(cur, 5, [(chunk_b, ["amenity=pub"])])
+    assert not osm_store.is_covered(cur, 5, [(chunk_a, ["amenity=pub", "shop"])])
+
+    cur.execute("select count(*) from osm_store_coverage where place_id = 5")
+    assert cur.fetchone()[0] == 2
+
+    osm_store.create_place_views(cur, "osm_store_test", [chunk_a])
+    cur.execute("select osm_id from osm_store_test_point order by osm_id")
+    assert [row[0] for row in cur.fetchall()] == [1, 2]
+
+    osm_store.drop_place_views(cur, "osm_store_test")
+    conn.rollback()
+    conn.close()
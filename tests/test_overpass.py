@@ -163,3 +163,44 @@ def test_run_query_rate_limit_does_not_send_email(monkeypatch):
 
     with pytest.raises(overpass.RateLimited):
         overpass.run_query("out;")
+
+
+class StreamedResponse:
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        return iter(self.blocks)
+
+    def close(self):
+        self.closed = True
+
+
+def test_save_response_keeps_only_head_and_tail(tmp_path):
+    filename = str(tmp_path / "chunk.xml")
+    blocks = [b"<osm>", b"x" * 5000, b"<remark> runtime error: oops </remark>"]
+    r = StreamedResponse(blocks)
+
+    ends = overpass.save_response(r, filename, block_size=10)
+
+    assert r.closed
+    assert open(filename, "rb").read() == b"".join(blocks)
+    assert list(tmp_path.iterdir()) == [tmp_path / "chunk.xml"]
+    assert ends.size == sum(len(block) for block in blocks)
+    assert len(ends.head) == len(ends.tail) == overpass.error_check_bytes
+    assert ends.content is None
+    assert overpass.response_error(ends) == "runtime_error"
+
+
+def test_response_error():
+    def ends(body):
+        return overpass.ResponseEnds(body, body, len(body))
+
+    assert overpass.response_error(ends(b"<osm></osm>")) is None
+    busy = b"<!DOCTYPE html><p>The server is probably too busy</p>"
+    assert overpass.response_error(ends(busy)) == "too_busy"
+    gateway = b"<!DOCTYPE html><title>504 Gateway Time-out</title>"
+    assert overpass.response_error(ends(gateway)) == "timeout"
+    oom = b"<remark> runtime error: Query run out of memory </remark>"
+    assert overpass.response_error(ends(oom)) == "out_of_memory"
@@ -1,6 +1,14 @@
-from matcher.model import Item
-from matcher.place import Place, bbox_chunk, bbox_chunk_dimensions
-from matcher import database
+from matcher.model import Item, ItemCandidate, PlaceItem
+from matcher.place import (
+    Place,
+    WikidataDensity,
+    bbox_area_sq_km,
+    bbox_chunk,
+    bbox_chunk_dimensions,
+    candidate_row,
+    wikidata_item_tags,
+)
+from matcher import database, matcher
 
 def simple_place():
     place = Place(place_id=1,
@@ -144,3 +152,145 @@ def test_bbox_chunk_minimum_size():
 
     assert bbox_chunk_dimensions(bbox, 0) == (1, 1)
     assert bbox_chunk(bbox, 0) == [(0, 10, 0, 1)]
+
+
+def test_wikidata_item_tags(monkeypatch):
+    monkeypatch.setattr(
+        matcher, "categories_to_tags", lambda cats: ["place=village", "man_made=windmill"]
+    )
+    v = {"tags": ["place=hamlet", "highway"], "categories": ["Windmills"]}
+    assert wikidata_item_tags(v) == {"place=hamlet", "place=village"}
+
+    v = {"tags": ["historic"], "categories": ["Windmills"]}
+    assert wikidata_item_tags(v) == {"historic", "place=village", "man_made=windmill"}
+
+    assert wikidata_item_tags({"tags": ["amenity", "building"]}) == {"building"}
+
+
+def test_candidate_row():
+    candidate = {
+        "osm_type": "way",
+        "osm_id": 10,
+        "name": "Test",
+        "matching_tags": {"amenity=pub"},
+    }
+    row = candidate_row(5, candidate)
+    assert row == {"item_id": 5, "osm_type": "way", "osm_id": 10, "name": "Test"}
+
+
+def test_bbox_area_sq_km():
+    assert round(bbox_area_sq_km((0, 1, 0, 1))) == 12392
+    assert round(bbox_area_sq_km((60, 61, 0, 1))) == 6102
+
+
+def test_wikidata_chunk_side_from_density():
+    place = simple_place()
+    assert place.wikidata_chunk_side(22, None) == 22
+
+    dense = WikidataDensity(items_per_sq_km=60, timeout_area=None)
+    assert place.wikidata_chunk_side(22, dense) == 5
+
+    timed_out = WikidataDensity(items_per_sq_km=None, timeout_area=100)
+    assert place.wikidata_chunk_side(22, timed_out) == 5
+
+    sparse = WikidataDensity(items_per_sq_km=0.01, timeout_area=None)
+    assert place.wikidata_chunk_side(22, sparse) == 88
+
+
+def test_wikidata_chunk_size_skips_doomed_unchunked_query():
+    place = simple_place()
+    place.area = 500 * 1000 * 1000
+    assert place.wikidata_chunk_size() == 1
+
+    dense = WikidataDensity(items_per_sq_km=60, timeout_area=None)
+    assert place.wikidata_chunk_size(size=5, density=dense) == 5
+
+    timed_out = WikidataDensity(items_per_sq_km=None, timeout_area=400)
+    assert place.wikidata_chunk_size(size=10, density=timed_out) == 3
+
+
+def test_chunk_cells_uses_one_query(monkeypatch):
+    calls = []
+
+    def execute(sql, params):
+        calls.append(params)
+        return [(1, '{"a": 1}'), (3, '{"c": 3}')]
+
+    monkeypatch.setattr("matcher.place.session.execute", execute, raising=False)
+    place = simple_place()
+    bboxes = [(0, 1, 0, 1), (0, 1, 1, 2), (1, 2, 0, 1)]
+
+    assert place.chunk_cells(bboxes, clip=True) == [
+        ((0, 1, 0, 1), '{"a": 1}'),
+        ((1, 2, 0, 1), '{"c": 3}'),
+    ]
+    assert len(calls) == 1
+    assert calls[0]["south"] == [0, 0, 1]
+    assert calls[0]["east"] == [1, 2, 1]
+    assert place.chunk_cells([]) == []
+    assert len(calls) == 1
+
+
+def test_chunk_tags_derives_item_tags_once(monkeypatch):
+    place = simple_place()
+    calls = []
+
+    def item_overpass_tags():
+        calls.append(1)
+        return {1: {"amenity=school"}, 2: {"tourism=museum", "building"}}
+
+    monkeypatch.setattr(place, "item_overpass_tags", item_overpass_tags)
+    monkeypatch.setattr(place, "chunk_item_ids", lambda chunks: [{1}, {1, 2}, set()])
+
+    chunk_tags = place.chunk_tags([(0, 1, 0, 1)] * 3, skip={"building"})
+    assert chunk_tags == [
+        {"amenity=school"},
+        {"amenity=school", "tourism=museum"},
+        set(),
+    ]
+    assert len(calls) == 1
+    assert place.oql_for_chunk((0, 1, 0, 1), tags=set()) is None
+
+
+def test_chunk_item_ids_finds_place_items(app):
+    place = simple_place()
+    place.place_id = place.osm_id = 2
+    items = [
+        Item(item_id=201, tags={'amenity=school'}, location='Point(0.5 0.5)'),
+        Item(item_id=202, tags={'tourism=museum'}, location='Point(1.5 0.5)'),
+    ]
+    place.items.extend(items)
+    database.session.add(place)
+    database.session.commit()
+
+    chunks = [(0, 1, 0, 1), (0, 1, 1, 2), (1, 2, 0, 1)]
+    assert place.chunk_item_ids(chunks) == [{201}, {202}, set()]
+    chunk_tags = place.chunk_tags(chunks)
+    assert 'amenity=school' in chunk_tags[0]
+    assert 'tourism=museum' in chunk_tags[1]
+    assert chunk_tags[2] == set()
+
+
+def matcher_candidates(app, place, monkeypatch, workers):
+    """Run the matcher, return the saved candidates and reset the place."""
+    monkeypatch.setitem(app.config, 'MATCHER_WORKERS', workers)
+    monkeypatch.setitem(app.config, 'MATCHER_BATCH_SIZE', 2)
+    place.run_matcher()
+
+    item_ids = [item.item_id for item in place.items]
+    q = ItemCandidate.query.filter(ItemCandidate.item_id.in_(item_ids))
+    found = sorted((c.item_id, c.osm_type, c.osm_id, c.name, round(c.dist, 1))
+                   for c in q)
+    q.delete(synchronize_session=False)
+    (PlaceItem.query.filter(PlaceItem.item_id.in_(item_ids))
+                    .update({'done': None}, synchronize_session=False))
+    database.session.commit()
+    return found
+
+
+def test_run_matcher_with_worker_processes(app, candidate_place, monkeypatch):
+    serial = matcher_candidates(app, candidate_place, monkeypatch, workers=1)
+    assert [c[:3] for c in serial] == [(301, 'node', 1), (302, 'way', 10)]
+
+    parallel = matcher_candidates(app, candidate_place, monkeypatch, workers=2)
+    assert parallel == serial
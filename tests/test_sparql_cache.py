@@ -0,0 +1,62 @@
+import os
+import time
+from datetime import timedelta
+
+import pytest
+from flask import Flask
+
+from matcher import sparql_cache
+
+
+@pytest.fixture
+def cache_app(tmp_path):
+    app = Flask("test_sparql_cache")
+    app.config["CACHE_DIR"] = str(tmp_path)
+    with app.app_context():
+        yield app
+
+
+def test_put_and_get(cache_app):
+    sparql_cache.put("default", "abc", b'{"results": {"bindings": []}}')
+    assert sparql_cache.get("default", "abc") == b'{"results": {"bindings": []}}'
+    assert sparql_cache.get("default", "missing") is None
+    filenames = os.listdir(os.path.join(sparql_cache.cache_root(), "default"))
+    assert filenames == ["abc.json.gz"]
+
+
+def test_expired(cache_app):
+    cache_app.config["SPARQL_CACHE_TTL"] = {"browse": timedelta(hours=1)}
+    sparql_cache.put("browse", "Q1_en", b"[]")
+    path = sparql_cache.entry_path("browse", "Q1_en")
+    two_hours_ago = time.time() - 7200
+    os.utime(path, (two_hours_ago, two_hours_ago))
+
+    assert sparql_cache.get("browse", "Q1_en") is None
+    assert sparql_cache.get("browse", "Q1_en", ttl=timedelta(days=1)) == b"[]"
+
+    removed = sparql_cache.prune()
+    assert [entry.key for entry in removed] == ["Q1_en"]
+    assert sparql_cache.entries() == []
+
+
+def test_prune_least_recently_used(cache_app):
+    for num, key in enumerate(["a", "b", "c"]):
+        sparql_cache.put("default", key, b"x" * 1000)
+        path = sparql_cache.entry_path("default", key)
+        accessed = time.time() - 100 + num
+        os.utime(path, (accessed, accessed))
+    sparql_cache.get("default", "a")  # now the most recently used
+
+    size = sparql_cache.entries()[0].size
+    removed = sparql_cache.prune(max_bytes=size * 2)
+    assert [entry.key for entry in removed] == ["b"]
+
+
+def test_get_entry_removed_while_reading(cache_app, monkeypatch):
+    sparql_cache.put("default", "abc", b"[]")
+
+    def utime(path, times):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(sparql_cache.os, "utime", utime)
+    assert sparql_cache.get("default", "abc") is None
@@ -2,6 +2,7 @@ import json
 
 import requests
 import pytest
+from flask import Flask
 
 from matcher import wikidata_api
 
@@ -54,3 +55,85 @@ def test_entity_iter_raises_after_rate_limit_attempts(monkeypatch):
         )
 
     assert retries == [(60, 1, 2)]
+
+
+def test_entity_iter_concurrent_yields_every_id(monkeypatch):
+    def api_call(params, session=None):
+        ids = params["ids"].split("|")
+        return response(200, entities={qid: {"id": qid} for qid in ids if qid != "Q7"})
+
+    monkeypatch.setattr(wikidata_api, "api_call", api_call)
+    monkeypatch.setattr(wikidata_api, "page_size", 3)
+
+    ids = {f"Q{num}" for num in range(1, 11)}
+    entities = dict(wikidata_api.entity_iter(ids, workers=4))
+
+    assert set(entities) == ids
+    assert entities["Q7"] == {"id": "Q7", "missing": ""}
+    assert entities["Q1"] == {"id": "Q1"}
+
+
+def test_entity_iter_reports_reply_without_entities(monkeypatch):
+    def api_call(params, session=None):
+        r = requests.Response()
+        r.status_code = 200
+        r._content = json.dumps({"error": {"code": "maxlag"}}).encode()
+        return r
+
+    sent = []
+    monkeypatch.setattr(wikidata_api, "api_call", api_call)
+    monkeypatch.setattr(wikidata_api, "page_size", 3)
+    monkeypatch.setattr(
+        wikidata_api.mail, "send_mail", lambda subject, body: sent.append(subject)
+    )
+
+    ids = {f"Q{num}" for num in range(1, 11)}
+    with pytest.raises(wikidata_api.EntityFetchError):
+        list(wikidata_api.entity_iter(ids, workers=4))
+    assert sent == ["error fetching wikidata entities"]
+
+
+@pytest.fixture
+def cache_app(tmp_path):
+    app = Flask("test_wikidata_api")
+    app.config["CACHE_DIR"] = str(tmp_path)
+    with app.app_context():
+        yield app
+
+
+def wbgetentities(calls):
+    def api_call(params, session=None):
+        calls.append(params["ids"])
+        entities = {
+            qid: {"id": qid, "missing": ""} if qid == "Q404" else {"id": qid}
+            for qid in params["ids"].split("|")
+        }
+        return response(200, entities=entities)
+
+    return api_call
+
+
+def test_entity_with_cache_uses_json_files_without_entity_cache(
+    cache_app, tmp_path, monkeypatch
+):
+    calls = []
+    monkeypatch.setattr(wikidata_api, "api_call", wbgetentities(calls))
+
+    assert wikidata_api.get_entity_with_cache("Q1") == {"id": "Q1"}
+    assert wikidata_api.get_entity_with_cache("Q1") == {"id": "Q1"}
+    assert calls == ["Q1"]
+    assert (tmp_path / "Q1.json").exists()
+
+    entities = wikidata_api.get_entities_with_cache(["Q1", "Q2"])
+    assert sorted(entity["id"] for entity in entities) == ["Q1", "Q2"]
+    assert calls == ["Q1", "Q2"]
+
+
+@pytest.mark.parametrize("entity_cache", [False, True])
+def test_entity_with_cache_returns_missing_entity(cache_app, monkeypatch, entity_cache):
+    cache_app.config["ENTITY_CACHE"] = entity_cache
+    calls = []
+    monkeypatch.setattr(wikidata_api, "api_call", wbgetentities(calls))
+
+    entity = wikidata_api.get_entity_with_cache("Q404")
+    assert entity == {"id": "Q404", "missing": ""}